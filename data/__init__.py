@@ -16,7 +16,8 @@ def open_dataset(dataset, **kwargs):
     as an attribute.
 
     Note: the returned model object will be LRU-cached internally so frequent calls
-    to open the "same" dataset will have minimal overhead.
+    to open the "same" dataset will have minimal overhead. The underlying files are
+    kept open between `with` blocks by data.dataset_pool.
 
     Params:
         * dataset -- Either a DatasetConfig object, or a string URL for the dataset
@@ -34,6 +35,8 @@ def open_dataset(dataset, **kwargs):
             that is less-than-or-equal-to the given starttime (and endtime).
         * meta_only {bool} -- Skip some dataset access operations in order to speed up
             response.
+        * access {str} -- How the data will be read (one of the data.chunking access
+            hints, e.g. AREA or POINT_SERIES), used to choose the dask chunks.
     """
 
     if not dataset:
@@ -54,6 +57,7 @@ def open_dataset(dataset, **kwargs):
         "meta_only": kwargs.get("meta_only", False),
         "grid_angle_file_url": getattr(dataset, "grid_angle_file_url", ""),
         "dataset_key": getattr(dataset, "key", ""),
+        "access": kwargs.get("access"),
     }
 
     nc_data = CalculatedData(url, **args)
@@ -0,0 +1,208 @@
+"""
+Bottom level index of model grids.
+
+Bottom maps and points used to read the whole water column of the area on
+every request and look for the deepest valid level of each cell with
+np.ma.notmasked_edges. The deepest valid level only depends on the land
+mask, so it is computed once per variable and grid (one level at a time,
+from the first time step) and kept in ``bottom_index_cache``. It is keyed by
+a fingerprint of the grid (see data.nearest_grid_point.grid_fingerprint),
+not by the version of the dataset's files, so re-indexing a dataset doesn't
+invalidate it. For sqlite-indexed datasets it is also saved next to the
+dataset's metadata catalog so that other worker processes and restarts
+reuse it, and it is computed under a lock shared by the processes of the
+host (see utils.single_flight.lock), so only one of them computes it.
+"""
+
+import os
+import threading
+
+import numpy as np
+from cachetools import LRUCache
+
+from data.catalog import CATALOG_SUFFIX, catalog_path
+from data.nearest_grid_point import grid_fingerprint
+from utils import single_flight
+from utils.atomic_file import atomic_write
+
+# Cells without any valid level (land)
+LAND = -1
+
+
+def compute_bottom_index(var, time_index: int = 0) -> np.ndarray:
+    """Returns the deepest valid level of each cell of a (time, depth, y, x)
+    variable, or LAND where every level is masked.
+
+    Arguments:
+        var -- xarray.DataArray (or CalculatedArray) with a depth dimension.
+
+    Keyword Arguments:
+        time_index {int} -- Time step the mask is read from. (default: {0})
+    """
+
+    bottom = None
+    for level in range(var.shape[1]):
+        values = np.ma.masked_invalid(np.asarray(var[time_index, level]))
+        if bottom is None:
+            bottom = np.full(values.shape, LAND, dtype=np.int16)
+        bottom[~np.ma.getmaskarray(values)] = level
+
+    bottom.setflags(write=False)  # Make immutable
+    return bottom
+
+
+def bottom_index_path(url, variable: str):
+    """Returns where the bottom index of a variable of a sqlite-indexed
+    dataset is saved (beside its catalog), or None.
+    """
+    path = catalog_path(url)
+    if path is None:
+        return None
+
+    return f"{path[:-len(CATALOG_SUFFIX)]}.bottom.{variable}.npz"
+
+
+class BottomIndexCache:
+    """LRU cache of bottom level indices, keyed by dataset, variable and
+    fingerprint of the variable's grid.
+    """
+
+    def __init__(self, maxsize: int = 32) -> None:
+        self._cache: LRUCache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.disk_hits: int = 0
+
+    def get(self, url, variable: str, var, latvar, lonvar,
+            dataset_key: str = "") -> np.ndarray:
+        """Returns the bottom level index of a variable, computing (and
+        saving) it on a miss.
+
+        Arguments:
+            url {str or list} -- URL(s) of the dataset.
+            variable {str} -- Key of the variable.
+            var -- The variable, as returned by get_dataset_variable.
+            latvar -- The latitude variable of its grid.
+            lonvar -- The longitude variable of its grid.
+
+        Keyword Arguments:
+            dataset_key {str} -- Key of the dataset. (default: {""})
+
+        Returns:
+            np.ndarray -- (y, x) array of level indices (LAND for land).
+        """
+
+        version = "%s/%s/%d" % (grid_fingerprint(latvar, lonvar, dataset_key), variable,
+                                var.shape[1])
+        key = (dataset_key, str(url), version)
+
+        with self._lock:
+            bottom = self._cache.get(key)
+            if bottom is not None:
+                self.hits += 1
+                return bottom
+            self.misses += 1
+
+        path = bottom_index_path(url, variable)
+        with single_flight.lock(single_flight.request_key('bottom', str(url), version)):
+            # Computed by another thread or process while this one waited
+            with self._lock:
+                bottom = self._cache.get(key)
+            if bottom is not None:
+                return bottom
+
+            bottom = self.__load(path, version)
+            if bottom is None:
+                bottom = compute_bottom_index(var)
+                self.__save(path, bottom, version)
+            else:
+                with self._lock:
+                    self.disk_hits += 1
+
+            with self._lock:
+                self._cache[key] = bottom
+
+        return bottom
+
+    def info(self) -> dict:
+        """Returns the hit/miss counters and current size of the cache.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'size': len(self._cache),
+                'maxsize': self._cache.maxsize,
+            }
+
+    def clear(self) -> None:
+        """Empties the in-memory cache and resets the counters.
+        Persisted files are left untouched.
+        """
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+            self.disk_hits = 0
+
+    @staticmethod
+    def __load(path, version):
+        if path is None or not os.path.isfile(path):
+            return None
+
+        try:
+            with np.load(path) as f:
+                if f['version'].tolist() != version:
+                    return None
+                bottom = f['bottom']
+        except (OSError, ValueError, KeyError):
+            return None
+
+        bottom.setflags(write=False)
+        return bottom
+
+    @staticmethod
+    def __save(path, bottom: np.ndarray, version) -> None:
+        if path is None:
+            return
+
+        try:
+            with atomic_write(path) as f:
+                np.savez(f, bottom=bottom, version=np.array(version))
+        except OSError:
+            pass
+
+
+bottom_index_cache = BottomIndexCache()
+
+
+def read_bottom(var, time, bottom: np.ndarray, y: slice, x: slice) -> np.ma.MaskedArray:
+    """Reads the values at the bottom level of each cell of an area, reading
+    only the levels between the shallowest and deepest bottom of the area.
+
+    Arguments:
+        var -- (time, depth, y, x) variable.
+        time {int, slice or list} -- Time index(es).
+        bottom {np.ndarray} -- Bottom level index of the area.
+        y {slice} -- Rows of the area.
+        x {slice} -- Columns of the area.
+
+    Returns:
+        np.ma.MaskedArray -- (y, x) values, or (time, y, x) if time is a
+            slice or list. Land is masked.
+    """
+
+    yy, xx = np.nonzero(bottom != LAND)
+    levels = bottom[yy, xx].astype(np.intp)
+
+    kmin = int(levels.min()) if levels.size else 0
+    kmax = int(levels.max()) if levels.size else 0
+    d = var[time, kmin:kmax + 1, y, x]
+    d = np.asarray(getattr(d, 'values', d))
+
+    data = np.ma.masked_all(d.shape[:-3] + bottom.shape, dtype=d.dtype)
+    data[..., yy, xx] = d[..., levels - kmin, yy, xx]
+
+    return np.ma.masked_invalid(data)
@@ -2,6 +2,7 @@ import numpy as np
 import xarray as xr
 
 import data.calculated_parser.parser
+from data.calculated_parser.chunked import evaluate_chunked
 from data.netcdf_data import NetCDFData
 from data.variable import Variable
 from data.variable_list import VariableList
@@ -59,7 +60,7 @@ class CalculatedData(NetCDFData):
                                    attrs,
                                    self.url)
         else:
-            return self.dataset.variables[key]
+            return super().get_dataset_variable(key)
 
     @property
     def variables(self):
@@ -106,26 +107,18 @@ class CalculatedArray():
         """
         self._parent = parent
         self._expression: str = expression
-        self._parser = data.calculated_parser.parser.Parser()
-        self._parser.lexer.lexer.input(expression)
+        # Compiled once per equation and shared by every CalculatedArray
+        self._compiled = data.calculated_parser.parser.compile_expression(expression)
         self._dims: list = dims
         self._attrs: dict = attrs
         self._db_url: str = db_url
         self._shape: tuple = self.__calculate_var_shape()
 
-        # This is a bit odd, but necessary. We run the expression through the
-        # lexer so that the lexer variables get populated. This way we know the
-        # list of underlying variables that are involved in the calculation
-        # before we attempt to do any calculations. This is used to provide
-        # information about the variable like shape, dimensions, etc.
-        for _ in self._parser.lexer.lexer:
-            pass
-
     def __getitem__(self, key):
         # This is where the magic happens.
 
-        data_array = self._parser.parse(
-            self._expression, self._parent, key, self._dims)
+        data_array = evaluate_chunked(self._compiled, self._parent, key,
+                                      self._dims, self._shape)
 
         return xr.DataArray(data_array)
 
@@ -0,0 +1,161 @@
+"""
+Chunked evaluation of compiled calculated-variable expressions.
+
+Evaluating an expression over a whole map area holds every temporary (and
+every full-depth block read for functions like sspeed or soniclayerdepth)
+in memory at once. When all the functions of an expression work column by
+column, the requested area is instead split along its last (x) dimension
+into chunks of at most CALCULATED_CHUNK_SIZE values, which are evaluated
+in a thread pool (NumPy releases the GIL in its ufuncs) and joined back.
+Expressions using functions that need neighbouring points (e.g. gradients)
+or reduce over the whole area (max, min) are evaluated in one piece.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import xarray as xr
+
+from utils.app_config import get_app_setting
+from utils.compute_budget import thread_budget
+
+# Functions whose result at a horizontal point only depends on the
+# arguments at that point (full-depth functions reduce along depth only)
+COLUMNWISE_FUNCTIONS = frozenset([
+    'sin', 'cos', 'tan', 'asin', 'acos', 'atan', 'atan2', 'ln', 'log', 'log2',
+    'abs', 'magnitude', 'oxygensaturation', 'nitrogensaturation', 'sspeed',
+    'density', 'heatcap', 'tempgradient', 'soniclayerdepth', 'deepsoundchannel',
+    'deepsoundchannelbottom',
+])
+
+# Number of values (including the depth levels of full-depth variables) in
+# one chunk; 2**21 float64 values is 16MB per temporary.
+DEFAULT_CHUNK_SIZE = 2 ** 21
+
+
+def is_columnwise(node) -> bool:
+    """Whether an expression tree can be evaluated in horizontal chunks."""
+    kind = node[0]
+    if kind == 'neg':
+        return is_columnwise(node[1])
+    if kind == 'binop':
+        return is_columnwise(node[2]) and is_columnwise(node[3])
+    if kind == 'call':
+        return node[1] in COLUMNWISE_FUNCTIONS and \
+            all(is_columnwise(a) for a in node[2])
+
+    return True
+
+
+def chunk_slices(s: slice, size: int, width: int) -> list:
+    """Splits slice s of an axis of the given size into slices of at most
+    width elements. Chunks are at least 2 wide so that squeezing a chunk
+    never drops the chunked axis.
+    """
+    start, stop, step = s.indices(size)
+    count = len(range(start, stop, step))
+    width = max(width, 2)
+
+    bounds = list(range(0, count, width))
+    if len(bounds) > 1 and count - bounds[-1] < 2:
+        bounds.pop()
+    bounds.append(count)
+
+    return [
+        slice(start + a * step, start + b * step, step)
+        for a, b in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def _full_key(key, ndims: int):
+    if not isinstance(key, tuple):
+        key = (key,)
+
+    return key + (slice(None),) * (ndims - len(key))
+
+
+def _full_depth_levels(expression, data) -> int:
+    levels = 1
+    for node in _nodes(expression.tree):
+        if node[0] == 'full_depth':
+            shape = data.variables[node[1]].shape
+            levels = max(levels, shape[0] if 'depth' in node[1] else shape[1])
+
+    return levels
+
+
+def _nodes(node):
+    yield node
+    if node[0] == 'neg':
+        yield from _nodes(node[1])
+    elif node[0] == 'binop':
+        yield from _nodes(node[2])
+        yield from _nodes(node[3])
+    elif node[0] == 'call':
+        for arg in node[2]:
+            yield from _nodes(arg)
+
+
+def _concatenate(results: list):
+    if all(isinstance(r, xr.Variable) for r in results):
+        return xr.Variable.concat(results, dim=results[0].dims[-1])
+
+    results = [r.values if isinstance(r, (xr.Variable, xr.DataArray)) else r
+               for r in results]
+    if any(isinstance(r, np.ma.MaskedArray) for r in results):
+        return np.ma.concatenate(results, axis=-1)
+
+    return np.concatenate(results, axis=-1)
+
+
+def evaluate_chunked(expression, data, key, dims: list, shape: tuple,
+                     chunk_size: int = None, max_workers: int = None):
+    """Evaluates a compiled expression, in horizontal chunks when possible.
+
+    Arguments:
+        expression {Expression} -- Compiled expression.
+        data -- The xarray or netcdf dataset to pull data from.
+        key -- Key passed along from __getitem__.
+        dims {list} -- Dimensions that correspond to the key.
+        shape {tuple} -- Shape of the calculated variable.
+
+    Keyword Arguments:
+        chunk_size {int} -- Maximum number of values in a chunk (default:
+            CALCULATED_CHUNK_SIZE setting).
+        max_workers {int} -- Number of threads evaluating chunks (default:
+            CALCULATED_THREADS setting, or the request's thread budget).
+
+    Returns the same result as expression.evaluate(data, key, dims).
+    """
+
+    if chunk_size is None:
+        chunk_size = get_app_setting('CALCULATED_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    if max_workers is None:
+        max_workers = get_app_setting('CALCULATED_THREADS') or thread_budget()
+
+    full_key = _full_key(key, len(dims))
+    if not chunk_size or expression.tree is None or len(full_key) != len(dims) or \
+            not all(isinstance(k, (int, np.integer, slice)) for k in full_key) or \
+            not isinstance(full_key[-1], slice) or (full_key[-1].step or 1) < 0 or \
+            not is_columnwise(expression.tree):
+        return expression.evaluate(data, key, dims)
+
+    column = _full_depth_levels(expression, data)
+    for k, size in zip(full_key[:-1], shape[:-1]):
+        if isinstance(k, slice):
+            column *= len(range(*k.indices(size)))
+
+    slices = chunk_slices(full_key[-1], shape[-1], chunk_size // max(column, 1))
+    if len(slices) < 2:
+        return expression.evaluate(data, key, dims)
+
+    keys = [full_key[:-1] + (s,) for s in slices]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(keys)))) as executor:
+        results = list(executor.map(
+            lambda k: expression.evaluate(data, k, dims), keys))
+
+    if any(np.ndim(r) == 0 for r in results):
+        # e.g. NaN for mismatched dimensions
+        return expression.evaluate(data, key, dims)
+
+    return _concatenate(results)
@@ -1,38 +1,60 @@
 #!/usr/bin/env python
 
+import operator
+import threading
+
 import numpy as np
 import ply.yacc as yacc
+from cachetools import LRUCache
 
 import data.calculated_parser.functions as functions
 import data.calculated_parser.lexer
 
-
-class Parser:
-    """The parsing portion of the domain specific language"""
-
-    def __init__(self, **kwargs):
-        self.lexer = data.calculated_parser.lexer.Lexer()
-        self.tokens = self.lexer.tokens
-
-        # Sets the operator precedence for the parser. The unary minus is the
-        # highest, followed by exponentiation, then multiplication/division and
-        # addition/subtraction is last on the list.
-        self.precedence = (
-            ('left', 'PLUS', 'MINUS'),
-            ('left', 'TIMES', 'DIVIDE'),
-            ('left', 'POWER'),
-            ('right', 'UMINUS'),
-        )
-        self.parser = yacc.yacc(module=self)
-        self.data = None
-        self.expression = None
-        self.result = np.nan
-
-    def parse(self, expression, data, key, dims):
-        """Parse the expression and return the result
+BINARY_OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '^': operator.pow,
+}
+
+
+class Expression:
+    """A compiled equation: the expression tree built by the Parser, which
+    can be evaluated for any data/key without parsing the equation again.
+
+    The tree is made of tuples (so that identical sub-expressions compare
+    and hash equal):
+        ('number', value)
+        ('variable', key)
+        ('full_depth', key)       -- [key] in the equation
+        ('neg', operand)
+        ('binop', operator, left, right)
+        ('call', function name, (arguments, ...))
+    """
+
+    def __init__(self, expression: str, tree: tuple) -> None:
+        self.expression = expression
+        self.tree = tree
+        self.variables = frozenset(self.__variables(tree))
+
+    @staticmethod
+    def __variables(node):
+        if node[0] in ('variable', 'full_depth'):
+            yield node[1]
+        elif node[0] == 'neg':
+            yield from Expression.__variables(node[1])
+        elif node[0] == 'binop':
+            yield from Expression.__variables(node[2])
+            yield from Expression.__variables(node[3])
+        elif node[0] == 'call':
+            for arg in node[2]:
+                yield from Expression.__variables(arg)
+
+    def evaluate(self, data, key, dims):
+        """Evaluate the expression and return the result
 
         Parameters:
-        expression -- the string expression to parse
         data -- the xarray or netcdf dataset to pull data from
         key -- the key passed along from the __getitem__ call, a tuple of
                integers and/or slices
@@ -40,16 +62,63 @@ class Parser:
 
         Returns a numpy array of data.
         """
+        if self.tree is None:
+            # Unknown function: the parser recovered without a result
+            return np.nan
+
+        try:
+            return Evaluator(data, key, dims).evaluate(self.tree)
+        except SyntaxError:
+            # Variable dimensions don't match the key. When this was raised
+            # inside the ply grammar actions the parser recovered and the
+            # result was NaN, so keep that behaviour.
+            return np.nan
+
+
+class Evaluator:
+    """Evaluates an expression tree against a dataset for a given key."""
+
+    def __init__(self, data, key, dims):
         self.data = data
-        self.result = np.nan  # populated by p_statement_expr()
         self.key = key
         self.dims = dims
-        self.expression = expression
-        self.parser.parse(expression)
-        self.data = None
-        self.key = None
-        self.dims = None
-        return self.result
+        # Results of the sub-expressions evaluated so far, so that repeated
+        # sub-expressions (e.g. the same sspeed(...) call twice) are only
+        # computed once.
+        self.__results = {}
+
+    def evaluate(self, node):
+        try:
+            return self.__results[node]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable node (e.g. a NaN or array constant); don't memoize
+            return self.__evaluate(node)
+
+        result = self.__evaluate(node)
+        self.__results[node] = result
+        return result
+
+    def __evaluate(self, node):
+        kind = node[0]
+        if kind == 'number':
+            return node[1]
+        if kind == 'variable':
+            variable = self.data.variables[node[1]]
+            return variable[self.get_key_for_variable(variable)]
+        if kind == 'full_depth':
+            return self.data.variables[node[1]][
+                self.get_key_for_variable_full_depth(node[1])
+            ]
+        if kind == 'neg':
+            return -self.evaluate(node[1])
+        if kind == 'binop':
+            return BINARY_OPERATORS[node[1]](self.evaluate(node[2]), self.evaluate(node[3]))
+        if kind == 'call':
+            return getattr(functions, node[1])(*[self.evaluate(a) for a in node[2]])
+
+        raise ValueError(f"Unknown expression node {kind}")
 
     def get_key_for_variable(self, variable):
         """Using self.key and self.dims, determine the key for the particular
@@ -90,6 +159,55 @@ class Parser:
 
         return tuple(key)
 
+
+class Parser:
+    """The parsing portion of the domain specific language"""
+
+    def __init__(self, **kwargs):
+        self.lexer = data.calculated_parser.lexer.Lexer()
+        self.tokens = self.lexer.tokens
+
+        # Sets the operator precedence for the parser. The unary minus is the
+        # highest, followed by exponentiation, then multiplication/division and
+        # addition/subtraction is last on the list.
+        self.precedence = (
+            ('left', 'PLUS', 'MINUS'),
+            ('left', 'TIMES', 'DIVIDE'),
+            ('left', 'POWER'),
+            ('right', 'UMINUS'),
+        )
+        self.parser = yacc.yacc(module=self)
+        self.expression = None
+        self.result = None
+
+    def compile(self, expression) -> Expression:
+        """Parse the expression into an Expression that can be evaluated
+        repeatedly.
+
+        Parameters:
+        expression -- the string expression to parse
+        """
+        self.result = None  # populated by p_statement_expr()
+        self.expression = expression
+        self.parser.parse(expression, lexer=self.lexer.lexer)
+        return Expression(expression, self.result)
+
+    def parse(self, expression, data, key, dims):
+        """Parse the expression and return the result
+
+        Parameters:
+        expression -- the string expression to parse
+        data -- the xarray or netcdf dataset to pull data from
+        key -- the key passed along from the __getitem__ call, a tuple of
+               integers and/or slices
+        dims -- the dimensions that correspond to the key, a list of strings
+
+        Returns a numpy array of data.
+        """
+        return self.compile(expression).evaluate(data, key, dims)
+
+    # The p_* methods build the expression tree (see Expression); nothing is
+    # evaluated while parsing.
     # Similar to the Lexer, these p_*, methods cannot have proper python
     # docstrings, because it's used for the parsing specification.
     def p_statement_expr(self, t):
@@ -98,22 +216,16 @@ class Parser:
 
     def p_expression_variable(self, t):
         'expression : ID'
-        t[0] = self.data.variables[t[1]][
-            self.get_key_for_variable(
-                self.data.variables[t[1]]
-            )
-        ]
+        t[0] = ('variable', t[1])
 
     def p_expression_variable_full_depth(self, t):
         '''expression : LBRKT ID RBRKT'''
 
-        t[0] = self.data.variables[t[2]][
-            self.get_key_for_variable_full_depth(t[2])
-        ]
+        t[0] = ('full_depth', t[2])
 
     def p_expression_uop(self, t):
         '''expression : MINUS expression %prec UMINUS'''
-        t[0] = -t[2]
+        t[0] = ('neg', t[2])
 
     def p_expression_binop(self, t):
         '''expression : expression PLUS expression
@@ -121,16 +233,7 @@ class Parser:
                     | expression TIMES expression
                     | expression DIVIDE expression
                     | expression POWER NUMBER'''
-        if t[2] == '+':
-            t[0] = t[1] + t[3]
-        elif t[2] == '-':
-            t[0] = t[1] - t[3]
-        elif t[2] == '*':
-            t[0] = t[1] * t[3]
-        elif t[2] == '/':
-            t[0] = t[1] / t[3]
-        elif t[2] == '^':
-            t[0] = t[1] ** t[3]
+        t[0] = ('binop', t[2], t[1], t[3] if t[2] != '^' else ('number', t[3]))
 
     def p_expression_group(self, t):
         'expression : LPAREN expression RPAREN'
@@ -138,18 +241,18 @@ class Parser:
 
     def p_expression_number(self, t):
         'expression : NUMBER'
-        t[0] = t[1]
+        t[0] = ('number', t[1])
 
     def p_expression_const(self, t):
         'expression : CONST'
-        t[0] = t[1]
+        t[0] = ('number', t[1])
 
     def p_expression_function(self, t):
         'expression : ID LPAREN arguments RPAREN'
         fname = t[1]
         arg_list = t[3]
         if fname in dir(functions):
-            t[0] = getattr(functions, fname)(*arg_list)
+            t[0] = ('call', fname, tuple(arg_list))
         else:
             raise SyntaxError
 
@@ -169,3 +272,29 @@ class Parser:
     def p_error(self, t):
         raise SyntaxError(
             'Syntax error in equation: {}...{}'.format(self.expression, t))
+
+
+# Compiled equations, keyed by equation string. Building the yacc parser and
+# parsing are only paid for the first use of each equation.
+_expression_cache: LRUCache = LRUCache(maxsize=256)
+_parser = None
+_lock = threading.Lock()
+
+
+def compile_expression(expression: str) -> Expression:
+    """Returns the compiled Expression for an equation (e.g. from
+    DatasetConfig.calculated_variables), parsing it only the first time.
+    """
+    global _parser
+
+    with _lock:
+        compiled = _expression_cache.get(expression)
+        if compiled is None:
+            # The ply parser keeps state while parsing, so it is shared
+            # under the lock.
+            if _parser is None:
+                _parser = Parser()
+            compiled = _parser.compile(expression)
+            _expression_cache[expression] = compiled
+
+    return compiled
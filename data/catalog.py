@@ -0,0 +1,284 @@
+"""
+Metadata catalog of a dataset: dimensions, variables, depth axis, lat/lon
+variable names and time axis.
+
+Listing the variables of a dataset or its depths used to open its NetCDF
+files (or run xarray.open_mfdataset) on every request. The catalog is built
+once (by NetCDFData.build_catalog, lazily or with
+scripts/build_dataset_catalog.py) and reused until the dataset changes.
+
+Catalogs of sqlite-indexed datasets are saved as JSON next to the index
+(or in the DATASET_CATALOG_DIR setting, if set, for read-only index
+directories) and versioned by the mtime and size of the index file. Other
+datasets are only kept in memory, versioned by the mtime of their files.
+Remote (OPeNDAP) datasets have no version to check, so their catalogs are
+rebuilt after DATASET_CATALOG_REMOTE_TTL seconds (60 by default).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Union
+
+import numpy as np
+from cachetools import TTLCache
+
+from data.variable import Variable
+from data.variable_list import VariableList
+from utils.app_config import get_app_setting
+from utils.atomic_file import atomic_write
+
+logger = logging.getLogger(__name__)
+
+CATALOG_SUFFIX = ".catalog.json"
+DEFAULT_REMOTE_TTL = 60  # seconds
+
+
+class DatasetCatalog:
+    """Metadata of a dataset that can be served without opening it.
+
+    Arguments:
+        dimensions {list} -- Names of all the dimensions.
+        variables {VariableList} -- Data variables (as NetCDFData.variables).
+
+    Keyword Arguments:
+        variable_keys {list} -- Names of all variables, including coordinates.
+        depths {dict} -- Depth axis in metres, keyed by depth dimension.
+        latlon {list} -- Names of the latitude and longitude variables.
+        time_units {str} -- Units of the time variable.
+        time_axes {list} -- Distinct lists of raw timestamps.
+        variable_time_axis {dict} -- Index into time_axes per variable.
+        default_time_axis {int} -- Time axis of variables not listed in
+            variable_time_axis (None if there is none).
+        version -- Version of the files the catalog was built from.
+    """
+
+    def __init__(self, dimensions: List[str], variables: VariableList,
+                 variable_keys: List[str] = None, depths: Dict[str, list] = None,
+                 latlon: List[str] = None, time_units: str = None,
+                 time_axes: List[list] = None, variable_time_axis: Dict[str, int] = None,
+                 default_time_axis: int = None, version=None) -> None:
+        self.dimensions: List[str] = list(dimensions)
+        self.variables: VariableList = variables
+        self.variable_keys: List[str] = list(variable_keys or [v.key for v in variables])
+        self.depths: Dict[str, list] = depths or {}
+        self.latlon: List[str] = latlon
+        self.time_units: str = time_units
+        self.time_axes: List[list] = time_axes or []
+        self.variable_time_axis: Dict[str, int] = variable_time_axis or {}
+        self.default_time_axis: int = default_time_axis
+        self.version = version
+
+    def depths_for(self, variable: Variable) -> Union[np.ndarray, None]:
+        """Returns the depth axis (in metres) of a variable, or None if it is
+        not in the catalog.
+        """
+        for dim in variable.dimensions:
+            if dim in self.depths:
+                depths = np.array(self.depths[dim])
+                depths.setflags(write=False)
+                return depths
+
+        return None
+
+    def timestamps(self, variable: str) -> List[int]:
+        """Returns the raw timestamps of a variable in ascending order.
+        """
+        axis = self.variable_time_axis.get(variable, self.default_time_axis)
+        if axis is None:
+            return []
+
+        return list(self.time_axes[axis])
+
+    def to_dict(self) -> dict:
+        return {
+            'version': self.version,
+            'dimensions': self.dimensions,
+            'variables': [
+                {
+                    'key': v.key,
+                    'name': v.name,
+                    'unit': v.unit,
+                    'dimensions': list(v.dimensions),
+                    'valid_min': v.valid_min,
+                    'valid_max': v.valid_max,
+                } for v in self.variables
+            ],
+            'variable_keys': self.variable_keys,
+            'depths': self.depths,
+            'latlon': self.latlon,
+            'time_units': self.time_units,
+            'time_axes': self.time_axes,
+            'variable_time_axis': self.variable_time_axis,
+            'default_time_axis': self.default_time_axis,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'DatasetCatalog':
+        variables = VariableList([
+            Variable(v['key'], v['name'], v['unit'], v['dimensions'],
+                     v['valid_min'], v['valid_max'])
+            for v in d['variables']
+        ])
+
+        return cls(
+            d['dimensions'], variables,
+            variable_keys=d['variable_keys'],
+            depths=d['depths'],
+            latlon=d['latlon'],
+            time_units=d['time_units'],
+            time_axes=d['time_axes'],
+            variable_time_axis=d['variable_time_axis'],
+            default_time_axis=d['default_time_axis'],
+            version=d['version'],
+        )
+
+
+def time_axes(timestamps: Dict[str, list]) -> tuple:
+    """Groups the timestamps of each variable into distinct time axes.
+
+    Returns:
+        tuple -- (list of time axes, dict of time axis index per variable)
+    """
+    axes = []
+    variable_axis = {}
+    for variable, ts in timestamps.items():
+        ts = [int(t) for t in ts]
+        try:
+            variable_axis[variable] = axes.index(ts)
+        except ValueError:
+            variable_axis[variable] = len(axes)
+            axes.append(ts)
+
+    return axes, variable_axis
+
+
+def _paths(url) -> list:
+    return list(url) if isinstance(url, (list, tuple)) else [url]
+
+
+def catalog_version(url) -> Union[list, None]:
+    """Returns the [mtime, size] of each of the dataset's files (the sqlite
+    index for indexed datasets), or None for remote datasets.
+    """
+    version = []
+    for path in _paths(url):
+        try:
+            st = os.stat(path)
+        except (OSError, TypeError, ValueError):
+            return None
+        version.append([st.st_mtime_ns, st.st_size])
+
+    return version
+
+
+def catalog_path(url, catalog_dir: str = None) -> Union[str, None]:
+    """Returns where the catalog of a sqlite-indexed dataset is saved, or
+    None for datasets whose catalog is only kept in memory.
+
+    Keyword Arguments:
+        catalog_dir {str} -- Directory of the catalogs, instead of the
+            DATASET_CATALOG_DIR setting. (default: {None})
+    """
+    if not isinstance(url, str) or not url.endswith(".sqlite3"):
+        return None
+
+    catalog_dir = catalog_dir or get_app_setting('DATASET_CATALOG_DIR')
+    if catalog_dir:
+        name = hashlib.sha1(os.path.abspath(url).encode()).hexdigest()
+        return os.path.join(catalog_dir, name + CATALOG_SUFFIX)
+
+    return url + CATALOG_SUFFIX
+
+
+def load_catalog(path: str) -> Union[DatasetCatalog, None]:
+    try:
+        with open(path, 'r') as f:
+            return DatasetCatalog.from_dict(json.load(f))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_catalog(catalog: DatasetCatalog, path: str) -> None:
+    """Writes a catalog atomically. Failures (e.g. read-only directory) are
+    logged and the catalog is only kept in memory.
+    """
+    try:
+        with atomic_write(path, 'w') as f:
+            json.dump(catalog.to_dict(), f)
+    except (OSError, TypeError, ValueError) as e:
+        logger.warning("Unable to save dataset catalog %s: %s", path, e)
+
+
+_catalogs: TTLCache = TTLCache(maxsize=64, ttl=3600)
+_catalogs_lock = threading.Lock()
+
+
+def cached_catalog(url) -> Union[DatasetCatalog, None]:
+    """Returns the catalog of a dataset from memory or disk if there is one
+    for the current version of the dataset, without building it.
+
+    Arguments:
+        url {str or list} -- URL(s) of the dataset.
+    """
+
+    key = json.dumps(url)
+    version = catalog_version(url)
+
+    with _catalogs_lock:
+        entry = _catalogs.get(key)
+    if entry is not None:
+        catalog, loaded = entry
+        if catalog.version == version:
+            if version is not None or \
+                    time.time() - loaded < get_app_setting('DATASET_CATALOG_REMOTE_TTL',
+                                                           DEFAULT_REMOTE_TTL):
+                return catalog
+
+    path = catalog_path(url)
+    catalog = load_catalog(path) if path and version is not None else None
+    if catalog is None or catalog.version != version:
+        return None
+
+    with _catalogs_lock:
+        _catalogs[key] = (catalog, time.time())
+
+    return catalog
+
+
+def get_catalog(url, builder: Callable[[], DatasetCatalog]) -> DatasetCatalog:
+    """Returns the catalog of a dataset from memory or disk, calling
+    builder() to build it when there is none for the current version of
+    the dataset.
+
+    Arguments:
+        url {str or list} -- URL(s) of the dataset.
+        builder {Callable} -- Builds the catalog (e.g. NetCDFData.build_catalog).
+    """
+
+    catalog = cached_catalog(url)
+    if catalog is not None:
+        return catalog
+
+    version = catalog_version(url)
+    catalog = builder()
+    catalog.version = version
+
+    path = catalog_path(url)
+    if path and version is not None:
+        save_catalog(catalog, path)
+
+    with _catalogs_lock:
+        _catalogs[json.dumps(url)] = (catalog, time.time())
+
+    return catalog
+
+
+def clear_catalogs() -> None:
+    """Forgets the catalogs held in memory.
+    """
+    with _catalogs_lock:
+        _catalogs.clear()
@@ -0,0 +1,230 @@
+"""
+Dask chunk shapes for open_mfdataset, planned from the on-disk chunking of
+the files and the way the caller is going to read them.
+
+A fixed chunks=200 matches neither the NetCDF chunking of the files nor the
+access pattern: a tile reads one time slab of a horizontal area, while a
+point timeseries reads a long time range of a tiny box and ended up reading
+whole 200x200 spatial chunks at every timestep.
+
+The on-disk chunk sizes are taken from the ``_ChunkSizes`` attribute (added
+by THREDDS/OPeNDAP) or from the file's chunking. Dask chunks are whole
+multiples of them (of 1, or POINT_CHUNK horizontally, for contiguous
+variables), shaped by the access
+hint:
+    * AREA         -- one timestep, horizontal chunks grown to the target size
+    * POINT_SERIES -- small horizontal chunks, the time range in one chunk
+    * PATH         -- the time range in one chunk, horizontal chunks grown to
+                      the target size (hovmollers and tracks read a time
+                      range along a path crossing a large bounding box)
+    * PROFILE      -- small horizontal chunks, the full depth in one chunk
+    * SUBSET       -- the full depth, horizontal chunks grown to the target
+    * None         -- on-disk chunks, horizontal chunks grown to the target
+
+The target size of a chunk is the DASK_CHUNK_TARGET_BYTES setting.
+"""
+
+import logging
+import os
+import threading
+from typing import Union
+
+import netCDF4
+import numpy as np
+from cachetools import LRUCache
+
+from utils.app_config import get_app_setting
+
+logger = logging.getLogger(__name__)
+
+AREA = "area"
+POINT_SERIES = "point-series"
+PATH = "path"
+PROFILE = "profile"
+SUBSET = "subset"
+ACCESS_HINTS = (AREA, POINT_SERIES, PATH, PROFILE, SUBSET)
+
+DEFAULT_TARGET_BYTES = 16 * 1024 * 1024
+# Smallest horizontal chunk of contiguous variables
+POINT_CHUNK = 32
+
+
+class DiskLayout:
+    """Dimensions and on-disk chunking of the main variable of a file.
+
+    Arguments:
+        dims {tuple} -- Dimension names of the variable.
+        shape {tuple} -- Size of each dimension.
+        chunks {tuple} -- On-disk chunk size along each dimension (the
+            dimension's size for contiguous variables).
+        itemsize {int} -- Bytes per value.
+        contiguous {bool} -- Whether the variable isn't chunked on disk.
+    """
+
+    def __init__(self, dims: tuple, shape: tuple, chunks: tuple, itemsize: int,
+                 contiguous: bool) -> None:
+        self.dims: tuple = tuple(dims)
+        self.shape: tuple = tuple(shape)
+        self.chunks: tuple = tuple(chunks)
+        self.itemsize: int = itemsize
+        self.contiguous: bool = contiguous
+
+    def __repr__(self) -> str:
+        return "DiskLayout(dims=%r, shape=%r, chunks=%r)" % (self.dims, self.shape, self.chunks)
+
+
+def _variable_chunks(variable) -> Union[tuple, None]:
+    if '_ChunkSizes' in variable.ncattrs():
+        return tuple(int(c) for c in np.atleast_1d(variable.getncattr('_ChunkSizes')))
+
+    chunking = variable.chunking()
+    if chunking == 'contiguous' or chunking is None:
+        return None
+
+    return tuple(int(c) for c in chunking)
+
+
+def read_disk_layout(path: str) -> Union[DiskLayout, None]:
+    """Returns the layout of the variable of a file with the most
+    dimensions (the largest one on a tie), skipping coordinate variables.
+    """
+    with netCDF4.Dataset(path) as ds:
+        candidates = [
+            v for name, v in ds.variables.items()
+            if v.ndim >= 2 and v.dimensions != (name,) and v.dtype.kind in 'iuf'
+        ]
+        if not candidates:
+            return None
+
+        variable = max(candidates, key=lambda v: (v.ndim, int(np.prod(v.shape))))
+        chunks = _variable_chunks(variable)
+        shape = tuple(int(n) for n in variable.shape)
+        contiguous = chunks is None or len(chunks) != len(shape)
+
+        return DiskLayout(
+            variable.dimensions,
+            shape,
+            shape if contiguous else tuple(min(c, n) for c, n in zip(chunks, shape)),
+            variable.dtype.itemsize,
+            contiguous,
+        )
+
+
+_layouts: LRUCache = LRUCache(maxsize=256)
+_layouts_lock = threading.Lock()
+
+
+def disk_layout(path: str) -> Union[DiskLayout, None]:
+    """Cached read_disk_layout (by path, mtime and size). Returns None if the
+    file can't be read.
+    """
+    try:
+        st = os.stat(path)
+        version = (st.st_mtime_ns, st.st_size)
+    except (OSError, TypeError, ValueError):
+        # Remote (OPeNDAP) URL
+        version = None
+
+    with _layouts_lock:
+        if (path, version) in _layouts:
+            return _layouts[(path, version)]
+
+    try:
+        layout = read_disk_layout(path)
+    except (OSError, RuntimeError) as e:
+        logger.warning("Can't read the chunking of %s: %s", path, e)
+        layout = None
+
+    with _layouts_lock:
+        _layouts[(path, version)] = layout
+
+    return layout
+
+
+def _is_time(dim: str) -> bool:
+    return 'time' in dim.lower()
+
+
+def _grow(chunks: dict, dims: list, sizes: dict, limit: int) -> None:
+    # Doubles the chunks along dims in turn (keeping them multiples of the
+    # on-disk chunks) while the chunk fits in limit values.
+    growing = [d for d in dims if chunks[d] < sizes[d]]
+    while growing:
+        for d in list(growing):
+            total = int(np.prod(list(chunks.values())))
+            grown = min(chunks[d] * 2, sizes[d])
+            if total // chunks[d] * grown > limit:
+                growing.remove(d)
+                continue
+            chunks[d] = grown
+            if grown == sizes[d]:
+                growing.remove(d)
+
+
+def plan_chunks(layout: DiskLayout, access: str = None, target_bytes: int = None) -> dict:
+    """Plans the dask chunks (dimension -> size) of a dataset.
+
+    Arguments:
+        layout {DiskLayout} -- Layout of the dataset's first file.
+
+    Keyword Arguments:
+        access {str} -- Access hint: AREA, POINT_SERIES, PATH, PROFILE,
+            SUBSET or None. (default: {None})
+        target_bytes {int} -- Target size of a chunk, the
+            DASK_CHUNK_TARGET_BYTES setting by default. (default: {None})
+    """
+
+    if target_bytes is None:
+        target_bytes = int(get_app_setting('DASK_CHUNK_TARGET_BYTES', DEFAULT_TARGET_BYTES))
+    limit = max(1, target_bytes // layout.itemsize)
+
+    # Chunks of open_mfdataset don't span files, so a file's size is the
+    # largest useful chunk along time.
+    sizes = dict(zip(layout.dims, layout.shape))
+    time = [d for d in layout.dims if _is_time(d)]
+    horizontal = [d for d in layout.dims[-2:] if d not in time]
+    vertical = [d for d in layout.dims if d not in time and d not in horizontal]
+
+    chunks = dict(zip(layout.dims, layout.chunks))
+    if layout.contiguous:
+        for d in time + vertical:
+            chunks[d] = 1
+        for d in horizontal:
+            chunks[d] = min(sizes[d], POINT_CHUNK)
+
+    if access in (POINT_SERIES, PROFILE):
+        if access == POINT_SERIES:
+            for d in time:
+                chunks[d] = sizes[d]
+        else:
+            for d in vertical:
+                chunks[d] = sizes[d]
+            for d in time:
+                chunks[d] = 1
+    else:
+        if access == AREA:
+            for d in time:
+                chunks[d] = 1
+        elif access == PATH:
+            for d in time:
+                chunks[d] = sizes[d]
+        elif access == SUBSET:
+            for d in vertical:
+                chunks[d] = sizes[d]
+        _grow(chunks, horizontal, sizes, limit)
+
+    return chunks
+
+
+def dataset_chunks(files: list, access: str = None) -> Union[dict, None]:
+    """Returns the dask chunks to open files with for an access hint, or
+    None if the on-disk layout of the files is unknown.
+    """
+    if not files:
+        return None
+
+    layout = disk_layout(files[0])
+    if layout is None:
+        return None
+
+    return plan_chunks(layout, access)
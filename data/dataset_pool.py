@@ -0,0 +1,264 @@
+"""
+Per-process pool of open datasets shared by NetCDFData instances.
+
+NetCDFData used to run xarray.open_mfdataset (and merge the geo_ref and grid
+angle files) on entering every ``with`` block and close the result on exit,
+so a burst of tile requests for the same timestep paid the file-open and
+metadata-decode cost on every tile. The pool keeps the merged dataset open
+between requests instead.
+
+Entries are keyed by the dataset key plus the resolved list of files, and are
+dropped when:
+    * the pool is full (least recently used first),
+    * they have not been used for the idle timeout,
+    * the modification time of any of their files, or of the sqlite index
+      the file list came from, has changed,
+    * they were opened more than the max age ago and some of their files
+      can't be watched (remote OPeNDAP URLs), so a republished remote
+      dataset is picked up.
+
+Entries that are in use when dropped are closed when they are released.
+
+uwsgi forks its workers after loading the application, so a handle opened in
+one process is never handed out in another: the pool is reset whenever it is
+used from a different process than the one that filled it.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Iterable
+
+from utils.app_config import get_app_setting
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 16
+DEFAULT_IDLE_TIMEOUT = 600  # seconds
+DEFAULT_MAX_AGE = 3600  # seconds
+
+
+def _mtime(path: str):
+    try:
+        return os.stat(path).st_mtime_ns
+    except (OSError, TypeError, ValueError):
+        # Remote (OPeNDAP) URL or missing file: nothing to watch
+        return None
+
+
+def file_signature(paths: Iterable[str]) -> tuple:
+    """Returns the modification times of the given paths, used to detect
+    files that were rewritten (or an index that was updated) since they
+    were opened.
+    """
+    return tuple((p, _mtime(p)) for p in paths if p)
+
+
+def _close(dataset) -> None:
+    try:
+        dataset.close()
+    except Exception:
+        logger.exception("Error closing pooled dataset")
+
+
+class PooledDataset:
+    """An open dataset checked out of a DatasetPool.
+    """
+
+    __slots__ = ('key', 'dataset', 'signature', 'refcount', 'opened', 'last_used', 'retired')
+
+    def __init__(self, key: Hashable, dataset, signature: tuple) -> None:
+        self.key = key
+        self.dataset = dataset
+        self.signature = signature
+        self.refcount: int = 0
+        self.opened: float = time.monotonic()
+        self.last_used: float = self.opened
+        self.retired: bool = False
+
+    @property
+    def watched(self) -> bool:
+        """Whether every file of the dataset has a modification time to
+        check (see file_signature).
+        """
+        return bool(self.signature) and all(m is not None for _, m in self.signature)
+
+
+class DatasetPool:
+    """LRU pool of open datasets with idle-timeout eviction and mtime
+    invalidation.
+
+    The maximum size, idle timeout and max age are read from the
+    DATASET_POOL_SIZE, DATASET_POOL_IDLE_TIMEOUT and DATASET_POOL_MAX_AGE
+    settings unless given explicitly. A size of 0 disables pooling: every
+    acquire opens a new dataset that is closed on release, as before.
+    """
+
+    def __init__(self, maxsize: int = None, idle_timeout: float = None,
+                 max_age: float = None) -> None:
+        self._maxsize = maxsize
+        self._idle_timeout = idle_timeout
+        self._max_age = max_age
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.RLock()
+        self._pid: int = os.getpid()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    @property
+    def maxsize(self) -> int:
+        if self._maxsize is not None:
+            return self._maxsize
+        return int(get_app_setting('DATASET_POOL_SIZE', DEFAULT_MAX_SIZE))
+
+    @property
+    def idle_timeout(self) -> float:
+        if self._idle_timeout is not None:
+            return self._idle_timeout
+        return float(get_app_setting('DATASET_POOL_IDLE_TIMEOUT', DEFAULT_IDLE_TIMEOUT))
+
+    @property
+    def max_age(self) -> float:
+        if self._max_age is not None:
+            return self._max_age
+        return float(get_app_setting('DATASET_POOL_MAX_AGE', DEFAULT_MAX_AGE))
+
+    def acquire(self, key: Hashable, opener: Callable, paths: Iterable[str] = ()) -> PooledDataset:
+        """Returns an open dataset for key, calling opener() to open it if
+        the pool does not hold a current one. Every acquire must be paired
+        with a release().
+
+        Arguments:
+            key {Hashable} -- Identifies the dataset and the files it spans.
+            opener {Callable} -- Opens and returns the dataset.
+
+        Keyword Arguments:
+            paths {Iterable[str]} -- Files (and sqlite index) whose modification
+                invalidates the pooled dataset. (default: {()})
+        """
+
+        signature = file_signature(paths)
+
+        with self._lock:
+            self.__check_process()
+            self.__evict_idle()
+
+            entry = self._entries.get(key)
+            if entry is not None and entry.signature != signature:
+                logger.info("Files changed, reopening %s", key)
+                self.__retire(key)
+                entry = None
+
+            if entry is not None and not entry.watched and \
+                    time.monotonic() - entry.opened > self.max_age:
+                logger.info("Max age reached, reopening %s", key)
+                self.__retire(key)
+                entry = None
+
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                entry.refcount += 1
+                entry.last_used = time.monotonic()
+                return entry
+
+            self.misses += 1
+
+        # Open outside of the lock so other datasets are not held up
+        entry = PooledDataset(key, opener(), signature)
+        entry.refcount = 1
+
+        with self._lock:
+            if self.maxsize <= 0:
+                entry.retired = True
+                return entry
+
+            current = self._entries.get(key)
+            if current is not None and current.signature == signature:
+                # Another thread opened it first; use theirs
+                _close(entry.dataset)
+                current.refcount += 1
+                current.last_used = time.monotonic()
+                self._entries.move_to_end(key)
+                return current
+
+            if current is not None:
+                self.__retire(key)
+            self._entries[key] = entry
+            self.__evict_lru()
+
+        return entry
+
+    def release(self, entry: PooledDataset) -> None:
+        """Returns a dataset obtained from acquire() to the pool, closing
+        it if it was dropped from the pool while in use.
+        """
+
+        with self._lock:
+            entry.refcount -= 1
+            entry.last_used = time.monotonic()
+            if entry.retired and entry.refcount <= 0:
+                _close(entry.dataset)
+
+    def info(self) -> dict:
+        """Returns the hit/miss/eviction counters and size of the pool.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'in_use': sum(1 for e in self._entries.values() if e.refcount > 0),
+                'maxsize': self.maxsize,
+            }
+
+    def clear(self) -> None:
+        """Closes every idle dataset and forgets the ones in use (they are
+        closed when released).
+        """
+        with self._lock:
+            for key in list(self._entries):
+                self.__retire(key)
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def __check_process(self) -> None:
+        pid = os.getpid()
+        if pid != self._pid:
+            # Inherited from the parent across a fork: the underlying file
+            # handles (and HDF5 state) must not be shared, so start afresh.
+            self._entries = OrderedDict()
+            self._pid = pid
+
+    def __retire(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        entry.retired = True
+        if entry.refcount <= 0:
+            _close(entry.dataset)
+
+    def __evict_idle(self) -> None:
+        deadline = time.monotonic() - self.idle_timeout
+        for key, entry in list(self._entries.items()):
+            if entry.refcount <= 0 and entry.last_used < deadline:
+                self.__retire(key)
+                self.evictions += 1
+
+    def __evict_lru(self) -> None:
+        excess = len(self._entries) - self.maxsize
+        # Oldest first; datasets in use are skipped and may keep the pool
+        # over its size until they are released.
+        for key, entry in list(self._entries.items()):
+            if excess <= 0:
+                break
+            if entry.refcount <= 0:
+                self.__retire(key)
+                self.evictions += 1
+                excess -= 1
+
+
+dataset_pool = DatasetPool()
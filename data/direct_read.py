@@ -0,0 +1,419 @@
+"""
+Direct hyperslab reads that bypass dask for small requests.
+
+Datasets are opened with xarray.open_mfdataset, so even a 10x10 window read
+by a point query or a tile builds and runs a dask graph over every file of
+the time range. For reads whose footprint is at most the DIRECT_READ_MAX_BYTES
+setting (0 disables the direct path), NetCDFData.get_dataset_variable returns
+a DirectReadVariable which resolves the footprint to the files holding it and
+reads it with netCDF4, decoded like xarray (_FillValue and missing_value
+become NaN, then scale_factor and add_offset are applied). Larger reads still
+go through dask.
+
+Each read is recorded (see record_read) in a per-request list that the app
+reports in the X-Data-Read-Path response header, and in process-wide counters.
+"""
+
+import contextlib
+import logging
+import os
+import threading
+from typing import Union
+
+import netCDF4
+import numpy as np
+import xarray
+from cachetools import LRUCache
+from flask import g, has_request_context
+from xarray.backends.locks import HDF5_LOCK
+
+from utils.app_config import get_app_setting
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+
+DIRECT = "direct"
+DASK = "dask"
+
+_counters = {DIRECT: 0, DASK: 0}
+_counters_lock = threading.Lock()
+
+
+def record_read(path: str, variable: str, nbytes: Union[int, None]) -> None:
+    """Records which path (DIRECT or DASK) a read took.
+    """
+    logger.debug("%s read of %s (%s bytes)", path, variable, nbytes)
+
+    with _counters_lock:
+        _counters[path] += 1
+
+    if has_request_context():
+        g.setdefault('data_reads', []).append((path, variable, nbytes))
+
+
+def request_reads() -> list:
+    """Returns the (path, variable, bytes) reads of the current request.
+    """
+    if not has_request_context():
+        return []
+
+    return g.get('data_reads', [])
+
+
+def summarize_reads(reads: list) -> str:
+    """Formats reads for the X-Data-Read-Path header,
+    e.g. "direct=3;dask=1;direct_bytes=4800".
+    """
+    direct = [r for r in reads if r[0] == DIRECT]
+    dask = [r for r in reads if r[0] == DASK]
+
+    return "direct=%d;dask=%d;direct_bytes=%d" % (
+        len(direct), len(dask), sum(r[2] or 0 for r in direct))
+
+
+def info() -> dict:
+    """Returns the number of reads that took each path in this process.
+    """
+    with _counters_lock:
+        return dict(_counters)
+
+
+def footprint(key, shape: tuple, itemsize: int) -> Union[int, None]:
+    """Returns the number of bytes selected by key from an array, or None
+    if the key isn't made of integers, slices and integer sequences.
+    """
+    if not isinstance(key, tuple):
+        key = (key,)
+    if len(key) > len(shape):
+        return None
+
+    nbytes = itemsize
+    for k, n in zip(key + (slice(None),) * (len(shape) - len(key)), shape):
+        if isinstance(k, (int, np.integer)):
+            continue
+        if isinstance(k, slice):
+            nbytes *= len(range(*k.indices(n)))
+            continue
+
+        k = np.asarray(k)
+        if k.ndim != 1 or k.dtype.kind not in 'iu':
+            return None
+        nbytes *= k.shape[0]
+
+    return nbytes
+
+
+def _decode(values, attrs: dict) -> np.ndarray:
+    # Like xarray's CF decoding; unlike netCDF4's auto masking, valid_min
+    # and valid_max are left alone.
+    values = np.asarray(values)
+    if values.dtype.kind not in 'iuf':
+        return values
+
+    fills = [np.asarray(attrs[a]).ravel() for a in ('_FillValue', 'missing_value')
+             if a in attrs]
+    scale = attrs.get('scale_factor')
+    offset = attrs.get('add_offset')
+    if not fills and scale is None and offset is None:
+        return values
+
+    if values.dtype.kind == 'f':
+        dtype = values.dtype
+    else:
+        dtype = np.float32 if values.dtype.itemsize <= 2 else np.float64
+    if scale is not None or offset is not None:
+        dtype = np.result_type(dtype, *[np.asarray(a).dtype for a in (scale, offset)
+                                         if a is not None])
+
+    result = values.astype(dtype)
+    if fills:
+        fills = np.concatenate(fills)
+        result[np.isin(values, fills[~np.isnan(fills.astype(np.float64))])] = np.nan
+    if scale is not None:
+        result *= scale
+    if offset is not None:
+        result += offset
+
+    return result
+
+
+class _Handle:
+    """An open netCDF4 dataset, closed once it is evicted and no read is
+    using it."""
+
+    def __init__(self, dataset: netCDF4.Dataset) -> None:
+        self.dataset = dataset
+        self.users = 0
+        self.evicted = False
+
+    def close(self) -> None:
+        with HDF5_LOCK:
+            self.dataset.close()
+
+
+class _Handles(LRUCache):
+    """Open netCDF4 datasets of this process, closed on eviction unless a
+    read is still using them (then by the last one)."""
+
+    def popitem(self):
+        key, handle = super().popitem()
+        handle.evicted = True
+        if handle.users == 0:
+            handle.close()
+        return key, handle
+
+
+_handles_pid = None
+_handles = _Handles(maxsize=64)
+_file_infos: LRUCache = LRUCache(maxsize=4096)
+_files_lock = threading.RLock()
+
+
+def _version(path: str):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        # URLs
+        return None
+
+
+@contextlib.contextmanager
+def _handle(path: str):
+    """Checks out the open dataset of a file for the duration of the block.
+    Handles are keyed by the file's mtime, so rewritten files are reopened.
+    """
+    global _handles_pid, _handles
+
+    key = (path, _version(path))
+    with _files_lock:
+        if _handles_pid != os.getpid():
+            # Handles opened before a fork must not be shared
+            _handles = _Handles(maxsize=64)
+            _handles_pid = os.getpid()
+
+        handle = _handles.get(key)
+        if handle is None:
+            with HDF5_LOCK:
+                dataset = netCDF4.Dataset(path)
+            dataset.set_auto_maskandscale(False)
+            handle = _Handle(dataset)
+            _handles[key] = handle
+        handle.users += 1
+
+    try:
+        yield handle.dataset
+    finally:
+        with _files_lock:
+            handle.users -= 1
+            if handle.evicted and handle.users == 0:
+                handle.close()
+
+
+def _file_info(path: str) -> dict:
+    """Variables (dims, shape) and attributes of a file and the first value
+    of its coordinate variables, cached by path, mtime and size.
+    """
+    version = _version(path)
+
+    with _files_lock:
+        info = _file_infos.get((path, version))
+        if info is not None:
+            return info
+
+    with _handle(path) as handle, HDF5_LOCK:
+        variables = {
+            name: (tuple(v.dimensions), tuple(v.shape))
+            for name, v in handle.variables.items()
+        }
+        attrs = {
+            name: {a: v.getncattr(a) for a in v.ncattrs()}
+            for name, v in handle.variables.items()
+        }
+        first = {
+            name: float(_decode(handle.variables[name][:1], attrs[name])[0])
+            for name, (dims, shape) in variables.items()
+            if dims == (name,) and shape[0] > 0 and
+            handle.variables[name].dtype.kind in 'iuf'
+        }
+    info = {'variables': variables, 'attrs': attrs, 'first': first}
+
+    with _files_lock:
+        _file_infos[(path, version)] = info
+
+    return info
+
+
+def _read_file(path: str, variable: str, key) -> np.ndarray:
+    attrs = _file_info(path)['attrs'][variable]
+    with _handle(path) as handle, HDF5_LOCK:
+        values = handle.variables[variable][key]
+
+    return _decode(values, attrs)
+
+
+class DirectReader:
+    """Reads hyperslabs of the variables of a set of NetCDF files that
+    open_mfdataset would concatenate along their first (time) dimension.
+
+    Arguments:
+        files {list} -- Paths (or URLs) of the files.
+    """
+
+    def __init__(self, files: list) -> None:
+        self.files: list = list(files)
+        self.__layouts: dict = {}
+        self.__lock = threading.Lock()
+
+    def layout(self, variable: str) -> Union[tuple, None]:
+        """Returns ((path, offset, length) pieces along the first dimension,
+        shape) of a variable, or None if it can't be read directly.
+        """
+        with self.__lock:
+            if variable in self.__layouts:
+                return self.__layouts[variable]
+
+        try:
+            layout = self.__layout(variable)
+        except (OSError, RuntimeError, KeyError, IndexError) as e:
+            logger.debug("No direct reads of %s: %s", variable, e)
+            layout = None
+
+        with self.__lock:
+            self.__layouts[variable] = layout
+
+        return layout
+
+    def __layout(self, variable: str):
+        holders = []
+        for path in self.files:
+            info = _file_info(path)
+            if variable in info['variables']:
+                holders.append((path, info))
+        if not holders:
+            return None
+
+        dims, shape = holders[0][1]['variables'][variable]
+        if len(holders) == 1 or not dims:
+            return [(holders[0][0], 0, shape[0] if shape else 0)], shape
+
+        # Concatenated along the first dimension, in coordinate order
+        concat_dim = dims[0]
+        if any(concat_dim not in info['first'] for _, info in holders):
+            return None
+        holders.sort(key=lambda h: h[1]['first'][concat_dim])
+
+        pieces = []
+        offset = 0
+        for path, info in holders:
+            d, s = info['variables'][variable]
+            if d != dims or s[1:] != shape[1:]:
+                return None
+            pieces.append((path, offset, s[0]))
+            offset += s[0]
+
+        return pieces, (offset,) + tuple(shape[1:])
+
+    def read(self, variable: str, key: tuple) -> np.ndarray:
+        """Reads variable[key] (orthogonal indexing, like xarray.Variable).
+        """
+        pieces, shape = self.layout(variable)
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (len(shape) - len(key))
+
+        if not shape:
+            return _read_file(pieces[0][0], variable, Ellipsis)
+
+        first, rest = key[0], key[1:]
+        scalar = isinstance(first, (int, np.integer))
+        if scalar:
+            indices = np.array([first if first >= 0 else first + shape[0]])
+        elif isinstance(first, slice):
+            indices = np.arange(*first.indices(shape[0]))
+        else:
+            indices = np.asarray(first)
+            indices = np.where(indices < 0, indices + shape[0], indices)
+
+        offsets = np.array([p[1] for p in pieces])
+        owner = np.searchsorted(offsets, indices, side='right') - 1
+
+        parts = []
+        start = 0
+        while start < indices.shape[0]:
+            # Consecutive indices in the same file are read at once
+            end = start + 1
+            while end < indices.shape[0] and owner[end] == owner[start]:
+                end += 1
+
+            path, offset, _ = pieces[owner[start]]
+            local = indices[start:end] - offset
+            if local.shape[0] == 1 or (np.diff(local) == 1).all():
+                local = slice(int(local[0]), int(local[-1]) + 1)
+
+            parts.append(_read_file(path, variable, (local,) + rest))
+            start = end
+
+        if not parts:
+            empty = _read_file(pieces[0][0], variable, (slice(0, 0),) + rest)
+            return empty[0] if scalar else empty
+
+        result = parts[0] if len(parts) == 1 else np.concatenate(parts, axis=0)
+
+        return result[0] if scalar else result
+
+
+class DirectReadVariable:
+    """Wraps an xarray.Variable of an opened dataset, reading small
+    selections directly and delegating everything else to the variable.
+
+    Arguments:
+        variable {xarray.Variable} -- The dask-backed variable.
+        name {str} -- Name of the variable in the files.
+        reader {DirectReader} -- Reader of the dataset's files.
+        max_bytes {int} -- Largest footprint read directly.
+    """
+
+    def __init__(self, variable: xarray.Variable, name: str, reader: DirectReader,
+                 max_bytes: int) -> None:
+        self._variable = variable
+        self._name = name
+        self._reader = reader
+        self._max_bytes = max_bytes
+
+    def __getitem__(self, key):
+        nbytes = footprint(key, self._variable.shape, self._variable.dtype.itemsize)
+        if nbytes is not None and nbytes <= self._max_bytes:
+            layout = self._reader.layout(self._name)
+            if layout is not None and tuple(layout[1]) == tuple(self._variable.shape):
+                values = self._reader.read(self._name, key)
+                record_read(DIRECT, self._name, nbytes)
+                return xarray.Variable(self.__dims(key), values, self._variable.attrs)
+
+        record_read(DASK, self._name, nbytes)
+        return self._variable[key]
+
+    def __dims(self, key) -> tuple:
+        if not isinstance(key, tuple):
+            key = (key,)
+
+        return tuple(d for d, k in zip(self._variable.dims, key + (slice(None),) * len(self._variable.dims))
+                     if not isinstance(k, (int, np.integer)))
+
+    def __getattr__(self, name):
+        return getattr(self._variable, name)
+
+    def __len__(self) -> int:
+        return len(self._variable)
+
+    def __array__(self, dtype=None):
+        return np.asarray(self._variable, dtype=dtype)
+
+    def __repr__(self) -> str:
+        return "DirectReadVariable(%r)" % (self._variable,)
+
+
+def max_direct_bytes() -> int:
+    """The DIRECT_READ_MAX_BYTES setting (0 disables direct reads)."""
+    return int(get_app_setting('DIRECT_READ_MAX_BYTES', DEFAULT_MAX_BYTES))
@@ -1,21 +1,37 @@
-import warnings
 from typing import Union
 
 import dateutil.parser
 import netCDF4 as netcdf
 import numpy as np
-import pyresample
 import pytz
-from cachetools import TTLCache
-from pykdtree.kdtree import KDTree
+from cachetools import LRUCache
 
 from data.calculated import CalculatedData
+from data.catalog import catalog_version
+from data.fvcom_mesh import MeshWeights, TriangularMesh, mesh_cache
 from data.model import Model
 from data.netcdf_data import NetCDFData
 from utils.errors import ServerError
 
-RAD_FACTOR = np.pi / 180.0
-EARTH_RADIUS = 6378137.0
+# Decoded Times variables, keyed by dataset url and version
+_timestamps: LRUCache = LRUCache(maxsize=16)
+
+
+def decode_times(times, tz) -> np.ndarray:
+    """Decodes the strings of an FVCOM Times variable
+    (e.g. 2015-07-06T00:00:00.000000) into timezone-aware datetimes.
+    """
+    times = np.char.strip(np.asarray(times, dtype=str))
+    try:
+        naive = np.array(times, dtype='datetime64[us]').astype(object)
+    except ValueError:
+        # Not ISO 8601
+        naive = [dateutil.parser.parse(t) for t in times]
+
+    timestamps = np.array([t.replace(tzinfo=tz) for t in naive])
+    timestamps.setflags(write=False)  # Make immutable
+
+    return timestamps
 
 
 class Fvcom(Model):
@@ -29,8 +45,6 @@ class Fvcom(Model):
         super().__init__(nc_data)
         self.nc_data = nc_data
         self.variables = nc_data.variables
-        self._kdt: KDTree = [None, None]
-        self.__timestamp_cache: TTLCache = TTLCache(1, 3600)
 
     def __enter__(self):
         self.nc_data.__enter__()
@@ -61,11 +75,8 @@ class Fvcom(Model):
             [int] -- Time index.
         """
 
-        time_var = self.nc_data.time_variable
-
-        # https: // stackoverflow.com/a/41022847/2231969
         # We use 1.e-7 since the default 1.e-5 doesn't provide enough precision
-        return next(i for i, _ in enumerate(time_var) if np.isclose(_, timestamp, 1.e-7))
+        return self.nc_data.time_index.exact(timestamp, rtol=1.e-7, atol=1.e-8)
 
     @property
     def depths(self):
@@ -79,71 +90,44 @@ class Fvcom(Model):
     def timestamps(self):
         """ Loads, caches, and returns the time dimension from a dataset.
         """
-        if self.__timestamp_cache.get("timestamps") is None:
-            for v in ['Times']:
-                if v in self.nc_data.dataset.variables:
-                    var = self.nc_data.get_dataset_variable(v)
-                    break
-
-            tz = pytz.timezone(var.time_zone)
-            time_list = list(map(
-                lambda dateStr:
-                dateutil.parser.parse(dateStr).replace(tzinfo=tz),
-                netcdf.chartostring(var[:])
-            ))
-            timestamps = np.array(time_list)
-            timestamps.setflags(write=False)  # Make immutable
-            self.__timestamp_cache["timestamps"] = timestamps
-
-        return self.__timestamp_cache.get("timestamps")
-
-    def __find_var(self, candidates):
-        for c in candidates:
-            if c in self.nc_data.dataset.variables:
-                return self.nc_data.get_dataset_variable(c)
-
-        return None
-
-    def __find_index(self, lat, lon, element=False, n=10):
-        index = int(element)
-
-        if element:
-            latvar = self.nc_data.get_dataset_variable('latc')
-            lonvar = self.nc_data.get_dataset_variable('lonc')
-        else:
-            latvar = self.nc_data.get_dataset_variable('lat')
-            lonvar = self.nc_data.get_dataset_variable('lon')
+        key = (str(self.nc_data.url), str(catalog_version(self.nc_data.url)))
+        timestamps = _timestamps.get(key)
+        if timestamps is None:
+            var = self.nc_data.get_dataset_variable('Times')
+            timestamps = decode_times(netcdf.chartostring(var[:]),
+                                      pytz.timezone(var.time_zone))
+            _timestamps[key] = timestamps
+
+        return timestamps
+
+    def __mesh(self) -> TriangularMesh:
+        return mesh_cache.mesh(self.__mesh_key(), self.__build_mesh)
+
+    def __mesh_key(self) -> tuple:
+        return (self.nc_data.dataset_key, str(self.nc_data.url),
+                str(catalog_version(self.nc_data.url)))
+
+    def __build_mesh(self) -> TriangularMesh:
+        variables = self.nc_data.dataset.variables
+        centres = {}
+        if 'latc' in variables and 'lonc' in variables:
+            centres = {
+                'latc': self.nc_data.get_dataset_variable('latc')[:],
+                'lonc': self.nc_data.get_dataset_variable('lonc')[:],
+            }
+
+        return TriangularMesh(
+            self.nc_data.get_dataset_variable('lat')[:],
+            self.nc_data.get_dataset_variable('lon')[:],
+            self.nc_data.get_dataset_variable('nv')[:],
+            **centres
+        )
 
-        if self._kdt[index] is None:
-            latvals = latvar[:] * RAD_FACTOR
-            lonvals = lonvar[:] * RAD_FACTOR
-            clat, clon = np.cos(latvals), np.cos(lonvals)
-            slat, slon = np.sin(latvals), np.sin(lonvals)
-            triples = np.array([np.ravel(clat * clon), np.ravel(clat * slon),
-                                np.ravel(slat)]).transpose()
-            self._kdt[index] = KDTree(triples)
-            del clat, clon
-            del slat, slon
-            del triples
-
-        if not hasattr(lat, "__len__"):
-            lat = [lat]
-            lon = [lon]
-
-        lat = np.array(lat)
-        lon = np.array(lon)
-
-        lat_rad = lat * RAD_FACTOR
-        lon_rad = lon * RAD_FACTOR
-        clat, clon = np.cos(lat_rad), np.cos(lon_rad)
-        slat, slon = np.sin(lat_rad), np.sin(lon_rad)
-        q = np.array([clat * clon, clat * slon, slat]).transpose()
-
-        dist_sq_min, minindex_1d = self._kdt[index].query(np.float32(q), k=n)
-        return np.squeeze(minindex_1d), dist_sq_min * EARTH_RADIUS
+    def __weights(self, lat, lon, element: bool) -> MeshWeights:
+        return mesh_cache.weights(self.__mesh_key(), self.__mesh(), lat, lon, element)
 
     def __bounding_box(self, lat, lon, element=False, n=10):
-        index, d = self.__find_index(lat, lon, element, n)
+        index, d = self.__mesh().nearest(lat, lon, element, n)
 
         def fix_limits(data, limit):
             mx = np.amax(data)
@@ -181,70 +165,12 @@ class Fvcom(Model):
 
         return latvar, lonvar
 
-    def __resample(self, lat_in, lon_in, lat_out, lon_out, var, radius=50000):
-        if len(var.shape) == 2:
-            var = np.rollaxis(var, 0, 2)
-        elif len(var.shape) == 3:
-            var = np.rollaxis(var, 0, 3)
-            var = np.rollaxis(var, 0, 3)
-
-        origshape = var.shape
-        var = var.reshape([var.shape[0], -1])
-
-        def weight(r):
-            r = np.clip(r, np.finfo(r.dtype).eps, np.finfo(r.dtype).max)
-            return 1. / r  # ** 2
-
-        data = np.squeeze(var[:])
+    def __time(self, starttime, endtime=None):
+        time = self.nc_data.timestamp_to_time_index(starttime)
+        if endtime is not None:
+            time = slice(time, self.nc_data.timestamp_to_time_index(endtime) + 1)
 
-        masked_lon_in = np.ma.array(lon_in)
-        masked_lat_in = np.ma.array(lat_in)
-
-        output_def = pyresample.geometry.SwathDefinition(
-            lons=np.ma.array(lon_out),
-            lats=np.ma.array(lat_out)
-        )
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore", UserWarning)
-
-            if len(data.shape) == 2 and data.shape[1] != 1:
-                output = []
-                # multiple depths
-                for d in range(0, data.shape[1]):
-                    masked_lon_in.mask = masked_lat_in.mask = \
-                        data[:, d].view(np.ma.MaskedArray).mask
-                    input_def = pyresample.geometry.SwathDefinition(
-                        lons=masked_lon_in,
-                        lats=masked_lat_in
-                    )
-                    output.append(pyresample.kd_tree.resample_custom(
-                        input_def, data[:, d], output_def,
-                        radius_of_influence=float(radius),
-                        neighbours=10,
-                        weight_funcs=weight,
-                        fill_value=None, nprocs=4
-                    ))
-
-                output = np.ma.array(output).transpose()
-            else:
-                masked_lon_in.mask = masked_lat_in.mask = \
-                    var[:].view(np.ma.MaskedArray).mask
-                input_def = pyresample.geometry.SwathDefinition(
-                    lons=masked_lon_in,
-                    lats=masked_lat_in
-                )
-                output = pyresample.kd_tree.resample_custom(
-                    input_def, data, output_def,
-                    radius_of_influence=float(radius),
-                    neighbours=10,
-                    weight_funcs=weight,
-                    fill_value=None, nprocs=4
-                )
-
-        if len(origshape) == 3:
-            output = output.reshape(origshape[1:])
-
-        return np.squeeze(output)
+        return time
 
     def get_raw_point(self, latitude, longitude, depth, timestamp, variable):
         min_i, max_i, radius = self.__bounding_box(
@@ -272,156 +198,84 @@ class Fvcom(Model):
             data
         )
 
-    def get_point(self, latitude, longitude, depth, timestamp, variable,
-                  return_depth=False):
+    def get_point(self, latitude, longitude, depth, variable, starttime,
+                  endtime=None, return_depth=False):
         var = self.nc_data.get_dataset_variable(variable)
-        time = self.nc_data.timestamp_to_time_index(timestamp)
-        latvar, lonvar = self.__latlon_vars(variable)
-
-        min_i, max_i, radius = self.__bounding_box(
-            latitude, longitude,
-            'nele' in self.nc_data.get_dataset_variable(variable).dimensions,
-            10
-        )
+        time = self.__time(starttime, endtime)
 
         if not hasattr(latitude, "__len__"):
             latitude = np.array([latitude])
             longitude = np.array([longitude])
 
-        if depth == 'bottom':
-            depth = -1
+        weights = self.__weights(latitude, longitude, 'nele' in var.dimensions)
+        span = weights.span
+
+        depth = -1 if depth == 'bottom' else int(depth)
 
         if len(var.shape) == 3:
-            data = var[time, depth, min_i:max_i]
+            data = var[time, depth, span]
         else:
-            data = var[time, min_i:max_i]
+            data = var[time, span]
 
-        res = self.__resample(
-            latvar[min_i:max_i],
-            lonvar[min_i:max_i],
-            latitude, longitude,
-            data,
-            radius
-        )
+        res = np.squeeze(weights.apply(data, span.start))
 
         if return_depth:
-            d = self.__get_depths(variable, time, min_i, max_i)
-
-            res_d = self.__resample(
-                latvar[min_i:max_i],
-                lonvar[min_i:max_i],
-                latitude, longitude,
-                d,
-                radius
-            )
-
-            if len(latitude) > 1:
-                dep = res_d[:, depth]
-            else:
-                dep = res_d[depth]
+            d = self.__get_depths(variable, time, span, depth)
+            dep = np.squeeze(weights.apply(d, span.start))
 
             return res, dep
         return res
 
-    def __get_depths(self, variable, timestamp, min_i, max_i):
+    def __get_depths(self, variable, time, span: slice, level=slice(None)):
+        """Returns the depths (in metres, positive down) of the sigma levels
+        of a variable over a span of its nodes or elements.
+        """
         var = self.nc_data.get_dataset_variable(variable)
-        time = self.nc_data.timestamp_to_time_index(timestamp)
+        mesh = self.__mesh()
 
-        if 'nele' in var.dimensions:
-            # First, find indicies to cover the nodes
-            nv = self.nc_data.get_dataset_variable('nv')[:, min_i:max_i]
-            min_n, max_n = np.amin(nv), np.amax(nv)
-
-            if 'siglay' in var.dimensions:
-                sigma_var = 'siglay'
-            elif 'siglev' in var.dimensions:
-                sigma_var = 'siglev'
-            else:
-                return np.zeros(max_i - min_i)
-
-            radius = 50000
-
-            lat_in = self.nc_data.get_dataset_variable('lat')[min_n:max_n]
-            lon_in = self.nc_data.get_dataset_variable('lon')[min_n:max_n]
-            lat_out = self.nc_data.get_dataset_variable('latc')[min_i:max_i]
-            lon_out = self.nc_data.get_dataset_variable('lonc')[min_i:max_i]
-
-            sigma = self.__resample(
-                lat_in, lon_in,
-                lat_out, lon_out,
-                self.nc_data.get_dataset_variable(sigma_var)[:, min_n:max_n],
-                radius
-            ).transpose()
-            bath = self.__resample(
-                lat_in, lon_in,
-                lat_out, lon_out,
-                self.nc_data.get_dataset_variable('h')[min_n:max_n],
-                radius
-            )
-            surf = self.__resample(
-                lat_in, lon_in,
-                lat_out, lon_out,
-                self.nc_data.get_dataset_variable('zeta')[time, min_n:max_n],
-                radius
-            ).transpose()
-
-            if hasattr(time, "__len__"):
-                sigma = np.tile(sigma, (len(time), 1, 1))
-                sigma = np.rollaxis(sigma, 1, 0)
-
-            z = -1 * (sigma * (bath + surf) + surf)
-            return z
+        if 'siglay' in var.dimensions:
+            sigma_var = 'siglay'
+        elif 'siglev' in var.dimensions:
+            sigma_var = 'siglev'
         else:
-            if 'siglay' in var.dimensions:
-                sigma = self.nc_data.get_dataset_variable('siglay')[:, min_i:max_i]
-            elif 'siglev' in var.dimensions:
-                sigma = self.nc_data.get_dataset_variable('siglev')[:, min_i:max_i]
-            else:
-                return np.array([0] * (max_i - min_i))
+            return np.zeros(span.stop - span.start)
 
-            bath = self.nc_data.get_dataset_variable('h')[min_i:max_i]
-            surf = self.nc_data.get_dataset_variable('zeta')[time, min_i:max_i]
+        sigma = mesh.table(sigma_var,
+                           lambda: self.nc_data.get_dataset_variable(sigma_var)[:])
+        bath = mesh.table('h', lambda: self.nc_data.get_dataset_variable('h')[:])
 
-            if hasattr(time, "__len__"):
-                sigma = np.tile(sigma, (len(time), 1, 1))
-                sigma = np.rollaxis(sigma, 1, 0)
+        if 'nele' in var.dimensions:
+            sigma = mesh.table(sigma_var + '_elements', lambda: mesh.to_elements(sigma))
+            bath = mesh.table('h_elements', lambda: mesh.to_elements(bath))
+
+            # zeta is on the nodes: read the nodes of the elements only
+            nodes = mesh.triangles[span]
+            node_span = slice(int(nodes.min()), int(nodes.max()) + 1)
+            zeta = np.asarray(self.nc_data.get_dataset_variable('zeta')[time, node_span])
+            surf = zeta[..., nodes - node_span.start].mean(axis=-1)
+        else:
+            surf = np.asarray(self.nc_data.get_dataset_variable('zeta')[time, span])
 
-            z = -1 * (sigma * (bath + surf) + surf)
-            return z
+        sigma = sigma[level, span]
+        bath = bath[span]
+        if sigma.ndim == 2:
+            surf = surf[..., np.newaxis, :]
 
-    def get_profile(self, latitude, longitude, timestamp, variable):
-        latvar, lonvar = self.__latlon_vars(variable)
-        time = self.nc_data.timestamp_to_time_index(timestamp)
+        return -1 * (sigma * (bath + surf) + surf)
 
-        min_i, max_i, radius = self.__bounding_box(
-            latitude, longitude,
-            'nele' in self.nc_data.get_dataset_variable(variable).dimensions,
-            10
-        )
+    def get_profile(self, latitude, longitude, variable, starttime, endtime=None):
+        var = self.nc_data.get_dataset_variable(variable)
+        time = self.__time(starttime, endtime)
 
         if not hasattr(latitude, "__len__"):
             latitude = np.array([latitude])
             longitude = np.array([longitude])
 
-        data = self.nc_data.get_dataset_variable(variable)[time, :, min_i:max_i]
-        res = self.__resample(
-            latvar[min_i:max_i],
-            lonvar[min_i:max_i],
-            [latitude], [longitude],
-            data,
-            radius
-        )
-
-        d = self.__get_depths(variable, time, min_i, max_i)
-
-        res_d = self.__resample(
-            latvar[min_i:max_i],
-            lonvar[min_i:max_i],
-            [latitude], [longitude],
-            d,
-            radius
-        )
+        weights = self.__weights(latitude, longitude, 'nele' in var.dimensions)
+        span = weights.span
 
-        dep = res_d
+        res = np.squeeze(weights.apply(var[time, :, span], span.start))
+        dep = np.squeeze(weights.apply(self.__get_depths(variable, time, span),
+                                       span.start))
 
         return res, dep
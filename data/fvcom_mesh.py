@@ -0,0 +1,318 @@
+"""
+Interpolation on FVCOM unstructured (triangular) meshes.
+
+FVCOM variables are located either on the nodes of the mesh or on its
+elements (triangles, listed by the nv variable). Instead of a per-request
+pyresample search on each depth level, the element containing each target
+point is located once and the result is kept as MeshWeights:
+    * node variables are linearly interpolated with the barycentric
+      coordinates of the point in its element;
+    * element variables take the value of the element (FVCOM's finite
+      volume representation).
+Points outside the mesh (e.g. just off its coastline) that are within
+FALLBACK_RADIUS of it are inverse-distance weighted from their nearest nodes
+(or take the value of their nearest element), like the pyresample search
+this replaced. Points further away are masked.
+
+Meshes (with their KD-tree and the static sigma/bathymetry tables used to
+compute depths) are kept in ``mesh_cache`` and the weights of each target
+grid (e.g. a tile or a transect) in ``mesh_weights_cache``.
+"""
+
+import hashlib
+import threading
+from typing import Callable
+
+import numpy as np
+from cachetools import LRUCache
+from pykdtree.kdtree import KDTree
+
+RAD_FACTOR = np.pi / 180.0
+EARTH_RADIUS = 6378137.0
+
+# Number of nearest elements searched for the one containing a point
+CANDIDATES = 8
+# Tolerance on barycentric coordinates for points on an element's edge
+EDGE_TOLERANCE = 1.e-9
+# Largest distance (metres) from the mesh of the points given a value
+FALLBACK_RADIUS = 50000
+# Number of nearest nodes weighted for points outside the mesh
+FALLBACK_NODES = 3
+
+
+def _xyz(lat, lon) -> np.ndarray:
+    lat = np.asarray(lat, dtype=np.float64).ravel() * RAD_FACTOR
+    lon = np.asarray(lon, dtype=np.float64).ravel() * RAD_FACTOR
+    clat = np.cos(lat)
+
+    return np.array([clat * np.cos(lon), clat * np.sin(lon), np.sin(lat)]).transpose()
+
+
+class MeshWeights:
+    """Interpolation weights of a set of target points.
+
+    Attributes:
+        indices {np.ndarray} -- (points, 3) node indices, or (points, 1)
+            element indices.
+        weights {np.ndarray} -- Weights of each index.
+        valid {np.ndarray} -- Whether each point is inside the mesh (or
+            within FALLBACK_RADIUS of it).
+    """
+
+    def __init__(self, indices: np.ndarray, weights: np.ndarray, valid: np.ndarray) -> None:
+        self.indices: np.ndarray = indices
+        self.weights: np.ndarray = weights
+        self.valid: np.ndarray = valid
+
+        for a in (self.indices, self.weights, self.valid):
+            a.setflags(write=False)  # Make immutable
+
+    @property
+    def span(self) -> slice:
+        """Smallest slice of nodes (or elements) covering all the points, so
+        that only that range has to be read.
+        """
+        used = self.indices[self.valid]
+        if used.size == 0:
+            return slice(0, 1)
+
+        return slice(int(used.min()), int(used.max()) + 1)
+
+    def apply(self, values, offset: int = 0) -> np.ma.MaskedArray:
+        """Interpolates values along their last axis.
+
+        Arguments:
+            values {np.ndarray} -- (..., nodes or elements) values.
+
+        Keyword Arguments:
+            offset {int} -- Index of the first node (or element) of values,
+                when only span was read. (default: {0})
+
+        Returns:
+            np.ma.MaskedArray -- (..., points) values, masked away from the
+                mesh or where a contributing value is masked.
+        """
+
+        values = np.ma.masked_invalid(np.ma.asarray(values, dtype=np.float64))
+        indices = np.where(self.valid[:, np.newaxis], self.indices - offset, 0)
+
+        picked = values[..., indices]
+        result = np.ma.sum(picked * self.weights, axis=-1)
+        mask = np.ma.getmaskarray(picked).any(axis=-1) | ~self.valid
+
+        return np.ma.array(np.ma.getdata(result), mask=mask)
+
+
+class TriangularMesh:
+    """An FVCOM mesh: node coordinates and element (triangle) connectivity.
+
+    Arguments:
+        lat {np.ndarray} -- Latitude of the nodes.
+        lon {np.ndarray} -- Longitude of the nodes.
+        nv {np.ndarray} -- (3, elements) 1-based node indices of the elements.
+
+    Keyword Arguments:
+        latc {np.ndarray} -- Latitude of the element centres. (default: {None})
+        lonc {np.ndarray} -- Longitude of the element centres. (default: {None})
+    """
+
+    def __init__(self, lat, lon, nv, latc=None, lonc=None) -> None:
+        self.lat: np.ndarray = np.asarray(lat, dtype=np.float64).ravel()
+        self.lon: np.ndarray = np.asarray(lon, dtype=np.float64).ravel()
+        self.triangles: np.ndarray = np.asarray(nv, dtype=np.intp).transpose() - 1
+
+        if latc is None or lonc is None:
+            latc = self.lat[self.triangles].mean(axis=1)
+            lonc = self.lon[self.triangles].mean(axis=1)
+        self.latc: np.ndarray = np.asarray(latc, dtype=np.float64).ravel()
+        self.lonc: np.ndarray = np.asarray(lonc, dtype=np.float64).ravel()
+
+        self.__trees: list = [None, None]
+        self.__tables: dict = {}
+        self.__lock = threading.Lock()
+
+    def tree(self, element: bool = False) -> KDTree:
+        """KD-tree over the nodes (or the element centres)."""
+        with self.__lock:
+            index = int(element)
+            if self.__trees[index] is None:
+                if element:
+                    self.__trees[index] = KDTree(_xyz(self.latc, self.lonc))
+                else:
+                    self.__trees[index] = KDTree(_xyz(self.lat, self.lon))
+
+            return self.__trees[index]
+
+    def nearest(self, lat, lon, element: bool = False, n: int = 1):
+        """Returns the indices of the n nearest nodes (or elements) of each
+        point and their distances in metres.
+        """
+        dist, index = self.tree(element).query(_xyz(lat, lon), k=n)
+
+        return index, dist * EARTH_RADIUS
+
+    def table(self, name: str, loader: Callable[[], np.ndarray]) -> np.ndarray:
+        """Returns a static per-mesh table (e.g. sigma levels or bathymetry),
+        calling loader() the first time.
+        """
+        with self.__lock:
+            table = self.__tables.get(name)
+        if table is None:
+            table = np.asarray(loader(), dtype=np.float64)
+            table.setflags(write=False)  # Make immutable
+            with self.__lock:
+                self.__tables[name] = table
+
+        return table
+
+    def to_elements(self, values) -> np.ndarray:
+        """Averages node values (along the last axis) onto the elements."""
+        return np.asarray(values)[..., self.triangles].mean(axis=-1)
+
+    def locate(self, lat, lon):
+        """Finds the element containing each point.
+
+        Returns:
+            tuple -- (element index, (points, 3) barycentric coordinates,
+                whether the point is inside the mesh)
+        """
+
+        lat = np.asarray(lat, dtype=np.float64).ravel()
+        lon = np.asarray(lon, dtype=np.float64).ravel()
+
+        k = min(CANDIDATES, self.triangles.shape[0])
+        _, candidates = self.tree(True).query(_xyz(lat, lon), k=k)
+        candidates = np.asarray(candidates, dtype=np.intp).reshape(lat.shape[0], k)
+
+        # Local planar coordinates (degrees, longitude scaled by cos(lat))
+        # of the candidate triangles relative to their first node.
+        nodes = self.triangles[candidates]                     # (points, k, 3)
+        scale = np.cos(self.lat[nodes[..., 0]] * RAD_FACTOR)
+
+        def planar(node_lat, node_lon):
+            dlon = (node_lon - self.lon[nodes[..., 0]] + 180.) % 360. - 180.
+            return dlon * scale, node_lat - self.lat[nodes[..., 0]]
+
+        bx, by = planar(self.lat[nodes[..., 1]], self.lon[nodes[..., 1]])
+        cx, cy = planar(self.lat[nodes[..., 2]], self.lon[nodes[..., 2]])
+        px, py = planar(lat[:, np.newaxis], lon[:, np.newaxis])
+
+        denom = bx * cy - cx * by
+        with np.errstate(divide='ignore', invalid='ignore'):
+            v = (px * cy - cx * py) / denom
+            w = (bx * py - px * by) / denom
+        u = 1. - v - w
+
+        inside = (u >= -EDGE_TOLERANCE) & (v >= -EDGE_TOLERANCE) & \
+            (w >= -EDGE_TOLERANCE) & (denom != 0)
+        first = np.argmax(inside, axis=1)
+        rows = np.arange(lat.shape[0])
+
+        element = candidates[rows, first]
+        bary = np.stack([u[rows, first], v[rows, first], w[rows, first]], axis=-1)
+        valid = inside[rows, first]
+
+        return element, np.nan_to_num(bary), valid
+
+    def weights(self, lat, lon, element: bool = False) -> MeshWeights:
+        """Computes the interpolation weights of a set of points, for node
+        variables or (element=True) element variables.
+        """
+        lat = np.asarray(lat, dtype=np.float64).ravel()
+        lon = np.asarray(lon, dtype=np.float64).ravel()
+        containing, bary, valid = self.locate(lat, lon)
+
+        if element:
+            indices = containing[:, np.newaxis]
+            weights = np.ones((containing.shape[0], 1))
+        else:
+            indices = self.triangles[containing]
+            weights = bary
+
+        outside = ~valid
+        if outside.any():
+            n = 1 if element else min(FALLBACK_NODES, self.lat.shape[0])
+            near, dist = self.nearest(lat[outside], lon[outside], element, n)
+            near = np.asarray(near, dtype=np.intp).reshape(-1, n)
+            dist = np.asarray(dist).reshape(-1, n)
+
+            # Inverse distance weights of the neighbours within the radius,
+            # the others point at the nearest one with no weight.
+            within = dist <= FALLBACK_RADIUS
+            w = np.where(within, 1. / np.maximum(dist, 1.), 0.)
+            total = w.sum(axis=1, keepdims=True)
+
+            indices[outside] = np.where(within, near, near[:, :1])
+            weights[outside] = np.divide(w, total, out=np.zeros_like(w), where=total > 0)
+            valid[outside] = within[:, 0]
+
+        return MeshWeights(indices, weights, valid)
+
+
+class MeshCache:
+    """LRU cache of meshes and of the weights of target grids on them."""
+
+    def __init__(self, maxsize: int = 8, weights_maxsize: int = 256) -> None:
+        self._meshes: LRUCache = LRUCache(maxsize=maxsize)
+        self._weights: LRUCache = LRUCache(maxsize=weights_maxsize)
+        self._lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def mesh(self, key, builder: Callable[[], TriangularMesh]) -> TriangularMesh:
+        """Returns the mesh for key, calling builder() on a miss."""
+        with self._lock:
+            mesh = self._meshes.get(key)
+        if mesh is None:
+            mesh = builder()
+            with self._lock:
+                self._meshes[key] = mesh
+
+        return mesh
+
+    def weights(self, key, mesh: TriangularMesh, lat, lon, element: bool = False) -> MeshWeights:
+        """Returns the weights of the points on the mesh (identified by key),
+        computing them on a miss.
+        """
+        lat = np.asarray(lat, dtype=np.float64).ravel()
+        lon = np.asarray(lon, dtype=np.float64).ravel()
+
+        h = hashlib.sha1(lat.tobytes())
+        h.update(lon.tobytes())
+        weights_key = (key, bool(element), h.hexdigest())
+
+        with self._lock:
+            weights = self._weights.get(weights_key)
+            if weights is not None:
+                self.hits += 1
+                return weights
+            self.misses += 1
+
+        weights = mesh.weights(lat, lon, element)
+        with self._lock:
+            self._weights[weights_key] = weights
+
+        return weights
+
+    def info(self) -> dict:
+        """Returns the hit/miss counters of the weights and the cache sizes.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'meshes': len(self._meshes),
+                'size': len(self._weights),
+                'maxsize': self._weights.maxsize,
+            }
+
+    def clear(self) -> None:
+        """Empties the cache and resets the counters."""
+        with self._lock:
+            self._meshes.clear()
+            self._weights.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+mesh_cache = MeshCache()
@@ -4,20 +4,26 @@ import numpy as np
 import pyresample
 from pint import UnitRegistry
 
+from data.bottom_index import LAND, bottom_index_cache, read_bottom
 from data.calculated import CalculatedData
 from data.model import Model
 from data.nearest_grid_point import find_nearest_grid_point
 from data.netcdf_data import NetCDFData
+from data.point_extraction import PointWindow
+from data.regular_grid import RegularGrid
+from utils.compute_budget import compute_limits
 from utils.errors import APIError
 
 
 class Mercator(Model):
     __depths = None
+    supports_point_windows = True
 
     def __init__(self, nc_data: Union[CalculatedData, NetCDFData]) -> None:
         super().__init__(nc_data)
         self.latvar = None
         self.lonvar = None
+        self.grid: RegularGrid = None
         self.nc_data = nc_data
         self._meta_only = nc_data.meta_only
         self.variables = nc_data.variables
@@ -28,6 +34,8 @@ class Mercator(Model):
         if not self._meta_only:
             if self.latvar is None:
                 self.latvar, self.lonvar = self.nc_data.latlon_variables
+                # None unless latitude and longitude are monotonic 1-D axes
+                self.grid = RegularGrid.from_variables(self.latvar, self.lonvar)
 
         return self
 
@@ -60,7 +68,12 @@ class Mercator(Model):
 
     def __bounding_box(self, lat, lon, n=10):
 
-        y, x, _ = find_nearest_grid_point(lat, lon, self.latvar, self.lonvar, n)
+        if self.grid is not None:
+            miny, maxy, minx, maxx = self.grid.bounding_box(lat, lon, int(n / 2))
+            return np.int64(miny), np.int64(maxy), np.int64(minx), np.int64(maxx), np.amax(50000)
+
+        y, x, _ = find_nearest_grid_point(
+            lat, lon, self.latvar, self.lonvar, n, self.nc_data.dataset_key)
 
         def fix_limits(data, limit):
             mx = np.amax(data)
@@ -79,7 +92,17 @@ class Mercator(Model):
 
         return np.int64(miny), np.int64(maxy), np.int64(minx), np.int64(maxx), np.amax(50000)
 
-    def __resample(self, lat_in, lon_in, lat_out, lon_out, var, radius=50000):
+    def __bottom_index(self, variable, var):
+        """Returns the (cached) bottom level index of a variable's grid.
+        """
+        return bottom_index_cache.get(self.nc_data.url, variable, var,
+                                      self.latvar, self.lonvar, self.nc_data.dataset_key)
+
+    def __resample(self, lat_in, lon_in, lat_out, lon_out, var, radius=50000,
+                   y: slice = None, x: slice = None):
+        if self.grid is not None and y is not None:
+            return self.__interpolate(lat_out, lon_out, var, y, x)
+
         var = np.squeeze(var)
         
         origshape = var.shape
@@ -91,23 +114,14 @@ class Mercator(Model):
                                                                                      var)
 
         if len(data.shape) == 3:
-            output = []
-            # multiple depths
-            for d in range(0, data.shape[2]):
-                grid_lat, grid_lon = np.meshgrid(
-                    masked_lat_in,
-                    masked_lon_in
-                )
-                grid_lat.mask = grid_lon.mask = \
-                    data[:, :, d].view(np.ma.MaskedArray).mask.transpose()
-                input_def = pyresample.geometry.SwathDefinition(
-                    lons=grid_lon,
-                    lats=grid_lat
-                )
-
-                output.append(self.nc_data.interpolate(input_def, output_def, data[:, :, d].transpose()))
-
-            output = np.ma.array(output).transpose()
+            # multiple depths and/or times: one neighbour search for all of them
+            grid_lat, grid_lon = np.meshgrid(
+                masked_lat_in,
+                masked_lon_in
+            )
+            output = self.nc_data.interpolate_levels(
+                grid_lon, grid_lat, output_def, data.transpose(1, 0, 2)
+            ).transpose()
         else:
             grid_lat, grid_lon = np.meshgrid(
                 masked_lat_in,
@@ -135,6 +149,40 @@ class Mercator(Model):
 
         return np.squeeze(output)
 
+    def __interpolate(self, lat_out, lon_out, var, y: slice, x: slice):
+        """ Interpolates (..., y, x) data of the rows y and columns x of the
+            grid in index space, returning the same layout as __resample.
+        """
+        output = self.grid.interpolate(
+            np.ma.asarray(var), lat_out, lon_out, self.nc_data.interp,
+            y, x, self.nc_data.radius, self.nc_data.neighbours
+        )
+
+        # Drop the squeezed axes and put the points first when there is a
+        # single stack of levels (times or depths).
+        output = output.reshape(tuple(s for s in output.shape[:-1] if s != 1) +
+                                output.shape[-1:])
+        if output.ndim == 2:
+            output = output.transpose()
+
+        return np.squeeze(output)
+
+    def point_grid(self, variable):
+        # Every variable is on the same grid
+        return None
+
+    def get_point_window(self, latitude, longitude, variable):
+        miny, maxy, minx, maxx, radius = self.__bounding_box(
+            latitude, longitude, 10)
+
+        return PointWindow(slice(miny, maxy), slice(minx, maxx),
+                           self.latvar[miny:maxy], self.lonvar[minx:maxx])
+
+    def interpolate_point_window(self, window, latitude, longitude, data):
+        return self.__resample(window.lat, window.lon,
+                               np.array([latitude]), np.array([longitude]), data,
+                               50000, window.y, window.x)
+
     def get_raw_point(self, latitude, longitude, depth, timestamp, variable):
         miny, maxy, minx, maxx, radius = self.__bounding_box(
             latitude, longitude, 10)
@@ -148,32 +196,9 @@ class Mercator(Model):
         time = self.nc_data.timestamp_to_time_index(timestamp)
 
         if depth == 'bottom':
-            if hasattr(time, "__len__"):
-                d = var[time[0], :, miny:maxy, minx:maxx]
-            else:
-                d = var[time, :, miny:maxy, minx:maxx]
-
-            reshaped = np.ma.masked_invalid(d.reshape([d.shape[0], -1]))
-
-            edges = np.array(np.ma.notmasked_edges(reshaped, axis=0))
-            depths = edges[1, 0, :]
-            indices = edges[1, 1, :]
-
-            if hasattr(time, "__len__"):
-                data_in = var[time, :, miny:maxy, minx:maxx]
-                data_in = data_in.reshape(
-                    [data_in.shape[0], data_in.shape[1], -1])
-                data = []
-                for i, t in enumerate(time):
-                    data.append(data_in[i, depths, indices])
-                data = np.ma.array(data).reshape([len(time), d.shape[-2],
-                                                  d.shape[-1]])
-            else:
-                data = np.ma.MaskedArray(np.zeros(d.shape[1:]),
-                                         mask=True,
-                                         dtype=d.dtype)
-                data[np.unravel_index(indices, data.shape)] = \
-                    reshaped[depths, indices]
+            bottom = self.__bottom_index(variable, var)[miny:maxy, minx:maxx]
+            data = read_bottom(var, time, bottom,
+                               slice(miny, maxy), slice(minx, maxx))
         else:
             if len(var.shape) == 4:
                 data = var[time, depth, miny:maxy, minx:maxx]
@@ -189,6 +214,7 @@ class Mercator(Model):
             data
         )
 
+    @compute_limits()
     def get_point(self, latitude, longitude, depth, variable, starttime,
                     endtime=None, return_depth=False):
 
@@ -212,47 +238,31 @@ class Mercator(Model):
         depth_value = None
         res = None
         if depth == 'bottom':
-            d = var[time_slice, :, miny:maxy, minx:maxx].values
-
-            d = np.rollaxis(d, 0, 4) # roll time to back
-            # compress lat, lon, time along depth axis
-            reshaped = np.ma.masked_invalid(d.reshape([d.shape[0], -1]))
-
-            # Find the bottom data values along depth axis.
-            edges = np.array(np.ma.notmasked_edges(reshaped, axis=0))
-            depths = edges[1, 0, :]
-            indices = edges[1, 1, :]
-
-            data = np.ma.MaskedArray(np.zeros(d.shape[1:]), # copy lat lon and time axis shapes
-                                        mask=True,
-                                        dtype=d.dtype)
-            data[np.unravel_index(indices, data.shape)] = \
-                reshaped[depths, indices]
-
-            # Roll time axis back to the front
-            data = np.rollaxis(data, 2, 0)
+            bottom = self.__bottom_index(variable, var)[miny:maxy, minx:maxx]
+            data = read_bottom(var, time_slice, bottom,
+                               slice(miny, maxy), slice(minx, maxx))
 
             res = self.__resample(
                 self.latvar[miny:maxy],
                 self.lonvar[minx:maxx],
                 [latitude], [longitude],
                 data,
-                radius
+                radius,
+                slice(miny, maxy), slice(minx, maxx)
             )
 
             if return_depth:
-                depth_values = np.ma.MaskedArray(np.zeros(d.shape[1:]),
-                                      mask=True,
-                                      dtype=self.depths.dtype)
-
-                depth_values[np.unravel_index(indices, depth_values.shape)] = self.depths[depths]
+                depth_values = np.ma.masked_all(bottom.shape, dtype=self.depths.dtype)
+                land = bottom == LAND
+                depth_values[~land] = self.depths[bottom[~land]]
 
                 dep = self.__resample(
                     self.latvar[miny:maxy],
                     self.lonvar[minx:maxx],
                     latitude, longitude,
-                    np.reshape(depth_values, data.shape),
-                    radius
+                    np.ma.array([depth_values] * data.shape[0]),
+                    radius,
+                    slice(miny, maxy), slice(minx, maxx)
                 )
 
         else:
@@ -266,7 +276,8 @@ class Mercator(Model):
                 self.lonvar[minx:maxx],
                 latitude, longitude,
                 data.values,
-                radius
+                radius,
+                slice(miny, maxy), slice(minx, maxx)
             )
 
             if return_depth:
@@ -279,6 +290,7 @@ class Mercator(Model):
             return res, depth_value
         return res
 
+    @compute_limits()
     def get_profile(self, latitude, longitude, variable, starttime, endtime=None):
         var = self.nc_data.get_dataset_variable(variable)
         # We expect the following shape (time, depth, lat, lon)
@@ -299,7 +311,8 @@ class Mercator(Model):
             self.lonvar[minx:maxx],
             [latitude], [longitude],
             var[time_slice, :, miny:maxy, minx:maxx].values,
-            radius
+            radius,
+            slice(miny, maxy), slice(minx, maxx)
         )
 
         return res, np.squeeze([self.depths] * len(latitude))
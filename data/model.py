@@ -11,6 +11,10 @@ class Model(metaclass=abc.ABCMeta):
     """Abstract base class for models.
     """
 
+    # Models that implement the point window hooks of data.point_extraction
+    # (point_grid, get_point_window and interpolate_point_window)
+    supports_point_windows = False
+
     def __init__(self, nc_data):
         self.nc_data = nc_data
 
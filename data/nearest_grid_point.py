@@ -7,15 +7,147 @@ Find Nearest Grid Point
 
 This module finds the indices of a point (or points) on a lat/lon grid that is
 closest to a specified lat/lon location.
+
+Building the KD-tree over a full model mesh (e.g. the 1021x1442 GIOPS grid) is
+far more expensive than querying it, so the trees are kept in a process-wide
+LRU cache (``grid_index_cache``) keyed by a fingerprint of the lat/lon
+variables. If the ``GRID_INDEX_CACHE_DIR`` setting is defined, the cartesian
+coordinates of each grid are also persisted to disk so that other worker
+processes can skip the trigonometry on their first request.
 """
 
+import hashlib
+import os
+import threading
 from math import pi
 
 import numpy as np
+from cachetools import LRUCache
 from pykdtree.kdtree import KDTree
 
+from utils.app_config import get_app_setting
+from utils.atomic_file import atomic_write
+
+
+class GridIndexCache:
+    """LRU cache of KD-trees built over lat/lon grids.
+
+    Entries are keyed by a fingerprint made of the dataset key, the names and
+    shapes of the lat/lon variables and their corner values, so two datasets
+    sharing variable names (e.g. nav_lat) but not grids never collide.
+    """
+
+    def __init__(self, maxsize: int = 8) -> None:
+        self._cache: LRUCache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.disk_hits: int = 0
+
+    def get(self, latvar, lonvar, dataset_key: str = ""):
+        """Returns the KD-tree and 2D grid shape for the given lat/lon
+        variables, building (and caching) the tree on a miss.
+
+        Arguments:
+            latvar {xarray.DataArray} -- Squeezed latitude variable.
+            lonvar {xarray.DataArray} -- Squeezed longitude variable.
+
+        Keyword Arguments:
+            dataset_key {str} -- Key of the dataset the grid belongs to. (default: {""})
+
+        Returns:
+            tuple -- (pykdtree.kdtree.KDTree, shape)
+        """
+
+        key = grid_fingerprint(latvar, lonvar, dataset_key)
+
+        with self._lock:
+            index = self._cache.get(key)
+            if index is not None:
+                self.hits += 1
+                return index
+            self.misses += 1
+
+        shape = _grid_shape(latvar, lonvar)
+
+        triples = self.__load(key)
+        if triples is None:
+            triples = _grid_triples(latvar, lonvar)
+            self.__save(key, triples)
+        else:
+            with self._lock:
+                self.disk_hits += 1
+
+        index = (KDTree(triples), shape)
+
+        with self._lock:
+            self._cache[key] = index
 
-def find_nearest_grid_point(lat, lon, latvar, lonvar, n=1):
+        return index
+
+    def info(self) -> dict:
+        """Returns the hit/miss counters and current size of the cache.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'size': len(self._cache),
+                'maxsize': self._cache.maxsize,
+            }
+
+    def clear(self) -> None:
+        """Empties the in-memory cache and resets the counters.
+        Persisted files are left untouched.
+        """
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+            self.disk_hits = 0
+
+    @staticmethod
+    def __path(key: str):
+        cache_dir = get_app_setting('GRID_INDEX_CACHE_DIR')
+        if not cache_dir:
+            return None
+
+        return os.path.join(cache_dir, key + ".npy")
+
+    def __load(self, key: str):
+        path = self.__path(key)
+        if path is None or not os.path.isfile(path):
+            return None
+
+        try:
+            return np.load(path)
+        except (OSError, ValueError):
+            return None
+
+    def __save(self, key: str, triples: np.ndarray) -> None:
+        path = self.__path(key)
+        if path is None:
+            return
+
+        def do_save(path, triples):
+            try:
+                # Written aside so other workers never load a partially
+                # written array
+                with atomic_write(path) as f:
+                    np.save(f, triples)
+            except OSError:
+                pass
+
+        t = threading.Thread(target=do_save, args=(path, triples))
+        t.daemon = True
+        t.start()
+
+
+grid_index_cache = GridIndexCache()
+
+
+def find_nearest_grid_point(lat, lon, latvar, lonvar, n=1, dataset_key=""):
     """Find the nearest grid point to a given lat/lon pair.
 
     Parameters
@@ -31,6 +163,9 @@ def find_nearest_grid_point(lat, lon, latvar, lonvar, n=1):
     n : int, optional
         Number of nearest grid points to return. Default is to return the
         single closest grid point.
+    dataset_key : str, optional
+        Key of the dataset the grid belongs to. Used to fingerprint the grid
+        in ``grid_index_cache``.
 
     Returns
     -------
@@ -50,6 +185,52 @@ def find_nearest_grid_point(lat, lon, latvar, lonvar, n=1):
     latvar = latvar.squeeze()
     lonvar = lonvar.squeeze()
 
+    kdt, shape = grid_index_cache.get(latvar, lonvar, dataset_key)
+    dist_sq, iy, ix = _find_index(lat, lon, kdt, shape, n)
+    # The results returned from _find_index are two-dimensional arrays (if
+    # n > 1) because it can handle the case of finding indices closest to
+    # multiple lat/lon locations (i.e., where lat and lon are arrays, not
+    # scalars). Currently, this function is intended only for a single lat/lon,
+    # so we redefine the results as one-dimensional arrays.
+    if n > 1:
+        return iy, ix, dist_sq
+    else:
+        return int(iy), int(ix), dist_sq
+
+
+def grid_fingerprint(latvar, lonvar, dataset_key: str) -> str:
+    """Computes the cache key of a lat/lon grid without reading the
+    whole coordinate arrays.
+    """
+
+    parts = [
+        str(dataset_key),
+        str(getattr(latvar, "name", "")),
+        str(getattr(lonvar, "name", "")),
+        str(latvar.shape),
+        str(lonvar.shape),
+    ]
+    for var in (latvar, lonvar):
+        first = (0,) * var.ndim
+        last = (-1,) * var.ndim
+        parts.append(str(np.asarray(var[first])))
+        parts.append(str(np.asarray(var[last])))
+
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+
+def _grid_shape(latvar, lonvar) -> tuple:
+    if latvar.ndim == 1:
+        return (latvar.size, lonvar.size)
+
+    return latvar.shape
+
+
+def _grid_triples(latvar, lonvar) -> np.ndarray:
+    """Converts a lat/lon grid into an array of cartesian (x, y, z) triples
+    on the unit sphere.
+    """
+
     rad_factor = pi / 180.0
     latvals = latvar[:] * rad_factor
     lonvals = lonvar[:] * rad_factor
@@ -76,22 +257,9 @@ def find_nearest_grid_point(lat, lon, latvar, lonvar, n=1):
         # shape.
         shape = (slat.size, slon.size)
         slat = np.broadcast_to(slat.values[:, np.newaxis], shape)
-    else:
-        shape = latvar.shape
-    triples = np.array([np.ravel(clat * clon), np.ravel(clat * slon),
-                        np.ravel(slat)]).transpose()
 
-    kdt = KDTree(triples)
-    dist_sq, iy, ix = _find_index(lat, lon, kdt, shape, n)
-    # The results returned from _find_index are two-dimensional arrays (if
-    # n > 1) because it can handle the case of finding indices closest to
-    # multiple lat/lon locations (i.e., where lat and lon are arrays, not
-    # scalars). Currently, this function is intended only for a single lat/lon,
-    # so we redefine the results as one-dimensional arrays.
-    if n > 1:
-        return iy, ix, dist_sq
-    else:
-        return int(iy), int(ix), dist_sq
+    return np.array([np.ravel(clat * clon), np.ravel(clat * slon),
+                     np.ravel(slat)]).transpose()
 
 
 def _find_index(lat0, lon0, kdt, shape, n=1):
@@ -4,10 +4,13 @@ import numpy as np
 import pyresample
 from pint import UnitRegistry
 
+from data.bottom_index import LAND, bottom_index_cache, read_bottom
 from data.calculated import CalculatedData
 from data.model import Model
 from data.nearest_grid_point import find_nearest_grid_point
 from data.netcdf_data import NetCDFData
+from data.point_extraction import PointWindow
+from utils.compute_budget import compute_limits
 from utils.errors import APIError
 
 
@@ -16,6 +19,7 @@ class Nemo(Model):
     """
 
     __depths = None
+    supports_point_windows = True
 
     def __init__(self, nc_data: Union[CalculatedData, NetCDFData]) -> None:
         super().__init__(nc_data)
@@ -57,7 +61,8 @@ class Nemo(Model):
     def __bounding_box(self, lat, lon, latvar, lonvar, n=10):
         """Computes and returns points bounding lat, lon.
         """
-        y, x, d = find_nearest_grid_point(lat, lon, latvar, lonvar, n)
+        y, x, d = find_nearest_grid_point(
+            lat, lon, latvar, lonvar, n, self.nc_data.dataset_key)
 
         def fix_limits(data, limit):
             mx = np.amax(data)
@@ -81,6 +86,13 @@ class Nemo(Model):
 
         return miny, maxy, minx, maxx, np.clip(np.amax(d), 5000, 50000)
 
+    def __bottom_index(self, variable, var):
+        """Returns the (cached) bottom level index of a variable's grid.
+        """
+        latvar, lonvar = self.__latlon_vars(variable)
+        return bottom_index_cache.get(self.nc_data.url, variable, var, latvar, lonvar,
+                                      self.nc_data.dataset_key)
+
     def __resample(self, lat_in, lon_in, lat_out, lon_out, var):
         """ Resamples data given lat/lon inputs and outputs
         """
@@ -95,22 +107,10 @@ class Nemo(Model):
                                                                                      var)
 
         if len(data.shape) == 3:
-            output = []
-            # multiple depths
-            for d in range(0, data.shape[2]):
-
-                masked_lon_in.mask = masked_lat_in.mask = \
-                    data[:, :, d].view(np.ma.MaskedArray).mask
-
-                input_def = pyresample.geometry.SwathDefinition(
-                    lons=masked_lon_in,
-                    lats=masked_lat_in,
-                    nprocs=8
-                )
-
-                output.append(self.nc_data.interpolate(input_def, output_def, data[:, :, d]))
-
-            output = np.ma.array(output).transpose()
+            # multiple depths and/or times: one neighbour search for all of them
+            output = self.nc_data.interpolate_levels(
+                masked_lon_in, masked_lat_in, output_def, data
+            ).transpose()
 
         else:
             masked_lon_in.mask = masked_lat_in.mask = \
@@ -136,8 +136,8 @@ class Nemo(Model):
 
         return np.squeeze(output)
 
-    def __latlon_vars(self, variable):
-        """ Returns the xarray.DataArray for latitude and longitude variables in the dataset.
+    def __latlon_keys(self, variable):
+        """ Returns the keys of the latitude and longitude variables of a variable.
         """
         # Get DataArray
         var = self.nc_data.get_dataset_variable(variable)
@@ -158,20 +158,39 @@ class Nemo(Model):
             coordinates = var.attrs['coordinates'].split()
             for p in pairs:
                 if p[0] in coordinates:
-                    return (
-                        self.nc_data.get_dataset_variable(p[0]),
-                        self.nc_data.get_dataset_variable(p[1])  # Check this
-                    )
+                    return (p[0], p[1])  # Check this
         else:
             for p in pairs:
                 if p[0] in self.nc_data.dataset.variables:
-                    return (
-                        self.nc_data.get_dataset_variable(p[0]),
-                        self.nc_data.get_dataset_variable(p[1])
-                    )
+                    return (p[0], p[1])
 
         raise LookupError("Cannot find latitude & longitude variables")
 
+    def __latlon_vars(self, variable):
+        """ Returns the xarray.DataArray for latitude and longitude variables in the dataset.
+        """
+        lat_key, lon_key = self.__latlon_keys(variable)
+
+        return (
+            self.nc_data.get_dataset_variable(lat_key),
+            self.nc_data.get_dataset_variable(lon_key)
+        )
+
+    def point_grid(self, variable):
+        return self.__latlon_keys(variable)
+
+    def get_point_window(self, latitude, longitude, variable):
+        latvar, lonvar = self.__latlon_vars(variable)
+        miny, maxy, minx, maxx, radius = self.__bounding_box(
+            latitude, longitude, latvar, lonvar, 10)
+
+        return PointWindow(slice(miny, maxy), slice(minx, maxx),
+                           latvar[miny:maxy, minx:maxx], lonvar[miny:maxy, minx:maxx])
+
+    def interpolate_point_window(self, window, latitude, longitude, data):
+        return self.__resample(window.lat, window.lon,
+                               np.array([latitude]), np.array([longitude]), data)
+
     def get_raw_point(self, latitude, longitude, depth, timestamp, variable):
         latvar, lonvar = self.__latlon_vars(variable)
         miny, maxy, minx, maxx, radius = self.__bounding_box(
@@ -186,32 +205,9 @@ class Nemo(Model):
         time = self.nc_data.timestamp_to_time_index(timestamp)
 
         if depth == 'bottom':
-            if hasattr(time, "__len__"):
-                d = var[time[0], :, miny:maxy, minx:maxx]
-            else:
-                d = var[time, :, miny:maxy, minx:maxx]
-
-            reshaped = np.ma.masked_invalid(d.reshape([d.shape[0], -1]))
-
-            edges = np.array(np.ma.notmasked_edges(reshaped, axis=0))
-            depths = edges[1, 0, :]
-            indices = edges[1, 1, :]
-
-            if hasattr(time, "__len__"):
-                data_in = var[time, :, miny:maxy, minx:maxx]
-                data_in = data_in.reshape(
-                    [data_in.shape[0], data_in.shape[1], -1])
-                data = []
-                for i, t in enumerate(time):
-                    data.append(data_in[i, depths, indices])
-                data = np.ma.array(data).reshape([len(time), d.shape[-2],
-                                                  d.shape[-1]])
-            else:
-                data = np.ma.MaskedArray(np.zeros(d.shape[1:]),
-                                         mask=True,
-                                         dtype=d.dtype)
-                data[np.unravel_index(indices, data.shape)] = \
-                    reshaped[depths, indices]
+            bottom = self.__bottom_index(variable, var)[miny:maxy, minx:maxx]
+            data = read_bottom(var, time, bottom,
+                               slice(miny, maxy), slice(minx, maxx))
         else:
             if len(var.shape) == 4:
                 data = var[time, depth, miny:maxy, minx:maxx]
@@ -224,6 +220,7 @@ class Nemo(Model):
             data
         )
 
+    @compute_limits()
     def get_point(self, latitude, longitude, depth, variable, starttime,
                   endtime=None, return_depth=False):
 
@@ -250,26 +247,9 @@ class Nemo(Model):
         depth_value = None
         res = None
         if depth == 'bottom':
-            d = var[time_slice, :, miny:maxy, minx:maxx].values
-
-            d = np.rollaxis(d, 0, 4) # roll time to back
-            # compress lat, lon, time along depth axis
-            reshaped = np.ma.masked_invalid(d.reshape([d.shape[0], -1]))
-
-            # Find the bottom data values along depth axis.
-            edges = np.array(np.ma.notmasked_edges(reshaped, axis=0))
-            depths = edges[1, 0, :]
-            indices = edges[1, 1, :]
-
-            data = np.ma.MaskedArray(np.zeros(d.shape[1:]),
-                                        mask=True,
-                                        dtype=d.dtype)
-
-            data[np.unravel_index(indices, data.shape)] = \
-                reshaped[depths, indices]
-
-             # Roll time axis back to the front
-            data = np.rollaxis(data, 2, 0)
+            bottom = self.__bottom_index(variable, var)[miny:maxy, minx:maxx]
+            data = read_bottom(var, time_slice, bottom,
+                               slice(miny, maxy), slice(minx, maxx))
 
             res = self.__resample(
                 latvar[miny:maxy, minx:maxx],
@@ -279,17 +259,15 @@ class Nemo(Model):
             )
 
             if return_depth:
-                depth_values = np.ma.MaskedArray(np.zeros(d.shape[1:]),
-                                      mask=True,
-                                      dtype=self.depths.dtype)
-
-                depth_values[np.unravel_index(indices, depth_values.shape)] = self.depths[depths]
+                depth_values = np.ma.masked_all(bottom.shape, dtype=self.depths.dtype)
+                land = bottom == LAND
+                depth_values[~land] = self.depths[bottom[~land]]
 
                 dep = self.__resample(
                     latvar[miny:maxy, minx:maxx],
                     lonvar[miny:maxy, minx:maxx],
                     latitude, longitude,
-                    np.reshape(depth_values, data.shape)
+                    np.ma.array([depth_values] * data.shape[0])
                 )
 
         else:
@@ -315,6 +293,7 @@ class Nemo(Model):
             return res, depth_value
         return res
 
+    @compute_limits()
     def get_profile(self, latitude, longitude, variable, starttime, endtime=None):
         var = self.nc_data.get_dataset_variable(variable)
         # We expect the following shape (time, depth, lat, lon)
@@ -1,9 +1,6 @@
 import datetime
 import os
 import sqlite3
-import uuid
-import warnings
-import zipfile
 from typing import List, Dict, Union, Set, Tuple
 
 import dateutil.parser
@@ -15,17 +12,26 @@ import pint
 import pyresample
 import xarray
 import xarray.core.variable
-from cachetools import TTLCache
 from flask_babel import format_date
 
 import data.calculated
+import data.catalog
 import data.utils
+from data.catalog import DatasetCatalog
+from data.chunking import PATH, POINT_SERIES, dataset_chunks
 from data.data import Data
+from data.dataset_pool import PooledDataset, dataset_pool
+from data.direct_read import DirectReader, DirectReadVariable, max_direct_bytes
 from data.nearest_grid_point import find_nearest_grid_point
+from data.resampling import resample, resample_levels
 from data.sqlite_database import SQLiteDatabase
+from data.subset_writer import write_subset
+from data.time_index import TimeIndex
+from data.timeseries_store import find_stores
 from data.variable import Variable
 from data.variable_list import VariableList
 from oceannavigator.dataset_config import DatasetConfig
+from utils.compute_budget import compute_limits, thread_budget
 
 
 class NetCDFData(Data):
@@ -39,68 +45,106 @@ class NetCDFData(Data):
         self.meta_only: bool = kwargs.get('meta_only', False)
         self.dataset: Union[xarray.Dataset, netCDF4.Dataset] = None
         self._variable_list: VariableList = None
-        self.__timestamp_cache: TTLCache = TTLCache(1, 3600)
         self._nc_files: list = []
         self._grid_angle_file_url: str = kwargs.get('grid_angle_file_url', "")
         self._time_variable: xarray.IndexVariable = None
+        self._time_index: TimeIndex = None
+        self._direct_reader: DirectReader = None
         self._dataset_open: bool = False
+        self._pool_entries: List[PooledDataset] = []
         self._dataset_key: str = kwargs.get('dataset_key', "")
+        self._access: str = kwargs.get('access')
         self._dataset_config: DatasetConfig = (
             DatasetConfig(self._dataset_key) if self._dataset_key else None
         )
 
     def __enter__(self):
         if not self.meta_only:
-            # Don't decode times since we do it anyways.
-            decode_times = False
-
-            if self._nc_files:
-                try:
-                    self.dataset = xarray.open_mfdataset(
-                        self._nc_files,
-                        decode_times=decode_times,
-                        chunks=200,
-                    )
-                except xarray.core.variable.MissingDimensionsError:
-                    # xarray won't open FVCOM files due to dimension/coordinate/variable label
-                    # duplication issue, so fall back to using netCDF4.Dataset()
-                    self.dataset = netCDF4.MFDataset(self._nc_files)
-            else:
-                try:
-                    # Handle list of URLs for staggered grid velocity field datasets
-                    url = self.url if isinstance(self.url, list) else [self.url]
-                    # This will raise a FutureWarning for xarray>=0.12.2.
-                    # That warning should be resolvable by changing to:
-                    # fields = xarray.open_mfdataset(self.url, combine="by_coords", decode_times=decode_times)
-                    fields = xarray.open_mfdataset(url, decode_times=decode_times)
-                except xarray.core.variable.MissingDimensionsError:
-                    # xarray won't open FVCOM files due to dimension/coordinate/variable label
-                    # duplication issue, so fall back to using netCDF4.Dataset()
-                    fields = netCDF4.Dataset(self.url)
-                if getattr(self._dataset_config, "geo_ref", {}):
-                    drop_variables = self._dataset_config.geo_ref.get("drop_variables", [])
-                    geo_refs = xarray.open_dataset(
-                        self._dataset_config.geo_ref["url"], drop_variables=drop_variables,
-                    )
-                    fields = fields.merge(geo_refs)
-                self.dataset = fields
-
-            if self._grid_angle_file_url:
-                angle_file = xarray.open_dataset(
-                    self._grid_angle_file_url,
-                    drop_variables=[self._dataset_config.lat_var_key, self._dataset_config.lon_var_key]
-                )
-                self.dataset = self.dataset.merge(angle_file)
-                angle_file.close()
-
+            # The opened (and merged) dataset is kept in a per-process pool
+            # so that consecutive requests don't re-open the same files.
+            entry = dataset_pool.acquire(self.__pool_key(), self.__open_dataset,
+                                         self.__pool_watched_files())
+            self._pool_entries.append(entry)
+            if entry.dataset is not self.dataset:
+                # Newly opened (or reopened after the files changed)
+                self._time_variable = None
+                self._time_index = None
+                self._direct_reader = None
+            self.dataset = entry.dataset
             self._dataset_open = True
 
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        if self._dataset_open:
-            self.dataset.close()
-            self._dataset_open = False
+        if self._pool_entries:
+            dataset_pool.release(self._pool_entries.pop())
+            self._dataset_open = bool(self._pool_entries)
+
+    def __pool_key(self) -> tuple:
+        url = tuple(self.url) if isinstance(self.url, list) else self.url
+        return (self._dataset_key, url, tuple(self._nc_files), self._grid_angle_file_url,
+                self._access)
+
+    def __pool_watched_files(self) -> list:
+        files = list(self._nc_files)
+        if not files:
+            files = list(self.url) if isinstance(self.url, list) else [self.url]
+        elif isinstance(self.url, str):
+            # sqlite index the file list was resolved from
+            files.append(self.url)
+        if getattr(self._dataset_config, "geo_ref", {}):
+            files.append(self._dataset_config.geo_ref["url"])
+        files.append(self._grid_angle_file_url)
+
+        return files
+
+    def __open_dataset(self) -> Union[xarray.Dataset, netCDF4.Dataset]:
+        # Don't decode times since we do it anyways.
+        decode_times = False
+
+        if self._nc_files:
+            # Dask chunks matching the files' chunking and the access hint
+            chunks = dataset_chunks(self._nc_files, self._access)
+            try:
+                dataset = xarray.open_mfdataset(
+                    self._nc_files,
+                    decode_times=decode_times,
+                    chunks=chunks if chunks is not None else 200,
+                )
+            except xarray.core.variable.MissingDimensionsError:
+                # xarray won't open FVCOM files due to dimension/coordinate/variable label
+                # duplication issue, so fall back to using netCDF4.Dataset()
+                dataset = netCDF4.MFDataset(self._nc_files)
+        else:
+            try:
+                # Handle list of URLs for staggered grid velocity field datasets
+                url = self.url if isinstance(self.url, list) else [self.url]
+                # This will raise a FutureWarning for xarray>=0.12.2.
+                # That warning should be resolvable by changing to:
+                # fields = xarray.open_mfdataset(self.url, combine="by_coords", decode_times=decode_times)
+                fields = xarray.open_mfdataset(url, decode_times=decode_times,
+                                               chunks=dataset_chunks(url, self._access))
+            except xarray.core.variable.MissingDimensionsError:
+                # xarray won't open FVCOM files due to dimension/coordinate/variable label
+                # duplication issue, so fall back to using netCDF4.Dataset()
+                fields = netCDF4.Dataset(self.url)
+            if getattr(self._dataset_config, "geo_ref", {}):
+                drop_variables = self._dataset_config.geo_ref.get("drop_variables", [])
+                geo_refs = xarray.open_dataset(
+                    self._dataset_config.geo_ref["url"], drop_variables=drop_variables,
+                )
+                fields = fields.merge(geo_refs)
+            dataset = fields
+
+        if self._grid_angle_file_url:
+            angle_file = xarray.open_dataset(
+                self._grid_angle_file_url,
+                drop_variables=[self._dataset_config.lat_var_key, self._dataset_config.lon_var_key]
+            )
+            dataset = dataset.merge(angle_file)
+            angle_file.close()
+
+        return dataset
 
     def __find_variable(self, candidates: list):
         """Finds a matching variable in the dataset given a list
@@ -157,9 +201,12 @@ class NetCDFData(Data):
             [int or ndarray] -- Time index(es).
         """
 
-        time_var = np.sort(self.time_variable.astype(np.int))
+        # Against the time values truncated to int, like the timestamps
+        # given to the clients
+        result = self.time_index.exact(timestamp, truncate=True)
 
-        result = np.nonzero(np.isin(time_var, timestamp))[0]
+        if np.ndim(result) == 0:
+            return result
 
         return result if result.shape[0] > 1 else result[0]
 
@@ -192,22 +239,27 @@ class NetCDFData(Data):
         time_range[0] = time_range[0].replace(tzinfo=None)
         time_range = [netCDF4.date2num(
             x, time_var.attrs['units']) for x in time_range]
-        time_range = [np.where(time_var.values == x)[0] for x in time_range]
+        time_range = [self.time_index.exact(x) for x in time_range]
 
         if len(time_range) == 1:  # Single Date
-            return int(str(time_range[0][0]))
+            return time_range[0]
         else:  # Multiple Dates
             date_formatted = {}
             i = 0
             for x in date.split(','):   # x is a single date
-                new_date = {x: int(str(time_range[i][0]))}
+                new_date = {x: time_range[i]}
                 date_formatted.update(new_date)  # Add Next pair
                 i += 1
             return date_formatted
 
 
-    def subset(self, query):
+    def subset(self, query, progress=None):
         """ Subsets a netcdf file with all depths
+
+            progress, if given, is called with the fraction of the output
+            written so far.
+
+            Returns the directory and name of the written NetCDF file.
         """
         # Ensure we have an output folder that will be cleaned by tmpreaper
         if not os.path.isdir("/tmp/subset"):
@@ -231,27 +283,15 @@ class NetCDFData(Data):
             # Time is in ISO 8601 format and we need the dataset quantum
 
             quantum = self._dataset_config.quantum
-            if quantum == 'day' or quantum == 'hour':
-                def find_time_index(isoDate: datetime.datetime):
-                    for idx, date in enumerate(self.timestamps):
-                        # Only compare year, month, day.
-                        # Some daily/hourly average datasets have an
-                        # hour and minute offset that messes up
-                        # the index search.
-                        if date.date() == isoDate.date():
-                            return idx
-
-            else:
-                def find_time_index(isoDate: datetime.datetime):
-                    for idx, date in enumerate(self.timestamps):
-                        # Only compare year and month
-                        if date.date().year == isoDate.date().year and \
-                                date.date().month == isoDate.date().month:
-                            return idx
+            # Only compare year, month, day for daily/hourly datasets since
+            # some daily/hourly average datasets have an hour and minute
+            # offset that messes up the index search. Otherwise only compare
+            # year and month.
+            period = 'day' if quantum in ('day', 'hour') else 'month'
 
             time_range = [dateutil.parser.parse(
                 x) for x in query.get('time').split(',')]
-            time_range = [find_time_index(x) for x in time_range]
+            time_range = [self.time_index.first_in_period(x, period) for x in time_range]
 
         apply_time_range = False
         if time_range[0] != time_range[1]:
@@ -278,14 +318,17 @@ class NetCDFData(Data):
         # will go directly to the underlying dataset and will not handle
         # calculated variables.
         if not entire_globe:
-            # Find closest indices in dataset corresponding to each calculated point
+            # Find closest indices in dataset corresponding to each calculated point.
+            # The second lookup reuses the grid index built by the first one.
             ymin_index, xmin_index, _ = find_nearest_grid_point(
                 bottom_left[0], bottom_left[1], self.get_dataset_variable(
-                    lat_var), self.get_dataset_variable(lon_var)
+                    lat_var), self.get_dataset_variable(lon_var),
+                dataset_key=self._dataset_key
             )
             ymax_index, xmax_index, _ = find_nearest_grid_point(
                 top_right[0], top_right[1], self.get_dataset_variable(
-                    lat_var), self.get_dataset_variable(lon_var)
+                    lat_var), self.get_dataset_variable(lon_var),
+                dataset_key=self._dataset_key
             )
 
             # Compute min/max for each slice in case the values are flipped
@@ -362,21 +405,20 @@ class NetCDFData(Data):
             GRID_RESOLUTION = 50
 
             # Regrids an input data array according to it's input grid definition
-            # to the output definition
+            # to the output definition. The nearest-neighbour search is cached by
+            # data.resampling, so it runs once for all the variables and levels.
             def regrid(data: np.ndarray,
                        input_def: pyresample.geometry.SwathDefinition,
                        output_def: pyresample.geometry.SwathDefinition):
 
                 orig_shape = data.shape
 
-                data = np.rollaxis(data, 0, 4)  # Roll time axis backward
-                data = np.rollaxis(data, 0, 4)  # Roll depth axis backward
-                # Merge time + depth axis together
-                data = data.reshape([data.shape[0], data.shape[1], -1])
+                # Merge time + depth axis together, behind the grid axes
+                data = np.moveaxis(data.reshape((-1,) + orig_shape[2:]), 0, -1)
 
                 # Perform regridding using nearest neighbour weighting
-                regridded = pyresample.kd_tree.resample_nearest(
-                    input_def, data, output_def, 50000, fill_value=None, nprocs=8)
+                regridded = resample(input_def, output_def, data, 'nearest', 50000, 1,
+                                     nprocs=thread_budget(), fill_value=None)
                 # Move merged axis back to front
                 regridded = np.moveaxis(regridded, -1, 0)
                 # Match target output grid (netcdf4 used to do this automatically but now it doesn't >.>)
@@ -469,12 +511,9 @@ class NetCDFData(Data):
                     u = ureg.kelvin
 
                 if u == ureg.kelvin:
-                    for i in range(0, len(subset[depth_var][:])):
-                        temp[:, i, :, :] = temp_data[:, i, :, :] - 273.15
+                    temp_data -= 273.15
 
-                else:
-                    for i in range(0, len(subset[depth_var][:])):
-                        temp[:, i, :, :] = temp_data[:, i, :, :]
+                temp[:] = temp_data
 
                 temp.valid_min = -100.0
                 temp.valid_max = 100.0
@@ -508,17 +547,10 @@ class NetCDFData(Data):
                 y_velo.units = "meter/sec"
                 y_velo.NAVO_code = 18
 
-            temp_file_name = working_dir + str(uuid.uuid4()) + ".nc"
-            subset.to_netcdf(temp_file_name)
-            subset.close()
-
-            # Reopen using netCDF4 to get non-encoded time values
-            subset = netCDF4.Dataset(temp_file_name, 'r')
-
             times = ds.createVariable('time', 'i', ('time',))
-            # Convert time from seconds to hours
-            for i in range(0, len(subset[time_var])):
-                times[i] = subset[time_var][i] / 3600
+            # Convert time from seconds to hours (the dataset is opened
+            # with decode_times=False, so these are the encoded values)
+            times[:] = subset[time_var].values / 3600
 
             times.long_name = "Validity time"
             times.units = "hours since 1950-01-01 00:00:00"
@@ -527,74 +559,39 @@ class NetCDFData(Data):
             ds.close()
             subset.close()
         else:
-            # Save subset normally
-            subset.to_netcdf(working_dir + filename +
-                             ".nc", format=output_format)
-
-        if int(query.get('should_zip')) == 1:
-            myzip = zipfile.ZipFile('%s%s.zip' % (
-                working_dir, filename), mode='w')
-            myzip.write('%s%s.nc' % (working_dir, filename),
-                        os.path.basename('%s%s.nc' % (working_dir, filename)))
-            myzip.comment = b"Generated from www.navigator.oceansdata.ca"
-            myzip.close()  # Must be called to actually create zip
-            return working_dir, filename+".zip"
+            # Save subset normally, one slab at a time
+            write_subset(subset, working_dir + filename + ".nc", output_format,
+                         progress=progress)
 
+        # Zipping (see should_zip) is done while the file is sent,
+        # by data.subset_writer.stream_zip.
         return working_dir, filename+".nc"
 
+    @compute_limits()
     def interpolate(self, input_def, output_def, data):
         """ Interpolates data given input and output definitions
             and the selected interpolation algorithm.
+
+            The neighbour search is cached by data.resampling, so repeated
+            requests on the same source and target grids (e.g. the same tile
+            for another timestep, depth or variable) only gather and weight.
+        """
+
+        return resample(input_def, output_def, data,
+                        self.interp, self.radius, self.neighbours, nprocs=thread_budget())
+
+    @compute_limits()
+    def interpolate_levels(self, lons, lats, output_def, data):
+        """ Interpolates a stack of levels (data.shape[-1]) on the grid
+            given by lons/lats with a single neighbour search, using
+            the selected interpolation algorithm.
+
+            Returns an array of shape (levels,) + output_def.shape.
         """
 
-        # Ignore pyresample warnings
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore", RuntimeWarning)
-            warnings.simplefilter("ignore", UserWarning)
-
-            # Interpolation with gaussian weighting
-            if self.interp == "gaussian":
-                return pyresample.kd_tree.resample_gauss(input_def, data,
-                                                         output_def, radius_of_influence=float(self.radius), sigmas=self.radius / 2, fill_value=None,
-                                                         nprocs=8)
-
-            # Bilinear weighting
-            elif self.interp == "bilinear":
-                """
-                    Weight function used to determine the effect of surrounding points
-                    on a given point
-                """
-                def weight(r):
-                    r = np.clip(r, np.finfo(r.dtype).eps,
-                                np.finfo(r.dtype).max)
-                    return 1. / r
-
-                return pyresample.kd_tree.resample_custom(input_def, data,
-                                                          output_def, radius_of_influence=float(self.radius), neighbours=self.neighbours, fill_value=None,
-                                                          weight_funcs=weight, nprocs=8)
-
-            # Inverse-square weighting
-            elif self.interp == "inverse":
-                """
-                    Weight function used to determine the effect of surrounding points
-                    on a given point
-                """
-                def weight(r):
-                    r = np.clip(r, np.finfo(r.dtype).eps,
-                                np.finfo(r.dtype).max)
-                    return 1. / r ** 2
-
-                return pyresample.kd_tree.resample_custom(input_def, data,
-                                                          output_def, radius_of_influence=float(self.radius), neighbours=self.neighbours, fill_value=None,
-                                                          weight_funcs=weight, nprocs=8)
-
-            # Nearest-neighbour interpolation (junk)
-            elif self.interp == "nearest":
-
-                return pyresample.kd_tree.resample_nearest(input_def, data,
-                                                           output_def, radius_of_influence=float(self.radius), nprocs=8)
-
-        raise ValueError(f"Unknown interpolation method {self.interp}.")
+        return resample_levels(lons, lats, output_def, data,
+                               self.interp, self.radius, self.neighbours,
+                               nprocs=thread_budget())
 
     @property
     def time_variable(self):
@@ -609,6 +606,26 @@ class NetCDFData(Data):
             ['time', 'time_counter', 'Times'])
         return self._time_variable
 
+    @property
+    def time_index(self) -> TimeIndex:
+        """Returns the sorted TimeIndex over the time variable, built once
+        per opened dataset.
+        """
+
+        if self._time_index is None:
+            var = self.time_variable
+            units = var.attrs['units'] if hasattr(var, 'attrs') else var.units
+            self._time_index = TimeIndex(var[:], units)
+
+        return self._time_index
+
+    @property
+    def dataset_key(self) -> str:
+        """Returns the key of the dataset in the dataset config
+        (empty string for datasets opened by URL).
+        """
+        return self._dataset_key
+
     @property
     def latlon_variables(self):
         """Finds the lat and lon variable arrays in the dataset.
@@ -626,24 +643,125 @@ class NetCDFData(Data):
     def dimensions(self) -> List[str]:
         """Return a list of the dimensions in the dataset.
         """
+        # Only from a catalog that is already built, listing the dimensions
+        # is cheaper than building one
+        catalog = data.catalog.cached_catalog(self.url)
+        if catalog is not None:
+            return catalog.dimensions
+
         # Handle possible list of URLs for staggered grid velocity field datasets
         url = self.url if not isinstance(self.url, list) else self.url[0]
 
-        if url.endswith(".sqlite3"):
-            try:
+        try:
+            if url.endswith(".sqlite3"):
                 with SQLiteDatabase(url) as db:
-                    dimension_list = db.get_all_dimensions()
-            except sqlite3.OperationalError:
-                pass
-            return dimension_list
+                    return db.get_all_dimensions()
 
-        # Open dataset (can't use xarray here since it doesn't like FVCOM files)
-        try:
+            # Open dataset (can't use xarray here since it doesn't like FVCOM files)
             with netCDF4.Dataset(url) as ds:
-                dimension_list = [dim for dim in ds.dimensions]
-        except FileNotFoundError:
-            dimension_list = []
-        return dimension_list
+                return [dim for dim in ds.dimensions]
+        except (OSError, sqlite3.OperationalError):
+            return []
+
+    @property
+    def catalog(self) -> DatasetCatalog:
+        """Returns the metadata catalog of the dataset, building it if there
+        is none for the current version of the dataset's files.
+        """
+        return data.catalog.get_catalog(self.url, self.build_catalog)
+
+    def build_catalog(self) -> DatasetCatalog:
+        """Builds the metadata catalog of the dataset from its sqlite index
+        and/or NetCDF files.
+        """
+        # Handle possible list of URLs for staggered grid velocity field datasets
+        url = self.url if not isinstance(self.url, list) else self.url[0]
+
+        if url.endswith(".sqlite3"):
+            with SQLiteDatabase(url) as db:
+                dimensions = db.get_all_dimensions()
+                variables = db.get_data_variables()
+                variable_keys = [v.key for v in db.get_all_variables()]
+
+                time_axes, variable_time_axis = data.catalog.time_axes(
+                    {v.key: db.get_timestamps(v.key) for v in variables})
+
+                # Coordinates are read from the most recent file holding them
+                coordinate_files = {}
+                for key in variable_keys:
+                    if key in self.depth_dimensions or key in ('time', 'time_counter'):
+                        timestamps = db.get_timestamps(key)
+                        coordinate_files[key] = db.get_netcdf_files(timestamps[-1:], [key])
+
+            default_time_axis = None
+        else:
+            # Open dataset (can't use xarray here since it doesn't like FVCOM files)
+            with netCDF4.Dataset(url) as ds:
+                dimensions = [dim for dim in ds.dimensions]
+
+            variables = self.__read_variable_list()
+
+            files = self.url if isinstance(self.url, list) else [self.url]
+            variable_keys = []
+            for f in files:
+                with netCDF4.Dataset(f) as ds:
+                    variable_keys.extend(k for k in ds.variables if k not in variable_keys)
+            coordinate_files = {key: files for key in variable_keys}
+
+            time_axes, variable_time_axis = [], {}
+            default_time_axis = None
+
+        time_units = None
+        for key in ('time', 'time_counter'):
+            time = self.__read_coordinate(coordinate_files.get(key, []), key)
+            if time is not None:
+                time_units = time[1]
+                if default_time_axis is None and not url.endswith(".sqlite3"):
+                    time_axes, default_time_axis = [[int(t) for t in time[0]]], 0
+                break
+
+        ureg = pint.UnitRegistry()
+        depths = {}
+        for key in self.depth_dimensions:
+            depth = self.__read_coordinate(coordinate_files.get(key, []), key)
+            if depth is not None:
+                values, units = depth
+                depths[key] = ureg.Quantity(
+                    values, ureg.parse_units(units.lower())).to(ureg.meters).magnitude.tolist()
+
+        latlon = [
+            next((k for k in ['nav_lat', 'latitude'] if k in variable_keys), None),
+            next((k for k in ['nav_lon', 'longitude'] if k in variable_keys), None),
+        ]
+
+        return DatasetCatalog(
+            dimensions, variables,
+            variable_keys=variable_keys,
+            depths=depths,
+            latlon=latlon,
+            time_units=time_units,
+            time_axes=time_axes,
+            variable_time_axis=variable_time_axis,
+            default_time_axis=default_time_axis,
+        )
+
+    @staticmethod
+    def __read_coordinate(files: list, key: str):
+        """Returns the (values, units) of a coordinate variable from the
+        first of the given files that holds it, or None.
+        """
+        for f in files:
+            try:
+                with netCDF4.Dataset(f) as ds:
+                    if key not in ds.variables:
+                        continue
+                    var = ds.variables[key]
+                    var.set_auto_mask(False)
+                    return np.asarray(var[:]).tolist(), getattr(var, 'units', "m")
+            except OSError:
+                continue
+
+        return None
 
     @property
     def depth_dimensions(self) -> List[str]:
@@ -695,8 +813,33 @@ class NetCDFData(Data):
     def get_dataset_variable(self, key: str):
         """
         Returns the value of a given variable name from the dataset
+
+        Variables opened through xarray are wrapped in a DirectReadVariable,
+        so that small selections are read from the files without dask.
         """
-        return self.dataset.variables[key]
+        variable = self.dataset.variables[key]
+
+        max_bytes = max_direct_bytes()
+        if max_bytes > 0 and isinstance(variable, xarray.Variable):
+            reader = self.__direct_reader()
+            if reader is not None:
+                return DirectReadVariable(variable, key, reader, max_bytes)
+
+        return variable
+
+    def __direct_reader(self) -> Union[DirectReader, None]:
+        if self._direct_reader is None:
+            if self._nc_files:
+                files = self._nc_files
+            elif isinstance(self.url, list):
+                files = self.url
+            elif isinstance(self.url, str) and not self.url.endswith(".sqlite3"):
+                files = [self.url]
+            else:
+                return None
+            self._direct_reader = DirectReader(files)
+
+        return self._direct_reader
 
     @property
     def variables(self) -> VariableList:
@@ -713,12 +856,13 @@ class NetCDFData(Data):
         if self._variable_list is not None:
             return self._variable_list
 
-        # Handle possible list of URLs for staggered grid velocity field datasets
-        url = self.url if not isinstance(self.url, list) else self.url[0]
-        if url.endswith(".sqlite3"):
-            with SQLiteDatabase(url) as db:
-                self._variable_list = db.get_data_variables()  # Cache the list for later
-                return self._variable_list
+        # Served from the catalog (which is shared between instances)
+        self._variable_list = self.catalog.variables  # Cache the list for later
+        return self._variable_list
+
+    def __read_variable_list(self) -> VariableList:
+        """Reads the data variables from the NetCDF file(s) of the dataset.
+        """
         try:
             # Handle possible list of URLs for staggered grid velocity field datasets
             url = self.url if isinstance(self.url, list) else [self.url]
@@ -726,14 +870,12 @@ class NetCDFData(Data):
             # That warning should be resolvable by changing to:
             # with xarray.open_mfdataset(url, combine="by_coords", decode_times=False) as ds:
             with xarray.open_mfdataset(url, decode_times=False) as ds:
-                self._variable_list = self._get_xarray_data_variables(ds)  # Cache the list for later
-            return self._variable_list
+                return self._get_xarray_data_variables(ds)
         except xarray.core.variable.MissingDimensionsError:
             # xarray won't open FVCOM files due to dimension/coordinate/variable label
             # duplication issue, so fall back to using netCDF4.Dataset()
             with netCDF4.Dataset(self.url) as ds:
-                self._variable_list = self._get_netcdf4_data_variables(ds)  # Cache the list for later
-            return self._variable_list
+                return self._get_netcdf4_data_variables(ds)
 
     @staticmethod
     def _get_xarray_data_variables(ds):
@@ -784,18 +926,8 @@ class NetCDFData(Data):
             Note: to get all timestamp values from a dataset,
             you must query the SQLiteDatabase.
         """
-        # If the timestamp cache is empty
-        if self.__timestamp_cache.get("timestamps") is None:
-
-            var = self.time_variable
-
-            # Convert timestamps to UTC
-            time_list = data.utils.time_index_to_datetime(np.sort(var), var.attrs['units'])
-            timestamps = np.array(time_list)
-            timestamps.setflags(write=False)  # Make immutable
-            self.__timestamp_cache["timestamps"] = timestamps
-
-        return self.__timestamp_cache.get("timestamps")
+        # Converted to UTC once per opened dataset
+        return self.time_index.datetimes
 
     def get_nc_file_list(self, datasetconfig: DatasetConfig, **kwargs: dict) -> Union[List, None]:
         try:
@@ -832,6 +964,14 @@ class NetCDFData(Data):
             if not timestamp:
                 raise RuntimeError("Error finding timestamp(s) in database.")
 
+            if self._access in (POINT_SERIES, PATH):
+                # Long time ranges are read from the time-contiguous stores
+                # (if they were built) instead of one file per timestep.
+                stores = find_stores(self.url, variables_to_load, timestamp)
+                if stores:
+                    self._nc_files = stores
+                    return
+
             file_list = db.get_netcdf_files(timestamp, variables_to_load)
             if not file_list:
                 raise RuntimeError("NetCDF file list is empty.")
@@ -0,0 +1,166 @@
+"""
+Batched extraction of timeseries at points.
+
+Timeseries and stick plots used to call get_timeseries_point once per
+point, variable and depth. Every call rebuilt the point's bounding box and
+read the whole time range through open_mfdataset, so a year-long plot cost
+points x variables x depths reads of every file.
+
+extract_timeseries computes each point's grid window once per lat/lon grid.
+It then reads the windows (all the depths at once) of each variable from
+each file of the time range in a thread pool, with one task per variable
+and file, and interpolates every (time, depth) level of a window at the
+same time.
+
+Models take part by setting supports_point_windows and implementing three
+hooks:
+    * point_grid(variable) -- key of the lat/lon grid of a variable
+    * get_point_window(latitude, longitude, variable) -- PointWindow
+    * interpolate_point_window(window, latitude, longitude, data)
+      -- (levels,) values of (levels, y, x) data
+Other models (FVCOM), and 'bottom' depths, go through get_timeseries_point
+as before.
+
+The number of threads is the POINT_EXTRACTION_THREADS setting (the request's
+thread budget, see utils.compute_budget, by default).
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils.app_config import get_app_setting
+from utils.compute_budget import thread_budget
+
+
+class PointWindow:
+    """The rows and columns of a grid around a point, and their coordinates.
+
+    Arguments:
+        y {slice} -- Rows of the window.
+        x {slice} -- Columns of the window.
+        lat {np.ndarray} -- Latitudes of the window (as the model uses them).
+        lon {np.ndarray} -- Longitudes of the window.
+    """
+
+    def __init__(self, y: slice, x: slice, lat, lon) -> None:
+        self.y: slice = y
+        self.x: slice = x
+        self.lat = lat
+        self.lon = lon
+
+
+def time_ranges(var, start: int, stop: int) -> list:
+    """Splits [start, stop) along the dask chunks of a variable's first
+    (time) dimension, which open_mfdataset never lets span two files.
+    """
+    chunks = getattr(var, 'chunks', None)
+    if not chunks:
+        return [(start, stop)]
+
+    bounds = np.cumsum((0,) + tuple(chunks[0]))
+    bounds = bounds[(bounds > start) & (bounds < stop)]
+    edges = [start] + [int(b) for b in bounds] + [stop]
+
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _values(data) -> np.ma.MaskedArray:
+    return np.ma.asarray(getattr(data, 'values', data))
+
+
+def _read_windows(var, times: tuple, depths: list, windows: list) -> list:
+    # One task: all the point windows of a variable in one file
+    result = []
+    for window in windows:
+        if len(var.shape) == 4:
+            key = (slice(*times), depths, window.y, window.x)
+        else:
+            key = (slice(*times), window.y, window.x)
+        result.append(_values(var[key]))
+
+    return result
+
+
+def _extract_each(dataset, points, variables, depths, starttime, endtime, length):
+    result = np.ma.masked_all((len(points), len(variables), len(depths), length))
+    for p, (lat, lon) in enumerate(points):
+        for v, variable in enumerate(variables):
+            for k, depth in enumerate(depths):
+                result[p, v, k] = np.ma.ravel(dataset.get_timeseries_point(
+                    lat, lon, depth, starttime, endtime, variable))
+
+    return result
+
+
+def extract_timeseries(dataset, points, variables, depths, starttime, endtime,
+                       max_workers: int = None) -> np.ma.MaskedArray:
+    """Extracts timeseries at points.
+
+    Arguments:
+        dataset {Model} -- Opened dataset (e.g. from data.open_dataset).
+        points {list} -- (latitude, longitude) of each point.
+        variables {list} -- Variable keys.
+        depths {list} -- Depth indices (or 'bottom').
+        starttime {int} -- First timestamp.
+        endtime {int} -- Last timestamp (included).
+
+    Keyword Arguments:
+        max_workers {int} -- Number of threads reading the files. (default:
+            POINT_EXTRACTION_THREADS setting, or the request's thread budget)
+
+    Returns:
+        np.ma.MaskedArray -- (point, variable, depth, time) values.
+    """
+
+    points = [(float(p[0]), float(p[1])) for p in points]
+    nc_data = dataset.nc_data
+    start = nc_data.timestamp_to_time_index(starttime)
+    stop = nc_data.timestamp_to_time_index(endtime) + 1
+    length = stop - start
+
+    if not dataset.supports_point_windows or \
+            not all(isinstance(d, (int, np.integer)) for d in depths):
+        return _extract_each(dataset, points, variables, depths, starttime, endtime, length)
+
+    if max_workers is None:
+        max_workers = get_app_setting('POINT_EXTRACTION_THREADS') or thread_budget()
+
+    depths = [int(d) for d in depths]
+
+    # Each point's window, once per lat/lon grid
+    grids = [dataset.point_grid(variable) for variable in variables]
+    windows = {}
+    for variable, grid in zip(variables, grids):
+        if grid not in windows:
+            windows[grid] = [dataset.get_point_window(lat, lon, variable)
+                             for lat, lon in points]
+
+    tasks = []
+    for v, (variable, grid) in enumerate(zip(variables, grids)):
+        var = nc_data.get_dataset_variable(variable)
+        for times in time_ranges(var, start, stop):
+            tasks.append((v, var, times, windows[grid]))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks)))) as executor:
+        futures = [executor.submit(_read_windows, var, times, depths, w)
+                   for _, var, times, w in tasks]
+        pieces = [f.result() for f in futures]
+
+    result = np.ma.masked_all((len(points), len(variables), len(depths), length))
+    for v, grid in enumerate(grids):
+        parts = [piece for task, piece in zip(tasks, pieces) if task[0] == v]
+
+        for p, (lat, lon) in enumerate(points):
+            data = np.ma.concatenate([part[p] for part in parts], axis=0)
+            if data.ndim == 3:
+                # No depth dimension: the same values at every depth
+                data = data[:, np.newaxis]
+            levels = data.shape[0] * data.shape[1]
+
+            values = np.ma.ravel(dataset.interpolate_point_window(
+                windows[grid][p], lat, lon,
+                data.reshape((levels,) + data.shape[2:])))
+            result[p, v] = values.reshape(data.shape[:2]).transpose()
+
+    return result
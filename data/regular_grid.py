@@ -0,0 +1,265 @@
+"""
+Interpolation on regular (rectilinear) latitude/longitude grids.
+
+When the latitude and longitude of a dataset are monotonic 1-D axes, the
+position of any point on the grid is found with arithmetic (uniform axes) or
+a binary search, so there is no need for a KD-tree over the broadcast mesh
+or for a pyresample neighbour search. Longitude axes spanning the globe wrap
+around.
+
+Methods (as the interp setting):
+    * nearest  -- value of the closest grid point
+    * bilinear -- bilinear interpolation between the four surrounding grid
+                  points, renormalized over the unmasked ones
+    * gaussian, inverse -- radial weighting (see data.resampling) of the
+                  nearest grid points of a small index-space window
+"""
+
+from typing import Union
+
+import numpy as np
+
+from data.resampling import search_neighbours, weight_function
+
+EARTH_RADIUS = 6378137.0
+RAD_FACTOR = np.pi / 180.0
+
+
+class RegularAxis:
+    """A monotonic 1-D coordinate axis.
+
+    Arguments:
+        values {np.ndarray} -- Coordinates (ascending or descending).
+
+    Keyword Arguments:
+        period {float} -- Period of the coordinate (360 for longitude), used
+            to wrap around when the axis covers a whole period. (default: {None})
+    """
+
+    def __init__(self, values, period: float = None) -> None:
+        self.values: np.ndarray = np.asarray(values, dtype=np.float64).ravel()
+        self.size: int = self.values.shape[0]
+        self.descending: bool = self.size > 1 and self.values[-1] < self.values[0]
+
+        ascending = self.values[::-1] if self.descending else self.values
+        self.__ascending: np.ndarray = ascending
+
+        steps = np.diff(ascending)
+        self.step: float = float(steps.mean()) if steps.size else 1.
+        self.uniform: bool = bool(steps.size) and \
+            np.allclose(steps, self.step, rtol=1.e-6, atol=1.e-9)
+
+        self.period: float = None
+        if period is not None and self.size > 1 and \
+                np.isclose(ascending[-1] - ascending[0] + self.step, period, atol=self.step / 2):
+            self.period = period
+
+    @staticmethod
+    def is_monotonic(values) -> bool:
+        values = np.asarray(values)
+        if values.ndim != 1 or values.shape[0] < 2 or not np.isfinite(values).all():
+            return False
+
+        steps = np.diff(values)
+        return bool((steps > 0).all() or (steps < 0).all())
+
+    def index(self, coords) -> np.ndarray:
+        """Returns the fractional indices of coordinates (NaN outside the
+        axis). On a periodic axis, indices in [size - 1, size) fall between
+        the last and the first coordinates.
+        """
+
+        coords = np.asarray(coords, dtype=np.float64)
+        ascending = self.__ascending
+        first = ascending[0]
+
+        if self.period is not None:
+            coords = first + np.mod(coords - first, self.period)
+
+        if self.uniform:
+            idx = (coords - first) / self.step
+        else:
+            i = np.clip(np.searchsorted(ascending, coords, side='right') - 1, 0, self.size - 2)
+            idx = i + (coords - ascending[i]) / (ascending[i + 1] - ascending[i])
+            if self.period is not None:
+                # Between the last coordinate and the first one (wrapped)
+                gap = first + self.period - ascending[-1]
+                last = coords >= ascending[-1]
+                idx = np.where(last, self.size - 1 + (coords - ascending[-1]) / gap, idx)
+
+        upper = self.size if self.period is not None else self.size - 1
+        tolerance = 1.e-6
+        idx = np.where((idx >= -tolerance) & (idx <= upper + tolerance),
+                       np.clip(idx, 0, upper), np.nan)
+        if self.period is not None:
+            idx = np.mod(idx, self.size)
+
+        if self.descending:
+            idx = self.size - 1 - idx
+            if self.period is not None:
+                idx = np.mod(idx, self.size)
+
+        return idx
+
+
+class RegularGrid:
+    """A grid made of a latitude and a longitude axis.
+
+    Arguments:
+        lat {np.ndarray} -- Monotonic 1-D latitudes.
+        lon {np.ndarray} -- Monotonic 1-D longitudes.
+    """
+
+    def __init__(self, lat, lon) -> None:
+        self.lat: RegularAxis = RegularAxis(lat)
+        self.lon: RegularAxis = RegularAxis(lon, period=360.)
+        self.shape: tuple = (self.lat.size, self.lon.size)
+
+    @classmethod
+    def from_variables(cls, latvar, lonvar) -> Union['RegularGrid', None]:
+        """Returns the grid of 1-D lat/lon variables, or None if they are
+        not monotonic 1-D axes.
+        """
+        lat = np.squeeze(np.asarray(latvar[:]))
+        lon = np.squeeze(np.asarray(lonvar[:]))
+        if not RegularAxis.is_monotonic(lat) or not RegularAxis.is_monotonic(lon):
+            return None
+
+        return cls(lat, lon)
+
+    def indices(self, lat, lon) -> tuple:
+        """Returns the fractional (y, x) indices of points."""
+        return (self.lat.index(np.ravel(lat)), self.lon.index(np.ravel(lon)))
+
+    def bounding_box(self, lat, lon, margin: int = 5) -> tuple:
+        """Returns the (miny, maxy, minx, maxx) index bounds (max exclusive)
+        of the grid points needed to interpolate at the given points.
+        """
+        fy, fx = self.indices(lat, lon)
+        ny, nx = self.shape
+
+        if np.isnan(fy).all() or np.isnan(fx).all():
+            return 0, min(ny, 2 * margin), 0, min(nx, 2 * margin)
+
+        miny = int(np.clip(np.floor(np.nanmin(fy)) - margin, 0, ny))
+        maxy = int(np.clip(np.ceil(np.nanmax(fy)) + margin + 1, 0, ny))
+
+        if self.lon.period is not None and (
+                np.nanmax(fx) + margin + 1 > nx or np.nanmin(fx) - margin < 0):
+            # Needs the neighbours across the wrap
+            return miny, maxy, 0, nx
+
+        minx = int(np.clip(np.floor(np.nanmin(fx)) - margin, 0, nx))
+        maxx = int(np.clip(np.ceil(np.nanmax(fx)) + margin + 1, 0, nx))
+
+        return miny, maxy, minx, maxx
+
+    def interpolate(self, data, lat, lon, interp: str, y: slice = slice(None),
+                    x: slice = slice(None), radius: float = 50000,
+                    neighbours: int = 10) -> np.ma.MaskedArray:
+        """Interpolates data at points.
+
+        Arguments:
+            data {np.ndarray} -- (..., y, x) data, on the rows and columns of
+                the grid given by y and x.
+            lat {np.ndarray} -- Latitudes of the points.
+            lon {np.ndarray} -- Longitudes of the points.
+            interp {str} -- nearest, bilinear, gaussian or inverse.
+
+        Keyword Arguments:
+            y {slice} -- Rows of the grid in data. (default: {slice(None)})
+            x {slice} -- Columns of the grid in data. (default: {slice(None)})
+            radius {float} -- Radius of influence in metres. (default: {50000})
+            neighbours {int} -- Neighbours used by inverse weighting. (default: {10})
+
+        Returns:
+            np.ma.MaskedArray -- (..., points) values, masked outside the grid.
+        """
+
+        data = np.ma.masked_invalid(np.ma.asarray(data))
+        lat = np.asarray(lat, dtype=np.float64).ravel()
+        lon = np.asarray(lon, dtype=np.float64).ravel()
+        fy, fx = self.indices(lat, lon)
+
+        y0, y1, _ = y.indices(self.shape[0])
+        x0, x1, _ = x.indices(self.shape[1])
+        wrap = self.lon.period is not None and x0 == 0 and x1 == self.shape[1]
+        outside = np.isnan(fy) | np.isnan(fx)
+        fy = np.where(outside, 0, fy)
+        fx = np.where(outside, 0, fx)
+
+        if interp == "nearest":
+            iy = np.rint(fy).astype(np.intp)[:, np.newaxis]
+            ix = np.rint(fx).astype(np.intp)[:, np.newaxis]
+            if wrap:
+                ix %= self.shape[1]
+            weights = np.ones(iy.shape)
+        elif interp == "bilinear":
+            iy0 = np.floor(fy).astype(np.intp)
+            ix0 = np.floor(fx).astype(np.intp)
+            dy = fy - iy0
+            dx = fx - ix0
+            iy = np.stack([iy0, iy0, iy0 + 1, iy0 + 1], axis=-1)
+            ix = np.stack([ix0, ix0 + 1, ix0, ix0 + 1], axis=-1)
+            if wrap:
+                ix %= self.shape[1]
+            weights = np.stack([(1 - dy) * (1 - dx), (1 - dy) * dx,
+                                dy * (1 - dx), dy * dx], axis=-1)
+        else:
+            iy, ix, weights = self.__radial_weights(lat, lon, fy, fx, interp,
+                                                    radius, neighbours, wrap)
+
+        # Grid points outside the grid or outside the data don't contribute
+        inside = (iy >= y0) & (iy < y1) & (ix >= x0) & (ix < x1)
+        iy = np.where(inside, iy - y0, 0)
+        ix = np.where(inside, ix - x0, 0)
+
+        values = data[..., iy, ix]                          # (..., points, k)
+        weights = np.where(inside & (weights > 0), weights, 0)
+        weights = np.where(np.ma.getmaskarray(values), 0, weights)
+
+        total = weights.sum(axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = (np.ma.getdata(values) * weights).sum(axis=-1) / total
+
+        mask = (total <= 0) | outside
+
+        return np.ma.array(np.where(mask, 0, result), mask=mask)
+
+    def __radial_weights(self, lat, lon, fy, fx, interp, radius, neighbours, wrap):
+        k = search_neighbours(interp, neighbours)
+        half = max(1, int(np.ceil((np.sqrt(k) - 1) / 2)) + 1)
+        offsets = np.arange(-half, half + 1)
+
+        iy = (np.rint(fy).astype(np.intp)[:, np.newaxis, np.newaxis] +
+              offsets[np.newaxis, :, np.newaxis])
+        ix = (np.rint(fx).astype(np.intp)[:, np.newaxis, np.newaxis] +
+              offsets[np.newaxis, np.newaxis, :])
+        iy, ix = np.broadcast_arrays(iy, ix)
+        iy = iy.reshape(lat.shape[0], -1)
+        ix = ix.reshape(lat.shape[0], -1)
+        if wrap:
+            ix = ix % self.shape[1]
+
+        # Great circle distances to the window's grid points
+        glat = self.lat.values[np.clip(iy, 0, self.shape[0] - 1)] * RAD_FACTOR
+        glon = self.lon.values[np.clip(ix, 0, self.shape[1] - 1)] * RAD_FACTOR
+        plat = lat[:, np.newaxis] * RAD_FACTOR
+        plon = lon[:, np.newaxis] * RAD_FACTOR
+        a = np.sin((glat - plat) / 2) ** 2 + \
+            np.cos(plat) * np.cos(glat) * np.sin((glon - plon) / 2) ** 2
+        dist = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+        dist = np.where((iy >= 0) & (iy < self.shape[0]) & (ix >= 0) &
+                        (ix < self.shape[1]), dist, np.inf)
+
+        # Keep the k nearest within the radius of influence
+        if k < dist.shape[1]:
+            nearest = np.argpartition(dist, k - 1, axis=1)[:, :k]
+            rows = np.arange(dist.shape[0])[:, np.newaxis]
+            iy, ix, dist = iy[rows, nearest], ix[rows, nearest], dist[rows, nearest]
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            weights = weight_function(interp, radius)(np.where(np.isfinite(dist), dist, 0))
+        weights = np.where(dist <= radius, weights, 0)
+
+        return iy, ix, weights
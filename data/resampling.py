@@ -0,0 +1,319 @@
+"""
+Resampling of model data onto target grids with reusable neighbour info.
+
+pyresample's resample_* helpers redo the kd-tree neighbour search on every
+call, although tiles and maps resample the same model window onto the same
+target grid for every timestep, depth and variable. Here the search
+(``get_neighbour_info``) is cached and only the gather + weighted sum
+(``get_sample_from_neighbour_info``) runs per call.
+"""
+
+import hashlib
+import threading
+import warnings
+
+import numpy as np
+import pyresample
+from cachetools import LRUCache
+
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+# Number of neighbours used by pyresample.kd_tree.resample_gauss
+GAUSSIAN_NEIGHBOURS = 8
+
+
+def _entry_size(entry: tuple) -> int:
+    return sum(a.nbytes for a in entry)
+
+
+def _hash_arrays(h, *arrays) -> None:
+    for a in arrays:
+        a = np.asanyarray(a)
+        data = np.ascontiguousarray(np.ma.getdata(a))
+        h.update(str((data.shape, data.dtype.str)).encode())
+        h.update(data.tobytes())
+        if np.ma.is_masked(a):
+            h.update(np.packbits(np.ma.getmaskarray(a)).tobytes())
+
+
+def grid_fingerprint(geo_def) -> str:
+    """Returns a hash of the coordinates (and mask) of a SwathDefinition.
+    """
+    h = hashlib.sha1()
+    _hash_arrays(h, geo_def.lons, geo_def.lats)
+
+    return h.hexdigest()
+
+
+class NeighbourInfoCache:
+    """LRU cache of pyresample neighbour info, bounded by the total number
+    of bytes held.
+
+    Entries are keyed by the source grid (including its land mask, since
+    masked points are excluded from the search), the target grid, the search
+    radius and the number of neighbours.
+    """
+
+    def __init__(self, maxbytes: int = MAX_CACHE_BYTES) -> None:
+        self._cache: LRUCache = LRUCache(maxsize=maxbytes, getsizeof=_entry_size)
+        self._lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, input_def, output_def, radius: float, neighbours: int, nprocs: int = 1) -> tuple:
+        """Returns (valid_input_index, valid_output_index, index_array, distance_array)
+        for the given geometries, running the neighbour search on a miss.
+        """
+
+        key = (
+            grid_fingerprint(input_def),
+            grid_fingerprint(output_def),
+            float(radius),
+            int(neighbours),
+        )
+
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = pyresample.kd_tree.get_neighbour_info(
+            input_def, output_def, float(radius),
+            neighbours=int(neighbours), nprocs=nprocs
+        )
+        for a in entry:
+            a.setflags(write=False)  # Shared between requests
+
+        with self._lock:
+            try:
+                self._cache[key] = entry
+            except ValueError:
+                # Larger than the whole cache; use it once without caching.
+                pass
+
+        return entry
+
+    def info(self) -> dict:
+        """Returns the hit/miss counters and memory usage of the cache.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._cache),
+                'bytes': self._cache.currsize,
+                'maxbytes': self._cache.maxsize,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+neighbour_info_cache = NeighbourInfoCache()
+
+
+def weight_function(interp: str, radius: float):
+    """Returns the radial weighting function f(distance) for the given
+    interpolation method.
+
+    Arguments:
+        interp {str} -- One of gaussian, bilinear, inverse or nearest.
+        radius {float} -- Radius of influence in metres.
+
+    Returns:
+        function or None -- None for nearest-neighbour.
+    """
+
+    if interp == "gaussian":
+        sigma = float(radius / 2)
+
+        def weight(r):
+            return np.exp(-r ** 2 / sigma ** 2)
+
+        return weight
+
+    if interp == "bilinear":
+        def weight(r):
+            r = np.clip(r, np.finfo(r.dtype).eps,
+                        np.finfo(r.dtype).max)
+            return 1. / r
+
+        return weight
+
+    if interp == "inverse":
+        def weight(r):
+            r = np.clip(r, np.finfo(r.dtype).eps,
+                        np.finfo(r.dtype).max)
+            return 1. / r ** 2
+
+        return weight
+
+    if interp == "nearest":
+        return None
+
+    raise ValueError(f"Unknown interpolation method {interp}.")
+
+
+def search_neighbours(interp: str, neighbours: int) -> int:
+    """Returns the number of neighbours searched for a given interpolation
+    method, matching what the pyresample.kd_tree.resample_* helpers used.
+    """
+    if interp == "gaussian":
+        return GAUSSIAN_NEIGHBOURS
+    if interp == "nearest":
+        return 1
+
+    return int(neighbours)
+
+
+def resample(input_def, output_def, data, interp: str, radius: float,
+             neighbours: int, nprocs: int = 1, fill_value=0):
+    """Resamples data from input_def onto output_def using cached
+    neighbour info.
+
+    Arguments:
+        input_def {pyresample.geometry.SwathDefinition} -- Source grid. Masked
+            coordinates are excluded from the neighbour search.
+        output_def {pyresample.geometry.SwathDefinition} -- Target grid.
+        data {np.ndarray} -- Data on the source grid, optionally with extra
+            trailing channels.
+        interp {str} -- gaussian, bilinear, inverse or nearest.
+        radius {float} -- Radius of influence in metres.
+        neighbours {int} -- Number of neighbours for bilinear/inverse weighting.
+
+    Keyword Arguments:
+        nprocs {int} -- Threads used by the neighbour search. (default: {1})
+        fill_value -- Value of undetermined nearest-neighbour points, None to
+            mask them. (default: {0})
+
+    Returns:
+        np.ndarray -- Resampled data (masked where undetermined, except for
+            nearest-neighbour which fills with fill_value like resample_nearest).
+    """
+
+    weight = weight_function(interp, radius)
+    k = search_neighbours(interp, neighbours)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        warnings.simplefilter("ignore", UserWarning)
+
+        valid_input_index, valid_output_index, index_array, distance_array = \
+            neighbour_info_cache.get(input_def, output_def, radius, k, nprocs)
+
+        if weight is None:
+            return pyresample.kd_tree.get_sample_from_neighbour_info(
+                'nn', output_def.shape, data,
+                valid_input_index, valid_output_index, index_array,
+                fill_value=fill_value
+            )
+
+        if np.ndim(data) > len(input_def.shape):
+            # One weight function per channel
+            weight = [weight] * data.shape[-1]
+
+        return pyresample.kd_tree.get_sample_from_neighbour_info(
+            'custom', output_def.shape, data,
+            valid_input_index, valid_output_index, index_array,
+            distance_array=distance_array, weight_funcs=weight, fill_value=None
+        )
+
+
+# Candidates searched by nearest-neighbour resampling of several levels whose
+# land masks differ, so that a valid point can be picked on every level.
+NEAREST_CANDIDATES = 8
+
+
+def resample_levels(lons, lats, output_def, data, interp: str, radius: float,
+                    neighbours: int, nprocs: int = 1):
+    """Resamples a stack of levels (depths and/or times) sharing one source
+    grid with a single neighbour search.
+
+    The search runs over the points that are valid on at least one level and
+    the weights are then masked per level, so each level only uses its own
+    valid points. When every level has the same mask the results are
+    identical to resampling each level separately.
+
+    Arguments:
+        lons {np.ndarray} -- Source longitudes, same shape as data.shape[:-1].
+        lats {np.ndarray} -- Source latitudes, same shape as data.shape[:-1].
+        output_def {pyresample.geometry.SwathDefinition} -- Target grid.
+        data {np.ma.MaskedArray} -- Source data with the levels on the last axis.
+        interp {str} -- gaussian, bilinear, inverse or nearest.
+        radius {float} -- Radius of influence in metres.
+        neighbours {int} -- Number of neighbours for bilinear/inverse weighting.
+
+    Keyword Arguments:
+        nprocs {int} -- Threads used by the neighbour search. (default: {1})
+
+    Returns:
+        np.ma.MaskedArray -- Array of shape (levels,) + output_def.shape.
+    """
+
+    weight = weight_function(interp, radius)
+    k = search_neighbours(interp, neighbours)
+
+    levels = data.shape[-1]
+    flat = np.ma.masked_invalid(data).reshape(-1, levels)
+    level_mask = np.ma.getmaskarray(flat)
+
+    # Search over points that are valid on at least one level
+    any_valid = ~level_mask.all(axis=1)
+    if weight is None and not (level_mask == level_mask[:, :1]).all():
+        k = NEAREST_CANDIDATES
+
+    input_def = pyresample.geometry.SwathDefinition(
+        lons=np.ma.array(np.ma.getdata(lons), mask=~any_valid.reshape(np.shape(lons))),
+        lats=np.ma.array(np.ma.getdata(lats), mask=~any_valid.reshape(np.shape(lats)))
+    )
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        warnings.simplefilter("ignore", UserWarning)
+
+        valid_input_index, valid_output_index, index_array, distance_array = \
+            neighbour_info_cache.get(input_def, output_def, radius, k, nprocs)
+
+    values = flat.filled(0)[valid_input_index]
+    masked = level_mask[valid_input_index]
+    if index_array.ndim == 1:
+        index_array = index_array[:, np.newaxis]
+        distance_array = distance_array[:, np.newaxis]
+
+    # pyresample marks missing neighbours with an index one past the end
+    out_of_range = index_array >= values.shape[0]
+    index = np.where(out_of_range, 0, index_array)
+
+    gathered = values[index]                                     # (out, k, levels)
+    valid = ~masked[index] & ~out_of_range[:, :, np.newaxis]    # (out, k, levels)
+
+    result = np.zeros((output_def.size, levels))
+    result_mask = np.ones((output_def.size, levels), dtype=bool)
+
+    if weight is None:
+        # Nearest valid candidate on each level, 0 where none is in range
+        # (like resample_nearest).
+        first = valid.argmax(axis=1)
+        found = valid.any(axis=1)
+        nearest = np.take_along_axis(gathered, first[:, np.newaxis, :], axis=1)[:, 0, :]
+        result[valid_output_index] = np.where(found, nearest, 0)
+        result_mask[:] = False
+    else:
+        distance = np.where(out_of_range, 1, distance_array)
+        w = weight(distance)[:, :, np.newaxis] * valid
+        norm = w.sum(axis=1)
+        total = (w * gathered).sum(axis=1)
+        ok = norm > 0
+        total[ok] /= norm[ok]
+        result[valid_output_index] = total
+        result_mask[valid_output_index] = ~ok
+
+    result = np.ma.array(result, mask=result_mask)
+    result = result.reshape(tuple(output_def.shape) + (levels,))
+
+    return np.moveaxis(result, -1, 0)
@@ -1,13 +1,104 @@
 #!/usr/bin/env python
 
 import itertools
+import os
 import re
 import sqlite3
-from typing import List
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+from cachetools import LRUCache
 
 from data.variable import Variable
 from data.variable_list import VariableList
 
+# Bytes of the index file memory-mapped by each connection
+MMAP_SIZE = 256 * 1024 * 1024
+
+# Statements kept compiled per connection
+CACHED_STATEMENTS = 64
+
+
+def _index_version(url: str) -> Tuple[int, int]:
+    """Returns the (mtime, size) of an index file, which changes whenever
+    the indexer updates it.
+    """
+    try:
+        st = os.stat(url)
+    except (OSError, TypeError, ValueError):
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class _ConnectionPool(threading.local):
+    """Read-only connections kept open per index file.
+
+    sqlite3 connections may only be used by the thread that created them,
+    so each thread has its own pool; a process forked from another (uwsgi
+    workers) also starts with an empty one. A connection is replaced when
+    its index file changes.
+    """
+
+    def __init__(self) -> None:
+        self.pid: int = os.getpid()
+        self.connections: Dict[str, tuple] = {}
+
+    def get(self, url: str, uri: str, version) -> sqlite3.Connection:
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.connections = {}
+
+        entry = self.connections.get(url)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        if entry is not None:
+            entry[1].close()
+
+        conn = sqlite3.connect(uri, uri=True, cached_statements=CACHED_STATEMENTS)
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE};")
+        self.connections[url] = (version, conn)
+
+        return conn
+
+
+_connection_pool = _ConnectionPool()
+
+
+class TimestampFileMap:
+    """In-memory timestamp -> filepath rows of one variable, sorted by
+    timestamp so that the files of any set or range of timestamps are found
+    with binary searches.
+    """
+
+    def __init__(self, rows: list) -> None:
+        rows = sorted(rows)
+        self.timestamps: np.ndarray = np.array([r[0] for r in rows], dtype=np.int64)
+        self.filepaths: np.ndarray = np.array([r[1] for r in rows], dtype=object)
+
+    def files(self, timestamps: List[int]) -> List[str]:
+        ts = np.asarray(timestamps, dtype=np.int64)
+        start = np.searchsorted(self.timestamps, ts, side='left')
+        end = np.searchsorted(self.timestamps, ts, side='right')
+
+        return list(itertools.chain.from_iterable(
+            self.filepaths[s:e] for s, e in zip(start, end) if e > s
+        ))
+
+    def unique_timestamps(self) -> List[int]:
+        return np.unique(self.timestamps).tolist()
+
+    def timestamp_range(self, starttime: int, endtime: int) -> List[int]:
+        start = np.searchsorted(self.timestamps, starttime, side='left')
+        end = np.searchsorted(self.timestamps, endtime, side='right')
+        return np.unique(self.timestamps[start:end]).tolist()
+
+
+# Keyed by (url, index version, variable), so maps are reloaded whenever
+# an index file is updated.
+_timestamp_file_maps: LRUCache = LRUCache(maxsize=64)
+_timestamp_file_maps_lock = threading.Lock()
+
 
 class SQLiteDatabase:
     """
@@ -17,6 +108,8 @@ class SQLiteDatabase:
     Note: databases are opened in READ-ONLY mode to prevent
     accidental writes. If you *really* need writes, this is not the
     class you're looking for. The URL parameter is treated as a URI.
+    Connections are kept open (per process and thread) between uses
+    and reopened when the index file changes.
     """
 
     def __init__(self, url: str):
@@ -25,19 +118,55 @@ class SQLiteDatabase:
         self.uri = f'file:{url}?mode=ro'
         self.conn = None  # sqlite connection handle
         self.c = None
+        self.version = None
 
     def __enter__(self):
-        self.conn = sqlite3.connect(self.uri, uri=True)
+        # Connections are pooled per process/thread and index file, and
+        # stay open after __exit__.
+        self.version = _index_version(self.url)
+        self.conn = _connection_pool.get(self.url, self.uri, self.version)
         self.c = self.conn.cursor()
 
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.conn.close()
+        self.c.close()
 
     def __flatten_list(self, some_list: list) -> list:
         return list(itertools.chain(*some_list))
 
+    def __timestamp_file_map(self, variable: str) -> TimestampFileMap:
+        """Returns the timestamp -> filepath map of a variable, loaded with a
+        single query once per version of the index file.
+        """
+
+        key = (self.url, self.version, variable)
+        with _timestamp_file_maps_lock:
+            file_map = _timestamp_file_maps.get(key)
+        if file_map is not None:
+            return file_map
+
+        self.c.execute(
+            """
+            SELECT
+                timestamp, filepath
+            FROM
+                TimestampVariableFilepath tvf
+                JOIN Filepaths fp ON tvf.filepath_id = fp.id
+                JOIN Variables v ON tvf.variable_id = v.id
+                JOIN Timestamps t ON tvf.timestamp_id = t.id
+            WHERE
+                variable = ?;
+            """, (variable, )
+        )
+        file_map = TimestampFileMap(self.c.fetchall())
+
+        if self.version is not None:
+            with _timestamp_file_maps_lock:
+                _timestamp_file_maps[key] = file_map
+
+        return file_map
+
     def get_netcdf_files(self, timestamp: List[int], variable: List[str]) -> List[str]:
         """Retrieves the netCDF files that are mapped to the given timestamp(s) and variable.
 
@@ -50,23 +179,8 @@ class SQLiteDatabase:
         """
 
         file_list = []
-
-        query = """
-        SELECT
-            filepath
-        FROM
-            TimestampVariableFilepath tvf
-            JOIN Filepaths fp ON tvf.filepath_id = fp.id
-            JOIN Variables v ON tvf.variable_id = v.id
-            JOIN Timestamps t ON tvf.timestamp_id = t.id
-        WHERE
-            variable = ?
-            AND timestamp = ?;
-        """
-        for ts in timestamp:
-            for v in variable:
-                self.c.execute(query, (v, ts))
-                file_list.append(self.__flatten_list(self.c.fetchall()))
+        for v in variable:
+            file_list.append(self.__timestamp_file_map(v).files(timestamp))
 
         # funky way to remove duplicates from the list: https://stackoverflow.com/a/7961390/2231969
         return list(set(self.__flatten_list(file_list)))
@@ -112,7 +226,9 @@ class SQLiteDatabase:
                 JOIN Variables v ON vd.variable_id = v.id
                 JOIN Dimensions d ON vd.dim_id = d.id
             WHERE
-                variable = ?;
+                variable = ?
+            ORDER BY
+                vd.rowid;
             """, (variable, )
         )
 
@@ -164,22 +280,7 @@ class SQLiteDatabase:
         if not variable:
             return None
 
-        self.c.execute(
-            """
-            SELECT DISTINCT
-                timestamp
-            FROM
-                TimestampVariableFilepath tvf
-                JOIN Timestamps ts ON tvf.timestamp_id = ts.id
-                JOIN Variables v ON tvf.variable_id = v.id
-            WHERE
-                variable = ?
-            ORDER BY
-                timestamp ASC;
-            """, (variable, )
-        )
-
-        return self.__flatten_list(self.c.fetchall())
+        return self.__timestamp_file_map(variable).unique_timestamps()
 
     def get_latest_timestamp(self, variable: str) -> int:
         """Returns the latest raw timestamp value for a given variable.
@@ -249,23 +350,9 @@ class SQLiteDatabase:
             [list] -- List of all timestamps in the given interval.
         """
 
-        self.c.execute(
-            """
-            SELECT DISTINCT
-                timestamp
-            FROM
-                TimestampVariableFilepath tvf
-                JOIN Variables v ON tvf.variable_id = v.id
-                JOIN Timestamps t ON tvf.timestamp_id = t.id
-            WHERE
-                variable = ?
-                AND timestamp BETWEEN ?
-                and ?;
-
-            """, (variable[0] if isinstance(variable, list) else variable, starttime, endtime, )
-        )
+        variable = variable[0] if isinstance(variable, list) else variable
 
-        return self.__flatten_list(self.c.fetchall())
+        return self.__timestamp_file_map(variable).timestamp_range(starttime, endtime)
 
     def get_all_variables(self) -> VariableList:
         """Retrieves all variables from the open database (including depth, time, etc.)
@@ -279,10 +366,35 @@ class SQLiteDatabase:
 
         result = self.c.fetchall()
 
-        l = [self.__build_variable_wrapper(v) for v in result]
+        dims = self.__get_all_variable_dims()
+
+        l = [self.__build_variable_wrapper(v, dims.get(v[0], [])) for v in result]
 
         return VariableList(l)
 
+    def __get_all_variable_dims(self) -> Dict[str, List[str]]:
+        """Returns the dimension names of every variable with one query.
+        """
+
+        self.c.execute(
+            """
+            SELECT
+                variable, name
+            FROM
+                VarsDims vd
+                JOIN Variables v ON vd.variable_id = v.id
+                JOIN Dimensions d ON vd.dim_id = d.id
+            ORDER BY
+                vd.rowid;
+            """
+        )
+
+        dims = {}
+        for variable, name in self.c.fetchall():
+            dims.setdefault(variable, []).append(name)
+
+        return dims
+
     def get_data_variables(self) -> VariableList:
         """Retrieves all data variables from the open database (i.e. depth, time, etc. are filtered out).
 
@@ -298,11 +410,12 @@ class SQLiteDatabase:
 
         return VariableList(result)
 
-    def __build_variable_wrapper(self, var_result: list) -> Variable:
+    def __build_variable_wrapper(self, var_result: list, dims: List[str]) -> Variable:
         """Builds a Variable object from a given row list.
 
         Arguments:
             var_result {list} -- A row from the Variable table in the sqlite database.
+            dims {list} -- The variable's dimension names.
 
         Returns:
             [Variable] -- constructed Variable object.
@@ -315,4 +428,4 @@ class SQLiteDatabase:
         valid_min = var_result[3] if var_result[3] != 1.17549e-38 else None
         valid_max = var_result[4] if var_result[4] != 3.40282e+38 else None
 
-        return Variable(name, long_name, units, self.get_variable_dims(name), valid_min, valid_max)
+        return Variable(name, long_name, units, dims, valid_min, valid_max)
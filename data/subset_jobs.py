@@ -0,0 +1,519 @@
+"""
+Asynchronous subset jobs.
+
+/api/v1.0/subset/ used to compute the whole subset inside the uwsgi worker
+that received the request, so a large export held one of the (8) workers for
+minutes. Subsets submitted to /api/v1.0/subset/jobs/ are instead run by a pool
+of subset worker processes, and the request returns a job id right away (the
+frontend then polls the job's status and downloads the result).
+/api/v1.0/subset/ is kept for scripts: it submits a job too and waits for it
+(see wait), so the subset isn't computed in the uwsgi worker either.
+The status of a job (queued, running, done or failed, with its progress) is
+kept in a JSON file, so it can be read from any uwsgi worker.
+
+Queries are normalized (dataset, sorted variables, bounding box, time range
+and output format, and the version of the dataset's files or index, so a
+re-indexed dataset gets new jobs) and hashed into the job id. Submitting a query that is
+already queued, running or done returns the existing job, and its result is
+served from the cache. The status file is created atomically, so identical
+queries received by different uwsgi workers are deduplicated too. Failed and
+stalled jobs are run again by the next submission. A job is stalled when its
+status hasn't been updated for SUBSET_JOB_TIMEOUT seconds, or when the
+process that holds it (the uwsgi worker whose pool it was queued in, then
+the subset worker running it) is gone. Jobs waiting for a slot update their
+status every HEARTBEAT_INTERVAL seconds.
+
+Results are kept in SUBSET_JOB_DIR/<job id>/ and the least recently used ones
+are removed when they take more than SUBSET_CACHE_BYTES.
+
+Each uwsgi worker starts its own pool of SUBSET_WORKERS processes, but a job
+only runs once it holds one of SUBSET_WORKERS lock files, so no more than
+SUBSET_WORKERS subsets run at a time on the host. The worker processes are
+niced (SUBSET_WORKER_NICE) and run with a thread budget of 1 (see
+utils.compute_budget), so exports use at most SUBSET_WORKERS cores and
+interactive tile and plot requests keep their priority.
+
+The workers are spawned with the SUBSET_WORKER_PYTHON interpreter (by
+default the one of the application; under uwsgi, sys.executable is the uwsgi
+binary). If a worker dies (e.g. killed for using too much memory), its
+pool's jobs are marked failed and a new pool is started for the next job.
+"""
+
+import fcntl
+import functools
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import re
+import shutil
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Tuple, Union
+
+from flask import Flask, current_app, has_app_context
+
+from utils.app_config import get_app_setting
+from utils.atomic_file import atomic_write, tmp_path
+from utils.compute_budget import compute_budget, compute_limits
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+DEFAULT_JOB_DIR = "/tmp/subset/jobs"
+DEFAULT_WORKERS = 2
+DEFAULT_CACHE_BYTES = 20 * 1024 ** 3
+DEFAULT_TIMEOUT = 6 * 3600  # seconds without an update before a job is stalled
+DEFAULT_NICE = 10
+
+PROGRESS_INTERVAL = 1.0  # seconds between progress updates of the status file
+SLOT_WAIT = 1.0  # seconds between attempts at taking a worker slot
+HEARTBEAT_INTERVAL = 60.0  # seconds between status updates of a waiting job
+
+_JOB_ID = re.compile(r'^[0-9a-f]{40}$')
+
+
+def job_dir() -> str:
+    """Returns the directory of the job status files and results.
+    """
+    return get_app_setting('SUBSET_JOB_DIR', DEFAULT_JOB_DIR)
+
+
+def dataset_version(dataset: str) -> Union[str, None]:
+    """Returns the version of a dataset's files (or sqlite index), see
+    data.catalog.catalog_version.
+    """
+    from data.catalog import catalog_version
+    from oceannavigator.dataset_config import DatasetConfig
+
+    version = catalog_version(DatasetConfig(dataset).url)
+    return json.dumps(version) if version is not None else None
+
+
+def normalize_query(query) -> dict:
+    """Returns the parts of a subset query that determine its output, in
+    a canonical form.
+
+    Raises:
+        ValueError -- A required parameter is missing.
+    """
+    normalized = {}
+    for key in ('dataset_name', 'variables', 'time', 'output_format'):
+        value = query.get(key)
+        if not value:
+            raise ValueError("Missing subset parameter %s." % key)
+        normalized[key] = value.strip()
+
+    variables = {v.strip() for v in normalized['variables'].split(',')}
+    normalized['variables'] = ','.join(sorted(v for v in variables if v))
+
+    times = [t.strip() for t in normalized['time'].split(',')]
+    normalized['time'] = ','.join(str(int(t)) if t.isdigit() else t for t in times)
+
+    for key in ('min_range', 'max_range'):
+        if query.get(key):
+            normalized[key] = ','.join('%.6f' % float(x) for x in query.get(key).split(','))
+
+    normalized['version'] = dataset_version(normalized['dataset_name'])
+
+    return normalized
+
+
+def job_id(query: dict) -> str:
+    """Returns the id of the job of a normalized query.
+    """
+    return hashlib.sha1(json.dumps(query, sort_keys=True).encode()).hexdigest()
+
+
+def _state_path(directory: str, jid: str) -> str:
+    return os.path.join(directory, jid + ".json")
+
+
+def _read_state(directory: str, jid: str) -> Union[dict, None]:
+    try:
+        with open(_state_path(directory, jid)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_state(directory: str, state: dict) -> None:
+    with atomic_write(_state_path(directory, state['job_id']), 'w') as f:
+        json.dump(state, f)
+
+
+def _create_state(directory: str, state: dict) -> bool:
+    # Written to a temporary file and linked into place, so the status file
+    # appears complete and only one of concurrent submissions creates it.
+    path = _state_path(directory, state['job_id'])
+    tmp = tmp_path(path)
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    try:
+        os.link(tmp, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp)
+
+
+def _update_state(directory: str, jid: str, **values) -> dict:
+    state = _read_state(directory, jid) or {'job_id': jid}
+    state.update(values, updated=time.time())
+    _write_state(directory, state)
+
+    return state
+
+
+def _result(directory: str, state: dict) -> Union[str, None]:
+    if state.get('status') != DONE or not state.get('filename'):
+        return None
+
+    path = os.path.join(directory, state['job_id'], state['filename'])
+    return path if os.path.isfile(path) else None
+
+
+def _owner() -> dict:
+    return {'host': socket.gethostname(), 'pid': os.getpid()}
+
+
+def _owner_alive(owner: Union[dict, None]) -> bool:
+    if not owner or owner.get('host') != socket.gethostname():
+        # Processes of other hosts can't be checked
+        return True
+
+    try:
+        os.kill(owner['pid'], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def _is_live(directory: str, state: dict) -> bool:
+    if state.get('status') == DONE:
+        return _result(directory, state) is not None
+    if state.get('status') in (QUEUED, RUNNING):
+        timeout = float(get_app_setting('SUBSET_JOB_TIMEOUT', DEFAULT_TIMEOUT))
+        return time.time() - state.get('updated', 0) < timeout and \
+            _owner_alive(state.get('owner'))
+
+    return False
+
+
+def _touch(directory: str, jid: str) -> None:
+    # The status file's mtime orders the results for eviction
+    try:
+        os.utime(_state_path(directory, jid))
+    except OSError:
+        pass
+
+
+def job_status(jid: str) -> Union[dict, None]:
+    """Returns the status of a job, or None if there is no such job.
+    """
+    if not _JOB_ID.match(jid):
+        return None
+
+    return _read_state(job_dir(), jid)
+
+
+def result_path(jid: str) -> Union[str, None]:
+    """Returns the path of the output of a finished job, or None if the job
+    is unknown or hasn't finished.
+    """
+    state = job_status(jid)
+    if state is None:
+        return None
+
+    directory = job_dir()
+    path = _result(directory, state)
+    if path is not None:
+        _touch(directory, jid)
+
+    return path
+
+
+def cached_result(query) -> Union[str, None]:
+    """Returns the path of the output of a finished job for the same
+    (normalized) query, if there is one.
+    """
+    try:
+        return result_path(job_id(normalize_query(query)))
+    except ValueError:
+        return None
+
+
+def wait(jid: str) -> Union[dict, None]:
+    """Waits for a job to finish, returning its last status: done, failed,
+    or still queued or running if it stalled. None if there is no such job.
+    """
+    directory = job_dir()
+    while True:
+        state = job_status(jid)
+        if state is None or state.get('status') in (DONE, FAILED) or \
+                not _is_live(directory, state):
+            return state
+        time.sleep(SLOT_WAIT)
+
+
+def submit(query) -> dict:
+    """Queues a subset query, unless the same query is already queued,
+    running or done.
+
+    Returns:
+        dict -- The status of the job.
+
+    Raises:
+        ValueError -- The query is missing a required parameter.
+    """
+    query = normalize_query(query)
+    jid = job_id(query)
+    directory = job_dir()
+    os.makedirs(directory, exist_ok=True)
+
+    now = time.time()
+    state = {
+        'job_id': jid,
+        'status': QUEUED,
+        'progress': 0.0,
+        'query': query,
+        'submitted': now,
+        'updated': now,
+        'owner': _owner(),
+    }
+
+    if not _create_state(directory, state):
+        current = _read_state(directory, jid)
+        if current is not None and _is_live(directory, current):
+            _touch(directory, jid)
+            return current
+
+        # Failed, stalled or evicted: run it again
+        shutil.rmtree(os.path.join(directory, jid), ignore_errors=True)
+        _write_state(directory, state)
+
+    try:
+        future = _executor().submit(_run_job, directory, jid, query)
+    except BrokenProcessPool:
+        # A worker died since the pool was checked, _executor starts a new one
+        future = _executor().submit(_run_job, directory, jid, query)
+    future.add_done_callback(functools.partial(_job_done, directory, jid, now))
+
+    return state
+
+
+def _job_done(directory: str, jid: str, submitted: float, future) -> None:
+    # _run_job records the failures of the subset, this records the ones of
+    # the pool (a worker that died, or a pool shut down)
+    if future.cancelled():
+        error = "Cancelled"
+    elif future.exception() is not None:
+        error = str(future.exception()) or type(future.exception()).__name__
+    else:
+        return
+
+    state = _read_state(directory, jid)
+    if state is not None and state.get('submitted') == submitted and \
+            state.get('status') in (QUEUED, RUNNING):
+        logger.error("Subset job %s failed: %s", jid, error)
+        _update_state(directory, jid, status=FAILED, error=error, finished=time.time())
+
+
+def evict(directory: str, max_bytes: int = None) -> None:
+    """Removes the least recently used finished jobs until the results take
+    at most max_bytes (the SUBSET_CACHE_BYTES setting by default).
+    """
+    if max_bytes is None:
+        max_bytes = int(get_app_setting('SUBSET_CACHE_BYTES', DEFAULT_CACHE_BYTES))
+
+    finished = []
+    for name in os.listdir(directory):
+        jid, ext = os.path.splitext(name)
+        if ext != ".json" or not _JOB_ID.match(jid):
+            continue
+        state = _read_state(directory, jid)
+        if state is None or state.get('status') not in (DONE, FAILED):
+            continue
+        try:
+            finished.append((os.stat(_state_path(directory, jid)).st_mtime, state))
+        except OSError:
+            continue
+
+    total = sum(s.get('size', 0) for _, s in finished)
+    for _, state in sorted(finished, key=lambda f: f[0]):
+        if total <= max_bytes:
+            break
+        if not state.get('size'):
+            continue
+        shutil.rmtree(os.path.join(directory, state['job_id']), ignore_errors=True)
+        try:
+            os.remove(_state_path(directory, state['job_id']))
+        except OSError:
+            pass
+        total -= state['size']
+
+
+def run_subset(query, progress: Callable[[float], None] = None) -> Tuple[str, str]:
+    """Computes a subset.
+
+    Returns:
+        tuple -- The directory and name of the written file.
+    """
+    from data import open_dataset
+    from data.chunking import SUBSET
+    from oceannavigator.dataset_config import DatasetConfig
+
+    config = DatasetConfig(query.get('dataset_name'))
+    time_range = query['time'].split(',')
+    variables = query['variables'].split(',')
+    with open_dataset(config, variable=variables, timestamp=int(time_range[0]),
+                      endtime=int(time_range[1]), access=SUBSET) as dataset:
+        return dataset.nc_data.subset(query, progress=progress)
+
+
+_app = None  # Set in the worker processes
+
+
+def _acquire_slot(directory: str, workers: int, heartbeat: Callable[[], None]):
+    # One lock file per concurrent job on the host
+    last = time.time()
+    while True:
+        for i in range(workers):
+            f = open(os.path.join(directory, "slot-%d.lock" % i), 'w')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f
+            except OSError:
+                f.close()
+
+        if time.time() - last >= HEARTBEAT_INTERVAL:
+            # Still waiting, not stalled
+            heartbeat()
+            last = time.time()
+        time.sleep(SLOT_WAIT)
+
+
+def _run_job(directory: str, jid: str, query: dict) -> None:
+    app = _app or Flask(__name__)
+    with app.app_context():
+        # The job now belongs to this process
+        _update_state(directory, jid, owner=_owner())
+        slot = _acquire_slot(directory, int(get_app_setting('SUBSET_WORKERS', DEFAULT_WORKERS)),
+                             lambda: _update_state(directory, jid))
+        try:
+            _update_state(directory, jid, status=RUNNING, started=time.time())
+
+            last = [0.0]
+
+            def progress(fraction: float) -> None:
+                now = time.time()
+                if now - last[0] >= PROGRESS_INTERVAL:
+                    last[0] = now
+                    _update_state(directory, jid, progress=round(fraction, 3))
+
+            try:
+                with compute_budget(1), compute_limits():
+                    working_dir, filename = run_subset(query, progress)
+
+                result_dir = os.path.join(directory, jid)
+                os.makedirs(result_dir, exist_ok=True)
+                path = os.path.join(result_dir, filename)
+                shutil.move(os.path.join(working_dir, filename), path)
+
+                _update_state(directory, jid, status=DONE, progress=1.0, filename=filename,
+                              size=os.path.getsize(path), finished=time.time())
+            except Exception as e:
+                logger.exception("Subset job %s failed", jid)
+                _update_state(directory, jid, status=FAILED, error=str(e),
+                              finished=time.time())
+        finally:
+            slot.close()
+
+        evict(directory)
+
+
+def _init_worker(config: dict) -> None:
+    # Gives the worker process the settings of the application
+    global _app
+    _app = Flask(__name__)
+    _app.config.update(config)
+
+    try:
+        os.nice(int(config.get('SUBSET_WORKER_NICE', DEFAULT_NICE)))
+    except OSError:
+        pass
+
+    import dask
+    dask.config.set(scheduler='synchronous')
+
+
+def _worker_config() -> dict:
+    if not has_app_context():
+        return {}
+
+    config = {}
+    for key, value in current_app.config.items():
+        try:
+            pickle.dumps(value)
+        except Exception:
+            continue
+        config[key] = value
+
+    return config
+
+
+def _python() -> str:
+    python = get_app_setting('SUBSET_WORKER_PYTHON')
+    if python:
+        return python
+
+    if sys.modules.get('uwsgi') is not None:
+        # sys.executable is the uwsgi binary, which can't run the workers
+        return os.path.join(sys.exec_prefix, "bin", "python3")
+
+    return sys.executable
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _executor() -> ProcessPoolExecutor:
+    # uwsgi forks its workers after loading the application, so each
+    # process starts its own pool. A pool whose worker died is broken for
+    # good, and is replaced.
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid() and getattr(_pool, '_broken', False):
+            logger.warning("Subset worker pool is broken, starting a new one.")
+            _pool.shutdown(wait=False)
+            _pool = None
+
+        if _pool is None or _pool_pid != os.getpid():
+            context = multiprocessing.get_context('spawn')
+            context.set_executable(_python())
+            _pool = ProcessPoolExecutor(
+                max_workers=int(get_app_setting('SUBSET_WORKERS', DEFAULT_WORKERS)),
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(_worker_config(),)
+            )
+            _pool_pid = os.getpid()
+
+        return _pool
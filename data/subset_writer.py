@@ -0,0 +1,195 @@
+"""
+Streaming output of subsets.
+
+xarray's to_netcdf computes every variable of a subset before writing it,
+so a large regional multi-day subset needed memory proportional to the
+output. write_subset writes each variable one slab (a single time and depth
+level) at a time, so only one slab is ever computed and held.
+
+NETCDF4 output is compressed with the SUBSET_COMPRESSION_LEVEL setting (zlib
+level, 0 disables) and chunked by slab. Like to_netcdf, variables are written
+with the encoding of the source (packed dtype, scale_factor and add_offset),
+and the dataset's unlimited_dims are unlimited.
+
+stream_zip produces a ZIP archive of the written file block by block, so the
+download can start immediately instead of after the archive was written to
+disk.
+"""
+
+import os
+import zipfile
+from typing import Callable, Iterator
+
+import netCDF4
+import numpy as np
+import xarray
+
+from utils.app_config import get_app_setting
+from utils.atomic_file import atomic_path
+
+DEFAULT_COMPRESSION_LEVEL = 4
+ZIP_COMMENT = b"Generated from www.navigator.oceansdata.ca"
+BLOCK_SIZE = 1024 * 1024
+
+# Attributes set by the library (or at variable creation) that can't be copied
+_RESERVED_ATTRS = {'_FillValue', '_NCProperties', '_Netcdf4Dimid', '_Netcdf4Coordinates'}
+
+
+def _output_dtype(dtype: np.dtype, file_format: str) -> np.dtype:
+    if file_format.startswith('NETCDF3') and dtype.kind in 'iu' and dtype.itemsize > 4:
+        # The classic formats have no 64-bit integers
+        return np.dtype(np.int32)
+
+    return dtype
+
+
+def _attrs(attrs: dict) -> dict:
+    return {k: v for k, v in attrs.items() if k not in _RESERVED_ATTRS and v is not None}
+
+
+def _pack(values: np.ndarray, dtype: np.dtype, fill_value, scale, offset) -> np.ndarray:
+    # Like xarray's CF encoding of (scale_factor, add_offset) packed variables
+    if values.dtype.kind != 'f':
+        return values.astype(dtype)
+
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    if offset is not None:
+        values = values - offset
+    if scale is not None:
+        values = values / scale
+    if dtype.kind in 'iu':
+        values = np.around(values)
+    if missing.any():
+        values[missing] = fill_value
+
+    return values.astype(dtype)
+
+
+def _slabs(shape: tuple):
+    # Index of each (time, depth, ...) slab of the last two dimensions
+    if len(shape) <= 2:
+        yield ()
+        return
+
+    yield from np.ndindex(*shape[:-2])
+
+
+def write_subset(subset: xarray.Dataset, path: str, file_format: str = 'NETCDF4',
+                 complevel: int = None, progress: Callable[[float], None] = None) -> None:
+    """Writes a dataset to a NetCDF file, computing one slab of a variable
+    at a time.
+
+    Arguments:
+        subset {xarray.Dataset} -- The (lazily loaded) subset.
+        path {str} -- Output file.
+
+    Keyword Arguments:
+        file_format {str} -- NetCDF format (as to_netcdf). (default: {'NETCDF4'})
+        complevel {int} -- zlib compression level of NETCDF4 files, the
+            SUBSET_COMPRESSION_LEVEL setting by default. (default: {None})
+        progress {callable} -- Called with the fraction of the slabs written
+            so far. (default: {None})
+    """
+
+    if any(v.dtype.kind not in 'iufb' for v in subset.variables.values()):
+        # Strings, dates and objects need xarray's encoding
+        subset.to_netcdf(path, format=file_format)
+        if progress is not None:
+            progress(1.0)
+        return
+
+    if complevel is None:
+        complevel = int(get_app_setting('SUBSET_COMPRESSION_LEVEL', DEFAULT_COMPRESSION_LEVEL))
+    compress = file_format.startswith('NETCDF4') and complevel > 0
+
+    total = sum(len(list(_slabs(v.shape))) for v in subset.variables.values() if v.ndim)
+    written = 0
+
+    with atomic_path(path) as tmp, netCDF4.Dataset(tmp, 'w', format=file_format) as nc:
+        unlimited = set(subset.encoding.get('unlimited_dims') or ())
+        for name, size in subset.sizes.items():
+            nc.createDimension(name, None if name in unlimited else size)
+        nc.setncatts(_attrs(subset.attrs))
+
+        for name, var in subset.variables.items():
+            dtype = _output_dtype(np.dtype(var.encoding.get('dtype', var.dtype)),
+                                  file_format)
+            scale = var.encoding.get('scale_factor')
+            offset = var.encoding.get('add_offset')
+            fill_value = var.encoding.get('_FillValue', var.attrs.get('_FillValue'))
+            if fill_value is None and (dtype.kind == 'f' or scale is not None or
+                                       offset is not None):
+                fill_value = netCDF4.default_fillvals[dtype.str[1:]]
+
+            options = {}
+            if compress and var.ndim >= 2:
+                options = {
+                    'zlib': True,
+                    'complevel': complevel,
+                    'shuffle': True,
+                    'chunksizes': (1,) * (var.ndim - 2) + var.shape[-2:],
+                }
+
+            out = nc.createVariable(name, dtype, var.dims, fill_value=fill_value,
+                                    **options)
+            # Values are packed here, like xarray would
+            out.set_auto_maskandscale(False)
+            out.setncatts(_attrs(var.attrs))
+            if scale is not None:
+                out.scale_factor = scale
+            if offset is not None:
+                out.add_offset = offset
+
+            if var.ndim == 0:
+                out.assignValue(_pack(np.asarray(var.values), dtype, fill_value, scale,
+                                      offset))
+                continue
+
+            for index in _slabs(var.shape):
+                out[index] = _pack(np.asarray(var[index].values), dtype, fill_value, scale,
+                                   offset)
+
+                written += 1
+                if progress is not None:
+                    progress(written / total)
+
+
+class _ZipOutput:
+    """Unseekable file object collecting what ZipFile writes."""
+
+    def __init__(self) -> None:
+        self.chunks: list = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_zip(path: str, arcname: str = None, block_size: int = BLOCK_SIZE) -> Iterator[bytes]:
+    """Yields a ZIP archive of a file as it is compressed, one block of the
+    file at a time.
+    """
+    output = _ZipOutput()
+
+    with zipfile.ZipFile(output, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.comment = ZIP_COMMENT
+        info = zipfile.ZipInfo.from_file(path, arcname or os.path.basename(path))
+        info.compress_type = zipfile.ZIP_DEFLATED
+
+        with open(path, 'rb') as src, zf.open(info, mode='w', force_zip64=True) as dest:
+            for block in iter(lambda: src.read(block_size), b""):
+                dest.write(block)
+                data = output.drain()
+                if data:
+                    yield data
+
+    yield output.drain()
@@ -0,0 +1,161 @@
+"""
+Sorted index over the time axis of an opened dataset.
+
+Resolving timestamps to time indices used to scan (and re-sort) the whole
+time variable on every call. TimeIndex sorts it once and answers exact,
+nearest, floor and range lookups with binary searches, and decodes the
+datetimes only once.
+
+Indices refer to the sorted time axis, like NetCDFData.timestamps.
+
+Timestamps sent by the clients are whole numbers (the sqlite index and the
+dataset catalogs truncate the time values to int), so exact lookups can be
+made against the truncated time axis, like the linear scan they replace.
+"""
+
+import datetime
+from typing import List, Union
+
+import numpy as np
+
+import data.utils
+
+
+class TimeIndex:
+    """O(log n) lookups on the values of a time variable.
+
+    Arguments:
+        values {np.ndarray} -- Raw values of the time variable.
+
+    Keyword Arguments:
+        units {str} -- CF time units (e.g. 'seconds since 1950-01-01 00:00:00'),
+            only needed for the decoded datetimes. (default: {None})
+    """
+
+    def __init__(self, values, units: str = None) -> None:
+        self.values: np.ndarray = np.sort(np.asarray(values).ravel())
+        self.values.setflags(write=False)
+        self.units: str = units
+        self.__datetimes: np.ndarray = None
+        self.__truncated: np.ndarray = None
+        self.__period_keys: dict = {}
+
+    def __len__(self) -> int:
+        return self.values.shape[0]
+
+    def exact(self, timestamp: Union[int, float, List], rtol: float = 0., atol: float = 0.,
+              truncate: bool = False):
+        """Returns the index of a timestamp, or the indices of a list of
+        timestamps (those not found are left out).
+
+        Arguments:
+            timestamp {int, float or list} -- Raw timestamp(s).
+
+        Keyword Arguments:
+            rtol {float} -- Relative tolerance for floating-point time axes. (default: {0.})
+            atol {float} -- Absolute tolerance. (default: {0.})
+            truncate {bool} -- Match against the time values truncated to int,
+                so 86400 finds 86400.5. (default: {False})
+
+        Raises:
+            IndexError -- If a single timestamp is not in the time axis.
+
+        Returns:
+            [int or ndarray] -- Time index(es).
+        """
+
+        if truncate:
+            # The first of the time values truncating to the timestamp
+            idx = np.clip(np.searchsorted(self.truncated, timestamp), 0, len(self) - 1)
+            found = self.truncated[idx] == timestamp
+        else:
+            idx = self.nearest(timestamp)
+            found = np.isclose(self.values[idx], timestamp, rtol=rtol, atol=atol) \
+                if rtol or atol else self.values[idx] == timestamp
+
+        if np.ndim(timestamp) == 0:
+            if not found:
+                raise IndexError(f"Timestamp {timestamp} is not in the time axis.")
+            return int(idx)
+
+        return idx[found]
+
+    def nearest(self, timestamp: Union[int, float, List]):
+        """Returns the index (or indices) of the closest timestamp(s).
+        """
+
+        timestamp = np.asarray(timestamp)
+        right = np.clip(np.searchsorted(self.values, timestamp), 1, len(self) - 1)
+        left = right - 1
+        if len(self) == 1:
+            right = left = np.zeros_like(right)
+
+        closer_left = np.abs(timestamp - self.values[left]) <= np.abs(self.values[right] - timestamp)
+        result = np.where(closer_left, left, right)
+
+        return int(result) if result.ndim == 0 else result
+
+    def floor(self, timestamp: Union[int, float]) -> int:
+        """Returns the index of the right-most timestamp <= the given one
+        (0 if all are greater), like data.utils.find_le.
+        """
+        return max(int(np.searchsorted(self.values, timestamp, side='right')) - 1, 0)
+
+    def range(self, starttime: Union[int, float], endtime: Union[int, float]) -> slice:
+        """Returns a slice of the timestamps in [starttime, endtime].
+        """
+        return slice(
+            int(np.searchsorted(self.values, starttime, side='left')),
+            int(np.searchsorted(self.values, endtime, side='right'))
+        )
+
+    @property
+    def truncated(self) -> np.ndarray:
+        """The time values truncated to int (still sorted).
+        """
+        if self.__truncated is None:
+            self.__truncated = self.values.astype(np.int64)
+            self.__truncated.setflags(write=False)  # Make immutable
+
+        return self.__truncated
+
+    @property
+    def datetimes(self) -> np.ndarray:
+        """The timestamps decoded to UTC datetimes (decoded once).
+        """
+        if self.__datetimes is None:
+            self.__datetimes = np.array(
+                data.utils.time_index_to_datetime(self.values, self.units))
+            self.__datetimes.setflags(write=False)  # Make immutable
+
+        return self.__datetimes
+
+    def first_in_period(self, date: datetime.datetime, period: str = 'day') -> Union[int, None]:
+        """Returns the index of the first timestamp in the same day
+        (or month) as date, or None if there is none.
+
+        Arguments:
+            date {datetime.datetime} -- Date to look for.
+
+        Keyword Arguments:
+            period {str} -- 'day' or 'month'. (default: {'day'})
+        """
+
+        keys = self.__period_keys.get(period)
+        if keys is None:
+            keys = np.array([self.__period_key(d, period) for d in self.datetimes])
+            self.__period_keys[period] = keys
+
+        target = self.__period_key(date, period)
+        idx = int(np.searchsorted(keys, target))
+        if idx < keys.shape[0] and keys[idx] == target:
+            return idx
+
+        return None
+
+    @staticmethod
+    def __period_key(date: datetime.datetime, period: str) -> int:
+        # Works for both datetime.datetime and cftime datetimes
+        if period == 'month':
+            return date.year * 100 + date.month
+        return (date.year * 100 + date.month) * 100 + date.day
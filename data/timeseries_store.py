@@ -0,0 +1,376 @@
+"""
+Time-contiguous replicas of dataset variables for long time-range reads.
+
+The NetCDF files of most datasets hold one timestep each, so a point
+timeseries or a hovmoller over a year opens hundreds of files (found through
+the sqlite index) and runs open_mfdataset over all of them. A timeseries store
+is a NetCDF4 copy of one variable of a dataset, with an unlimited time
+dimension and chunks that are long in time and small in space
+(TIME_CHUNK x 1 level x TILE x TILE). Reading a point's whole timeseries
+from it means reading a few chunks of a few files.
+
+Stores are optional. They are only used when the TIMESERIES_STORE_DIR setting
+is set, and are built and extended by scripts/build_timeseries_store.py as new
+files are indexed. A store only ever grows at the end of its time axis.
+Timesteps that aren't later than the last stored one are skipped.
+
+A store is a directory of segment files, named after the range of appends
+they hold (00000000-00000000.nc for the first one). Each append writes only
+the new timesteps, to a new segment that is linked into place once complete,
+so readers never see a partially written file and a segment is never
+written twice, even by builders on different hosts sharing the directory.
+When the last MERGE_SEGMENTS segments hold as many appends each, they are
+merged into one segment, so a store has a few segments (about
+MERGE_SEGMENTS per power of MERGE_SEGMENTS appends) and each timestep is
+only copied a few times. Readers use the widest segments covering the
+appends (see segments), and merged segments are deleted SUPERSEDED_GRACE
+seconds after they were replaced.
+
+NetCDFData routes a sqlite-indexed dataset to the stores when it is opened
+with the POINT_SERIES (or PATH) access hint for at least
+TIMESERIES_STORE_MIN_STEPS timesteps. All the requested variables must have a store, and the stores must
+share a time axis that holds every requested timestamp.
+
+Stores are saved in TIMESERIES_STORE_DIR/<sha1 of the index path>/<variable>/
+"""
+
+import contextlib
+import fcntl
+import glob
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from typing import List, Union
+
+import netCDF4
+import numpy as np
+from cachetools import LRUCache
+
+from utils.app_config import get_app_setting
+from utils.atomic_file import tmp_path
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".nc"
+DEFAULT_MIN_STEPS = 24
+MERGE_SEGMENTS = 4
+SUPERSEDED_GRACE = 3600  # seconds before merged segments are deleted
+
+TIME_CHUNK = 512
+TILE = 16
+
+
+def store_dir(url: str, base_dir: str = None) -> Union[str, None]:
+    """Returns the directory of the stores of a sqlite-indexed dataset, or
+    None if stores aren't enabled (see the TIMESERIES_STORE_DIR setting).
+    """
+    if not isinstance(url, str) or not url.endswith(".sqlite3"):
+        return None
+
+    base_dir = base_dir or get_app_setting('TIMESERIES_STORE_DIR')
+    if not base_dir:
+        return None
+
+    return os.path.join(base_dir, hashlib.sha1(os.path.abspath(url).encode()).hexdigest())
+
+
+def store_path(url: str, variable: str, base_dir: str = None) -> Union[str, None]:
+    """Returns the directory of the store of a variable of a dataset (see
+    store_dir).
+    """
+    directory = store_dir(url, base_dir)
+    if directory is None:
+        return None
+
+    return os.path.join(directory, variable)
+
+
+_SEGMENT = re.compile(r'^(\d+)-(\d+)' + re.escape(SEGMENT_SUFFIX) + '$')
+
+
+def _segment_name(first: int, last: int) -> str:
+    return "%08d-%08d%s" % (first, last, SEGMENT_SUFFIX)
+
+
+def _all_segments(path: str) -> list:
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return []
+
+    ranges = []
+    for name in names:
+        m = _SEGMENT.match(name)
+        if m:
+            ranges.append((int(m.group(1)), int(m.group(2))))
+
+    return ranges
+
+
+def _covering(ranges: list) -> list:
+    # The widest segments holding appends 0, 1, 2, ... without a gap
+    ranges = sorted(ranges, key=lambda r: (r[0], -r[1]))
+    chosen = []
+    following = 0
+    for first, last in ranges:
+        if first == following:
+            chosen.append((first, last))
+            following = last + 1
+
+    return chosen
+
+
+def segments(path: str) -> List[str]:
+    """Returns the segment files of a store, in time order (empty if the
+    store doesn't exist).
+    """
+    return [os.path.join(path, _segment_name(*r)) for r in _covering(_all_segments(path))]
+
+
+_times: LRUCache = LRUCache(maxsize=256)
+_times_lock = threading.Lock()
+
+
+def store_times(path: str) -> Union[np.ndarray, None]:
+    """Returns the time values of a store (cached by segments), or None if
+    the store doesn't exist.
+    """
+    files = segments(path)
+    if not files:
+        return None
+
+    key = tuple(files)
+    with _times_lock:
+        times = _times.get(key)
+    if times is not None:
+        return times
+
+    try:
+        parts = []
+        for f in files:
+            with netCDF4.Dataset(f) as ds:
+                parts.append(np.array(ds.variables[ds.getncattr('time_dimension')][:]))
+        times = np.concatenate(parts)
+    except (OSError, KeyError, AttributeError) as e:
+        logger.warning("Unable to read timeseries store %s: %s", path, e)
+        return None
+
+    times.setflags(write=False)  # Make immutable
+    with _times_lock:
+        _times[key] = times
+
+    return times
+
+
+def find_stores(url: str, variables: List[str], timestamps: List[int]) -> Union[List[str], None]:
+    """Returns the store segments to read variables at timestamps from
+    instead of the dataset's files, or None if the request should read the
+    files.
+    """
+    if len(timestamps) < int(get_app_setting('TIMESERIES_STORE_MIN_STEPS', DEFAULT_MIN_STEPS)):
+        return None
+
+    paths = [store_path(url, v) for v in variables]
+    if not paths or None in paths:
+        return None
+
+    times = [store_times(p) for p in paths]
+    if any(t is None for t in times):
+        return None
+    if any(not np.array_equal(t, times[0]) for t in times[1:]):
+        # Stores that are out of step would be merged on the union of
+        # their time axes.
+        return None
+    if not np.isin(timestamps, times[0]).all():
+        return None
+
+    return [f for p in paths for f in segments(p)]
+
+
+def _first_time(path: str, time_dim: str) -> float:
+    with netCDF4.Dataset(path) as ds:
+        return float(ds.variables[time_dim][0])
+
+
+def _create(dst: netCDF4.Dataset, src: netCDF4.Dataset, variable: str) -> None:
+    # Values are copied as stored (packed, with their fill values)
+    src.set_auto_maskandscale(False)
+    dst.set_auto_maskandscale(False)
+
+    var = src.variables[variable]
+    time_dim = var.dimensions[0]
+
+    for name, dim in src.dimensions.items():
+        dst.createDimension(name, None if name == time_dim else len(dim))
+
+    # Grid variables (lat/lon, depths, ...) and the time coordinate
+    for name, v in src.variables.items():
+        if name == variable or (time_dim in v.dimensions and name != time_dim):
+            continue
+        _copy_variable(dst, v, name)
+        if name != time_dim:
+            dst.variables[name][:] = v[:]
+
+    chunks = []
+    for i, (d, n) in enumerate(zip(var.dimensions, var.shape)):
+        if i == 0:
+            chunks.append(TIME_CHUNK)
+        elif i >= len(var.dimensions) - 2:
+            chunks.append(min(TILE, n))
+        else:
+            chunks.append(1)
+    _copy_variable(dst, var, variable, chunksizes=chunks, zlib=True, complevel=1, shuffle=True)
+
+    dst.setncattr('time_dimension', time_dim)
+    dst.setncattr('variable', variable)
+
+
+def _copy_variable(dst: netCDF4.Dataset, v: netCDF4.Variable, name: str, **kwargs) -> None:
+    attrs = {a: v.getncattr(a) for a in v.ncattrs() if a != '_FillValue'}
+    fill_value = v.getncattr('_FillValue') if '_FillValue' in v.ncattrs() else None
+
+    out = dst.createVariable(name, v.datatype, v.dimensions, fill_value=fill_value, **kwargs)
+    out.setncatts(attrs)
+
+
+def _write_segment(path: str, variable: str, time_dim: str, files: List[str],
+                   after: float) -> int:
+    """Writes the timesteps of a variable in files later than after to a
+    new segment file, returning the number written (none are written if 0).
+    """
+    # Unique across the hosts and threads sharing the store directory
+    tmp = tmp_path(path)
+    written = 0
+    try:
+        with netCDF4.Dataset(tmp, 'w', format='NETCDF4') as dst:
+            with netCDF4.Dataset(files[0]) as src:
+                _create(dst, src, variable)
+
+            dst.set_auto_maskandscale(False)
+            dst_time = dst.variables[time_dim]
+            dst_var = dst.variables[variable]
+            last = after
+
+            for f in files:
+                with netCDF4.Dataset(f) as src:
+                    src.set_auto_maskandscale(False)
+                    times = np.asarray(src.variables[time_dim][:])
+                    new = np.flatnonzero(times > last)
+                    if new.size == 0:
+                        continue
+
+                    for start in range(0, new.size, TIME_CHUNK):
+                        # Slabs of at most TIME_CHUNK timesteps
+                        part = new[start:start + TIME_CHUNK]
+                        values = src.variables[variable][part.min():part.max() + 1]
+                        values = values[part - part.min()]
+                        dst_time[written:written + part.size] = times[part]
+                        dst_var[written:written + part.size] = values
+                        written += part.size
+
+                    last = times[new[-1]]
+
+        if written:
+            # Fails if another builder wrote the segment first
+            os.link(tmp, path)
+    finally:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+    return written
+
+
+@contextlib.contextmanager
+def _store_lock(path: str):
+    # Serializes the builders of a host (other hosts are caught by os.link)
+    with open(os.path.join(path, ".lock"), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _merge(path: str, variable: str, time_dim: str) -> None:
+    """Merges the last MERGE_SEGMENTS segments while they hold as many
+    appends each.
+    """
+    while True:
+        ranges = _covering(_all_segments(path))
+        tail = ranges[-MERGE_SEGMENTS:]
+        spans = {last - first for first, last in tail}
+        if len(tail) < MERGE_SEGMENTS or len(spans) != 1:
+            return
+
+        files = [os.path.join(path, _segment_name(*r)) for r in tail]
+        merged = os.path.join(path, _segment_name(tail[0][0], tail[-1][1]))
+        try:
+            _write_segment(merged, variable, time_dim, files, -np.inf)
+        except FileExistsError:
+            pass
+
+
+def _remove_superseded(path: str) -> None:
+    chosen = _covering(_all_segments(path))
+    for first, last in _all_segments(path):
+        if (first, last) in chosen:
+            continue
+        merged = [r for r in chosen if r[0] <= first and last <= r[1]]
+        if not merged:
+            continue
+        try:
+            # Readers that listed the store before the merge may still open it
+            replaced = os.stat(os.path.join(path, _segment_name(*merged[0]))).st_mtime
+            if time.time() - replaced > SUPERSEDED_GRACE:
+                os.remove(os.path.join(path, _segment_name(first, last)))
+        except OSError:
+            pass
+
+    for tmp in glob.glob(os.path.join(path, "*.tmp")):
+        try:
+            if time.time() - os.stat(tmp).st_mtime > SUPERSEDED_GRACE:
+                os.remove(tmp)
+        except OSError:
+            pass
+
+
+def append_to_store(path: str, variable: str, files: List[str]) -> int:
+    """Appends the timesteps of a variable in files that are later than the
+    last timestep of a store to a new segment, creating the store if needed.
+
+    Returns:
+        int -- The number of timesteps appended.
+    """
+    if not files:
+        return 0
+
+    with netCDF4.Dataset(files[0]) as ds:
+        time_dim = ds.variables[variable].dimensions[0]
+    files = sorted(files, key=lambda f: _first_time(f, time_dim))
+
+    os.makedirs(path, exist_ok=True)
+    with _store_lock(path):
+        while True:
+            ranges = _covering(_all_segments(path))
+            times = store_times(path)
+            last = times[-1] if times is not None and len(times) else -np.inf
+            following = ranges[-1][1] + 1 if ranges else 0
+
+            try:
+                appended = _write_segment(os.path.join(path, _segment_name(following, following)),
+                                          variable, time_dim, files, last)
+                break
+            except FileExistsError:
+                # Another host appended meanwhile, skip its timesteps
+                continue
+
+        if appended:
+            _merge(path, variable, time_dim)
+        _remove_superseded(path)
+
+    return appended
@@ -1,7 +1,7 @@
 import logging
 from sys import argv
 
-from flask import Flask, request, send_file
+from flask import Flask, g, request, send_file
 from flask_compress import Compress
 from flask_babel import Babel
 
@@ -9,6 +9,8 @@ from flask_babel import Babel
 # because it is how the rest of the app gets access to DatasetConfig
 from .dataset_config import DatasetConfig
 from data.observational import db
+from data.direct_read import request_reads, summarize_reads
+from utils.compute_budget import compute_budget
 
 babel = Babel()
 
@@ -41,6 +43,30 @@ def create_app(testing = False):
 
     config_blueprints(app)
 
+    @app.before_request
+    def enter_compute_budget():
+        # Threads the request may use, shared among the busy workers. This
+        # only sets the budget of the request's thread, the process-wide
+        # limits are applied around the computes (see compute_limits).
+        g.compute_budget = compute_budget()
+        g.compute_threads = g.compute_budget.__enter__()
+
+    @app.teardown_request
+    def exit_compute_budget(exc):
+        budget = g.pop('compute_budget', None)
+        if budget is not None:
+            budget.__exit__(None, None, None)
+
+    @app.after_request
+    def add_data_read_path(response):
+        # Which read path (direct netCDF4 or dask) the request's data reads took
+        reads = request_reads()
+        if reads:
+            response.headers['X-Data-Read-Path'] = summarize_reads(reads)
+        if 'compute_threads' in g:
+            response.headers['X-Compute-Threads'] = str(g.compute_threads)
+        return response
+
     Compress(app)
 
     babel.init_app(app)
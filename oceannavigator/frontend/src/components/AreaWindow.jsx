@@ -76,6 +76,8 @@ export default class AreaWindow extends React.Component {
       output_format: "NETCDF4", // Subset output format
       convertToUserGrid: false,
       zip: false, // Should subset file(s) be zipped
+      subset_pending: false, // A subset job is being computed
+      subset_status: "", // Status of the subset job
     };
 
     if (props.init !== null) {
@@ -85,6 +87,7 @@ export default class AreaWindow extends React.Component {
     // Function bindings
     this.onLocalUpdate = this.onLocalUpdate.bind(this);
     this.subsetArea = this.subsetArea.bind(this);
+    this.pollSubset = this.pollSubset.bind(this);
     this.onTabChange = this.onTabChange.bind(this);
     this.updatePlotTitle = this.updatePlotTitle.bind(this);
     this.saveScript = this.saveScript.bind(this);
@@ -96,6 +99,7 @@ export default class AreaWindow extends React.Component {
 
   componentWillUnmount() {
     this._mounted = false;
+    clearTimeout(this.subsetTimer);
   }
 
   componentWillReceiveProps(props) {
@@ -215,24 +219,10 @@ export default class AreaWindow extends React.Component {
     return [lat_min, lat_max, long_min, long_max];
   }
 
-  subsetArea() {
+  subsetQuery() {
     const AABB = this.calculateAreaBoundingBox(this.props.area[0]);
-    
-    window.location.href = "/api/v1.0/subset/?" +
-       "&output_format=" + this.state.output_format +
-       "&dataset_name=" + this.state.dataset_0.dataset +
-       "&variables=" + this.state.output_variables.join() +
-       "&min_range=" + [AABB[0], AABB[2]].join() +
-       "&max_range=" + [AABB[1], AABB[3]].join() +
-       "&time=" + [this.state.output_starttime, this.state.output_endtime].join() +
-       "&user_grid=" + (this.state.convertToUserGrid ? 1 : 0) +
-       "&should_zip=" + (this.state.zip ? 1 : 0);
-  }
 
-  saveScript(key) {
-    const AABB = this.calculateAreaBoundingBox(this.props.area[0]);
-    
-    let query = {
+    return {
       "output_format": this.state.output_format,
       "dataset_name": this.state.dataset_0.dataset,
       "variables": this.state.output_variables.join(),
@@ -242,6 +232,65 @@ export default class AreaWindow extends React.Component {
       "user_grid": (this.state.convertToUserGrid ? 1:0),
       "should_zip": (this.state.zip ? 1:0)
     };
+  }
+
+  // Subsets are computed by the server's subset workers: submit a job,
+  // poll its status and download the result when it is done.
+  subsetArea() {
+    const query = this.subsetQuery();
+
+    this.setState({subset_pending: true, subset_status: _("Queued")});
+    $.ajax({
+      url: "/api/v1.0/subset/jobs/",
+      method: "POST",
+      data: query,
+      success: function(job) {
+        this.pollSubset(job, query.should_zip);
+      }.bind(this),
+      error: function() {
+        this.setState({subset_pending: false, subset_status: _("Subset failed.")});
+      }.bind(this),
+    });
+  }
+
+  pollSubset(job, should_zip) {
+    if (!this._mounted) {
+      return;
+    }
+
+    if (job.status === "done") {
+      this.setState({subset_pending: false, subset_status: ""});
+      window.location.href = "/api/v1.0/subset/jobs/" + job.job_id +
+        "/download/?should_zip=" + should_zip;
+      return;
+    }
+    if (job.status === "failed") {
+      this.setState({
+        subset_pending: false,
+        subset_status: _("Subset failed.") + " " + (job.error || ""),
+      });
+      return;
+    }
+
+    this.setState({
+      subset_status: job.status === "running" ?
+        _("Computing") + " " + Math.round(job.progress * 100) + "%" : _("Queued"),
+    });
+    this.subsetTimer = setTimeout(function() {
+      $.ajax({
+        url: "/api/v1.0/subset/jobs/" + job.job_id + "/",
+        success: function(status) {
+          this.pollSubset(status, should_zip);
+        }.bind(this),
+        error: function() {
+          this.setState({subset_pending: false, subset_status: _("Subset failed.")});
+        }.bind(this),
+      });
+    }.bind(this), 2000);
+  }
+
+  saveScript(key) {
+    const query = this.subsetQuery();
 
     window.location.href = window.location.origin + "/api/v1.0/generatescript/" + stringify(query) + "/" + key + "/" + "SUBSET/";
   }
@@ -499,7 +548,7 @@ export default class AreaWindow extends React.Component {
               key='save'
               id='save'
               onClick={this.subsetArea}
-              disabled={this.state.output_variables == ""}
+              disabled={this.state.output_variables == "" || this.state.subset_pending}
             ><Icon icon="save" /> {_("Save")}</Button>
             
             <DropdownButton
@@ -517,6 +566,8 @@ export default class AreaWindow extends React.Component {
                 eventKey="r"
               ><Icon icon="code" /> {_("R")}</MenuItem>
             </DropdownButton>
+
+            <p>{this.state.subset_status}</p>
           </form>
         </Panel.Body>
       </Panel.Collapse>
@@ -12,6 +12,7 @@ import pytz
 import cftime
 from bisect import bisect_left
 import plotting.utils
+from utils.compute_budget import thread_budget
 
 _data_cache = LRUCache(maxsize=16)
 
@@ -166,7 +167,7 @@ class Grid(object):
                     method=method,
                     neighbours=neighbours,
                     radius_of_influence=radius,
-                    nprocs=4
+                    nprocs=thread_budget()
                 )
             )
         resampled = np.ma.vstack(resampled)
@@ -250,7 +251,7 @@ class Grid(object):
                                      method=method,
                                      neighbours=neighbours,
                                      radius_of_influence=radius,
-                                     nprocs=4))
+                                     nprocs=thread_budget()))
         combined = np.ma.array(combined)
 
         if mintime + 1 >= len(ts):
@@ -303,7 +304,7 @@ def _fill_invalid_shift(z):
 
 
 def resample(in_lat, in_lon, out_lat, out_lon, data, method='inv_square',
-             neighbours=8, radius_of_influence=500000, nprocs=4):
+             neighbours=8, radius_of_influence=500000, nprocs=None):
     masked_lat = in_lat.view(np.ma.MaskedArray)
     masked_lon = in_lon.view(np.ma.MaskedArray)
     masked_lon.mask = masked_lat.mask = data.view(np.ma.MaskedArray).mask
@@ -311,6 +312,9 @@ def resample(in_lat, in_lon, out_lat, out_lon, data, method='inv_square',
     input_def = SwathDefinition(lons=masked_lon, lats=masked_lat)
     target_def = SwathDefinition(lons=out_lon, lats=out_lat)
 
+    if nprocs is None:
+        nprocs = thread_budget()
+
     if method == 'inv_square':
         res = resample_custom(
             input_def,
@@ -9,6 +9,7 @@ from mpl_toolkits.axes_grid1 import make_axes_locatable
 import plotting.colormap as colormap
 import plotting.utils as utils
 from data import open_dataset
+from data.chunking import PATH
 from data.sqlite_database import SQLiteDatabase
 from oceannavigator import DatasetConfig
 from plotting.line import LinePlotter
@@ -54,7 +55,7 @@ class HovmollerPlotter(LinePlotter):
             return (depth, depth_value, depth_unit)
 
         # Load left/Main Map
-        with open_dataset(self.dataset_config, timestamp=self.starttime, endtime=self.endtime, variable=self.variables) as dataset:
+        with open_dataset(self.dataset_config, timestamp=self.starttime, endtime=self.endtime, variable=self.variables, access=PATH) as dataset:
 
             self.depth, self.depth_value, self.depth_unit = find_depth(
                 self.depth, len(dataset.depths) - 1, dataset)
@@ -85,7 +86,7 @@ class HovmollerPlotter(LinePlotter):
         # Load data sent from Right Map (if in compare mode)
         if self.compare:
             compare_config = DatasetConfig(self.compare['dataset'])
-            with open_dataset(compare_config, timestamp=self.compare['starttime'], endtime=self.compare['endtime'], variable=self.compare['variables']) as dataset:
+            with open_dataset(compare_config, timestamp=self.compare['starttime'], endtime=self.compare['endtime'], variable=self.compare['variables'], access=PATH) as dataset:
                 self.compare['depth'], self.compare['depth_value'], self.compare['depth_unit'] = find_depth(
                     self.compare['depth'], len(dataset.depths) - 1, dataset)
 
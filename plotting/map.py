@@ -24,6 +24,7 @@ import plotting.colormap as colormap
 import plotting.overlays as overlays
 import plotting.utils as utils
 from data import open_dataset
+from data.chunking import AREA
 from oceannavigator import DatasetConfig
 from plotting.plotter import Plotter
 from utils.errors import ClientError, ServerError
@@ -195,7 +196,7 @@ class MapPlotter(Plotter):
         if self.__load_quiver():
             variables_to_load.append(self.quiver['variable'])
 
-        with open_dataset(self.dataset_config, variable=variables_to_load, timestamp=self.time) as dataset:
+        with open_dataset(self.dataset_config, variable=variables_to_load, timestamp=self.time, access=AREA) as dataset:
 
             self.variable_unit = self.get_variable_units(
                 dataset, self.variables
@@ -7,6 +7,7 @@ import hashlib
 from cachetools import LRUCache
 import threading
 from flask import current_app
+from utils.compute_budget import thread_budget
 import os
 
 _bathymetry_cache = LRUCache(maxsize=256 * 1024 * 1024, getsizeof=len)
@@ -74,7 +75,7 @@ def bathymetry(basemap, target_lat, target_lon, blur=None):
                 target_def,
                 radius_of_influence=500000,
                 fill_value=None,
-                nprocs=4)
+                nprocs=thread_budget())
 
             def do_save(filename, data):
                 np.save(filename, data.filled())
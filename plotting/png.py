@@ -0,0 +1,74 @@
+"""
+PNG encoding of rendered tiles.
+
+The encoder is configured with these settings:
+
+    * PNG_OPTIMIZE (default True) -- have PIL search for the smallest
+      encoding, at zlib level 9. Slowest, smallest files.
+    * PNG_COMPRESS_LEVEL (default 6) -- zlib level (0-9) used when
+      PNG_OPTIMIZE is off.
+    * PNG_PALETTE (default True) -- encode images drawn with a categorical
+      colormap as palette PNGs (see is_categorical). This is lossless: images
+      with more than 256 colours are still encoded as RGBA.
+"""
+
+from io import BytesIO
+
+import matplotlib.colors
+import numpy as np
+from PIL import Image
+
+from utils.app_config import get_app_setting
+
+
+def is_categorical(cmap) -> bool:
+    """Returns True if a colormap has few enough colours for its images to
+    fit in a palette, with one entry left for masked values.
+    """
+    return isinstance(cmap, matplotlib.colors.ListedColormap) and cmap.N < 256
+
+
+def _palette_image(rgba: np.ndarray):
+    """Returns an RGBA image as a palette image, or None if it has more than
+    256 colours.
+    """
+    rgba = np.ascontiguousarray(rgba, dtype=np.uint8)
+    colors, indices = np.unique(rgba.view(np.uint32).reshape(-1), return_inverse=True)
+    if len(colors) > 256:
+        return None
+
+    im = Image.fromarray(indices.reshape(rgba.shape[:2]).astype(np.uint8), 'P')
+    im.putpalette(colors.view(np.uint8).tobytes(), rawmode='RGBA')
+
+    return im
+
+
+def encode_png(im, palette: bool = False) -> BytesIO:
+    """Encodes an image (PIL image, or RGBA uint8 array) as a PNG.
+
+    Arguments:
+        im -- The image.
+        palette {bool} -- Try a palette PNG first, if PNG_PALETTE allows it.
+
+    Returns:
+        BytesIO -- The PNG, at position 0.
+    """
+    if isinstance(im, np.ndarray):
+        rgba = im
+        im = Image.fromarray(rgba)
+    else:
+        rgba = None
+
+    if palette and get_app_setting('PNG_PALETTE', True):
+        if rgba is None:
+            rgba = np.asarray(im.convert('RGBA'))
+        im = _palette_image(rgba) or im
+
+    buf = BytesIO()
+    if get_app_setting('PNG_OPTIMIZE', True):
+        im.save(buf, format='PNG', optimize=True)
+    else:
+        im.save(buf, format='PNG', compress_level=int(get_app_setting('PNG_COMPRESS_LEVEL', 6)))
+    buf.seek(0)
+
+    return buf
@@ -5,6 +5,7 @@ from flask_babel import gettext
 
 import plotting.utils as utils
 from data import open_dataset
+from data.chunking import PROFILE
 from data.sqlite_database import SQLiteDatabase
 from plotting.point import PointPlotter
 from utils.errors import ClientError
@@ -19,7 +20,7 @@ class ProfilePlotter(PointPlotter):
 
     def load_data(self):
 
-        with open_dataset(self.dataset_config, timestamp=self.time, variable=self.variables) as ds:
+        with open_dataset(self.dataset_config, timestamp=self.time, variable=self.variables, access=PROFILE) as ds:
 
             try:
                 self.load_misc(ds, self.variables)
@@ -7,6 +7,8 @@ from matplotlib.dates import date2num
 
 import plotting.utils as utils
 from data import open_dataset
+from data.chunking import POINT_SERIES
+from data.point_extraction import extract_timeseries
 from plotting.point import PointPlotter
 
 
@@ -23,39 +25,20 @@ class StickPlotter(PointPlotter):
 
         self.depth = sorted(self.depth)
 
-        with open_dataset(self.dataset_config, timestamp=self.starttime, endtime=self.endtime, variable=self.variables) as dataset:
+        with open_dataset(self.dataset_config, timestamp=self.starttime, endtime=self.endtime, variable=self.variables, access=POINT_SERIES) as dataset:
 
             self.load_misc(dataset, self.variables)
             self.variable_name = self.get_vector_variable_name(dataset,
                                                                self.variables)
 
-            point_data = []
-            point_depth = []
-            for p in self.points:
-                data = []
-                depth = []
-                for v in self.variables:
-                    dd = []
-                    jj = []
-                    for d in self.depth:
-                        da, dp = dataset.get_timeseries_point(
-                            float(p[0]),
-                            float(p[1]),
-                            d,
-                            self.starttime,
-                            self.endtime,
-                            v,
-                            return_depth=True
-                        )
-                        dd.append(da)
-                        jj.append(dp)
-                    data.append(np.ma.array(dd))
-                    depth.append(np.ma.array(jj))
-                point_data.append(np.ma.array(data))
-                point_depth.append(np.ma.array(depth))
-
-            point_data = np.ma.array(point_data)
-            point_depth = np.ma.array(point_depth)
+            # One batched read of every point, variable and depth per file
+            point_data = extract_timeseries(dataset, self.points, self.variables,
+                                            self.depth, self.starttime, self.endtime)
+
+            point_depth = np.ma.masked_all(point_data.shape)
+            for idx, d in enumerate(self.depth):
+                if d != 'bottom':
+                    point_depth[:, :, idx] = dataset.depths[int(d)]
 
             for idx, factor in enumerate(self.scale_factors):
                 if factor != 1.0:
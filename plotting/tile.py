@@ -17,11 +17,14 @@ from netCDF4 import Dataset
 from PIL import Image
 from pyproj import Proj
 from scipy.ndimage.filters import gaussian_filter
+from shapely.geometry import Polygon, box
 from skimage import measure
 
 import plotting.colormap as colormap
+import plotting.png as png
 import plotting.utils as utils
 from data import open_dataset
+from data.chunking import AREA
 from data.sqlite_database import SQLiteDatabase
 from oceannavigator import DatasetConfig
 
@@ -154,10 +157,97 @@ def scale(args):
     return buf
 
 
+def metatile_bounds(x, y, z, size):
+    """Returns the column and row of the first tile of the size x size
+    block (metatile) holding tile x, y, and the number of tiles on each side
+    of the block (fewer at the lowest zoom levels).
+    """
+    n = min(size, 2 ** z)
+    return (x // n) * n, (y // n) * n, n
+
+
+def _densify(ring, points=16):
+    # Points along the edges of a lon/lat ring, so that it keeps its shape
+    # once projected
+    coords = np.array(ring.coords)
+    steps = np.linspace(0, 1, points, endpoint=False)[:, np.newaxis]
+    edges = [a + steps * (b - a) for a, b in zip(coords[:-1], coords[1:])]
+    return np.vstack(edges + [coords[:1]])
+
+
+def metatiles(projection, z, size, polygon=None):
+    """Yields the first tile (x, y) of the metatiles of zoom level z (see
+    metatile_bounds), only those intersecting a lon/lat shapely polygon if
+    one is given.
+    """
+    count = 2 ** z
+    n = min(size, count)
+
+    if polygon is None:
+        for x0 in range(0, count, n):
+            for y0 in range(0, count, n):
+                yield x0, y0
+        return
+
+    # Projected extent of the tile grid: tiles are columns from west to
+    # east and rows from north to south.
+    x, y = get_m_coords(projection, 0, 0, 0)
+    xmin, xmax = np.amin(x), np.amax(x)
+    ymin, ymax = np.amin(y), np.amax(y)
+    width = (xmax - xmin) / count
+    height = (ymax - ymin) / count
+
+    proj = Proj(init=projection)
+    shapes = []
+    for p in getattr(polygon, 'geoms', [polygon]):
+        lonlat = _densify(p.exterior)
+        lat = np.clip(lonlat[:, 1], -85.05, 85.05)
+        px, py = proj(lonlat[:, 0], lat)
+        shapes.append(Polygon(zip(px, py)).buffer(0))
+
+    seen = set()
+    for shape in shapes:
+        bx0, by0, bx1, by1 = shape.bounds
+        # One more tile on each side, the extent is computed from pixel
+        # centres
+        c0 = max(0, int((bx0 - xmin) // width) - 1) // n * n
+        c1 = min(count - 1, int((bx1 - xmin) // width) + 1)
+        r0 = max(0, int((ymax - by1) // height) - 1) // n * n
+        r1 = min(count - 1, int((ymax - by0) // height) + 1)
+
+        for x0 in range(c0, c1 + 1, n):
+            for y0 in range(r0, r1 + 1, n):
+                extent = box(xmin + x0 * width, ymax - (y0 + n) * height,
+                             xmin + (x0 + n) * width, ymax - y0 * height)
+                if (x0, y0) not in seen and extent.intersects(shape):
+                    seen.add((x0, y0))
+                    yield x0, y0
+
+
 def plot(projection, x, y, z, args):
-    lat, lon = get_latlon_coords(projection, x, y, z)
-    if len(lat.shape) == 1:
-        lat, lon = np.meshgrid(lat, lon)
+    return plot_metatile(projection, x, y, z, args, 1)[(x, y)]
+
+
+def plot_metatile(projection, x, y, z, args, size):
+    """Renders the metatile (see metatile_bounds) holding tile x, y with one
+    data read and interpolation, and returns the PNG of each of its tiles.
+
+    Returns:
+        dict -- BytesIO of each (x, y) tile of the metatile.
+    """
+    x0, y0, n = metatile_bounds(x, y, z, size)
+
+    # Pixel coordinates of every tile, indexed (column, row) like a single
+    # tile's meshgrid
+    lat = np.empty((n * 256, n * 256))
+    lon = np.empty((n * 256, n * 256))
+    for j in range(n):
+        for i in range(n):
+            tile_lat, tile_lon = get_latlon_coords(projection, x0 + j, y0 + i, z)
+            if len(tile_lat.shape) == 1:
+                tile_lat, tile_lon = np.meshgrid(tile_lat, tile_lon)
+            lat[j * 256:(j + 1) * 256, i * 256:(i + 1) * 256] = tile_lat
+            lon[j * 256:(j + 1) * 256, i * 256:(i + 1) * 256] = tile_lon
 
     dataset_name = args.get('dataset')
     config = DatasetConfig(dataset_name)
@@ -173,7 +263,7 @@ def plot(projection, x, y, z, args):
     time = args.get('time')
 
     data = []
-    with open_dataset(config, variable=variable, timestamp=time) as dataset:
+    with open_dataset(config, variable=variable, timestamp=time, access=AREA) as dataset:
 
         for v in variable:
             data.append(dataset.get_area(
@@ -209,27 +299,34 @@ def plot(projection, x, y, z, args):
         cmap = colormap.colormaps.get('speed')
 
     data = data.transpose()
-    xpx = x * 256
-    ypx = y * 256
+    xpx = x0 * 256
+    ypx = y0 * 256
 
     # Mask out any topography if we're below the vector-tile threshold
     if z < 8:
         with Dataset(current_app.config['ETOPO_FILE'] % (projection, z), 'r') as dataset:
-            bathymetry = dataset["z"][ypx:(ypx + 256), xpx:(xpx + 256)]
-
-        bathymetry = gaussian_filter(bathymetry, 0.5)
-
-        data[np.where(bathymetry > -depthm)] = np.ma.masked
+            bathymetry = dataset["z"][ypx:(ypx + n * 256), xpx:(xpx + n * 256)]
 
     sm = matplotlib.cm.ScalarMappable(
         matplotlib.colors.Normalize(vmin=scale[0], vmax=scale[1]), cmap=cmap)
 
-    img = sm.to_rgba(np.ma.masked_invalid(np.squeeze(data)))
-    im = Image.fromarray((img * 255.0).astype(np.uint8))
+    tiles = {}
+    for i in range(n):
+        for j in range(n):
+            rows = slice(i * 256, (i + 1) * 256)
+            cols = slice(j * 256, (j + 1) * 256)
+            tile = data[rows, cols]
 
-    buf = BytesIO()
-    im.save(buf, format='PNG', optimize=True)
-    return buf
+            if z < 8:
+                # Filtered per tile, as when tiles were rendered one by one
+                tile_bathymetry = gaussian_filter(bathymetry[rows, cols], 0.5)
+                tile[np.where(tile_bathymetry > -depthm)] = np.ma.masked
+
+            img = sm.to_rgba(np.ma.masked_invalid(np.squeeze(tile)))
+            tiles[(x0 + j, y0 + i)] = png.encode_png((img * 255.0).astype(np.uint8),
+                                                     palette=png.is_categorical(sm.cmap))
+
+    return tiles
 
 
 def topo(projection, x, y, z, shaded_relief):
@@ -277,11 +374,7 @@ def topo(projection, x, y, z, shaded_relief):
     img = img + shade
     img = np.clip(img, 0, 1)
 
-    im = Image.fromarray((img * 255.0).astype(np.uint8))
-    buf = BytesIO()
-    im.save(buf, format='PNG', optimize=True)
-
-    return buf
+    return png.encode_png((img * 255.0).astype(np.uint8))
 
 
 def bathymetry(projection, x, y, z, args):
@@ -329,10 +422,6 @@ def bathymetry(projection, x, y, z, args):
         )
         plt.close(fig)
         buf.seek(0)
-        im = Image.open(buf)
-
-        buf2 = BytesIO()
-        im.save(buf2, format='PNG', optimize=True)
-        return buf2
+        return png.encode_png(Image.open(buf), palette=True)
 
     return None
@@ -0,0 +1,404 @@
+"""
+Cache of rendered data tiles, shared by the tile route and
+scripts/seed_tiles.py.
+
+The backend is chosen by the TILE_STORE setting:
+
+    * filesystem (default) -- one PNG per tile under CACHE_DIR at its URL
+      path, e.g. CACHE_DIR/api/v1.0/tiles/gaussian/25/10/EPSG:3857/giops_day/
+      votemper/2212704000/0/-5,30/6/50/40.png, as tiles were always cached.
+    * sqlite -- one MBTiles-like SQLite file per dataset, variable and
+      timestamp under TILE_STORE_DIR (default CACHE_DIR/tilestore), e.g.
+      giops_day/votemper/2212704000.mbtiles. The tiles table is keyed by the
+      layer (interpolation, projection, depth and scale), zoom, column and row
+      (XYZ rows, not flipped like TMS), so a hit is one indexed read.
+
+A tile expires DatasetConfig.cache hours after it is rendered. The filesystem
+store checks the age of the file on every hit. The sqlite store saves the
+expiry time with the tile, and TileStore.expire deletes every expired tile.
+drop_times deletes all the tiles of a dataset's old timestamps. Both are run by
+scripts/expire_tiles.py.
+
+Tiles are rendered by metatile (see plotting.tile.plot_metatile), under the
+single-flight lock of the metatile (metatile_key, see utils.single_flight),
+so a metatile is only rendered once when several workers (or the seeder) ask
+for its tiles.
+
+The topography and bathymetry tiles are cached as files at their URL path by
+write_behind, in a background thread, so responses don't wait for the disk.
+At most TILE_WRITE_QUEUE (default 256) tiles wait to be written; past that,
+they are written by the caller.
+"""
+
+import abc
+import glob
+import logging
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from typing import Dict, Tuple, Union
+
+from cachetools import LRUCache
+
+from utils.app_config import get_app_setting
+from utils.atomic_file import atomic_write
+from utils.single_flight import request_key
+
+logger = logging.getLogger(__name__)
+
+# Tiles on each side of the block rendered at once (the TILE_METATILE_SIZE
+# setting, 1 renders tiles one by one)
+DEFAULT_METATILE_SIZE = 4
+
+# A tile layer, as requested from /api/v1.0/tiles/ (radius in km)
+Layer = namedtuple('Layer', ['interp', 'radius', 'neighbours', 'projection', 'dataset',
+                             'variable', 'time', 'depth', 'scale'])
+
+
+def format_scale(scale) -> str:
+    """Formats a [min, max] scale like the frontend does in tile URLs.
+    """
+    def number(v):
+        v = float(v)
+        return str(int(v)) if v.is_integer() else repr(v)
+
+    return ",".join(number(v) for v in scale)
+
+
+def metatile_key(layer: Layer, zoom: int, n: int, x0: int, y0: int) -> str:
+    """Returns the single-flight key of the metatile of n x n tiles starting
+    at tile x0, y0.
+    """
+    # The seeder has ints where the route has URL strings
+    return request_key('tile', [str(v) for v in layer], zoom, n, x0, y0)
+
+
+def write_file(data: bytes, path: str) -> None:
+    """Writes a file of the cache. It is written aside and renamed, so
+    readers never see a partial file.
+    """
+    # The writer thread and a request writing its own tiles (write_behind's
+    # fallback) may write the same path, atomic_write names tmp files by thread
+    with atomic_write(path) as f:
+        f.write(data)
+
+
+_writes = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def _writer(writes: queue.Queue) -> None:
+    while True:
+        data, path = writes.get()
+        try:
+            write_file(data, path)
+        except OSError:
+            logger.exception("Unable to cache %s", path)
+        finally:
+            writes.task_done()
+
+
+def _write_queue() -> queue.Queue:
+    global _writes, _writer_pid
+
+    with _writer_lock:
+        # The thread doesn't survive a fork, start one in each process
+        if _writer_pid != os.getpid():
+            _writes = queue.Queue(maxsize=int(get_app_setting('TILE_WRITE_QUEUE', 256)))
+            threading.Thread(target=_writer, args=(_writes,), name='tile-cache-writer',
+                             daemon=True).start()
+            _writer_pid = os.getpid()
+
+    return _writes
+
+
+def write_behind(data: bytes, path: str) -> None:
+    """Queues a file to be written to the cache in the background, or
+    writes it now if the queue is full.
+    """
+    try:
+        _write_queue().put_nowait((data, path))
+    except queue.Full:
+        write_file(data, path)
+
+
+def _expired(created: float, ttl: Union[int, None], now: float = None) -> bool:
+    if ttl is None:
+        return False
+
+    return (now or time.time()) - created > ttl * 3600
+
+
+class TileStore(metaclass=abc.ABCMeta):
+    """Interface of the tile stores.
+
+    Tiles are the encoded PNGs, keyed by Layer, zoom, x and y. ttl is the
+    DatasetConfig.cache of the layer's dataset, in hours (None never expires).
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    @abc.abstractmethod
+    def get(self, layer: Layer, zoom: int, x: int, y: int, ttl: int = None) -> Union[bytes, None]:
+        """Returns a cached tile, or None if it isn't cached or expired.
+        """
+        pass
+
+    def contains(self, layer: Layer, zoom: int, x: int, y: int, ttl: int = None) -> bool:
+        return self.get(layer, zoom, x, y, ttl) is not None
+
+    @abc.abstractmethod
+    def put(self, layer: Layer, zoom: int, tiles: Dict[Tuple[int, int], bytes],
+            ttl: int = None) -> None:
+        """Caches the (x, y) tiles of a zoom level, all at once.
+        """
+        pass
+
+    @abc.abstractmethod
+    def expire(self, now: float = None) -> int:
+        """Deletes the expired tiles, returning how many were deleted.
+        """
+        pass
+
+    @abc.abstractmethod
+    def drop_times(self, dataset: str, before: int) -> int:
+        """Deletes the tiles of the timestamps of a dataset earlier than
+        before, returning the number of timestamps dropped.
+        """
+        pass
+
+
+class FilesystemTileStore(TileStore):
+    """One PNG file per tile, at the tile's URL path under CACHE_DIR."""
+
+    def zoom_dir(self, layer: Layer, zoom: int) -> str:
+        return os.path.join(self.directory, "api", "v1.0", "tiles", layer.interp,
+                            str(layer.radius), str(layer.neighbours), layer.projection,
+                            layer.dataset, layer.variable, str(layer.time), str(layer.depth),
+                            layer.scale, str(zoom))
+
+    def tile_path(self, layer: Layer, zoom: int, x: int, y: int) -> str:
+        return os.path.join(self.zoom_dir(layer, zoom), str(x), "%d.png" % y)
+
+    def get(self, layer, zoom, x, y, ttl=None):
+        path = self.tile_path(layer, zoom, x, y)
+        try:
+            with open(path, 'rb') as f:
+                if _expired(os.fstat(f.fileno()).st_mtime, ttl):
+                    os.remove(path)
+                    return None
+                return f.read()
+        except OSError:
+            return None
+
+    def contains(self, layer, zoom, x, y, ttl=None):
+        try:
+            mtime = os.stat(self.tile_path(layer, zoom, x, y)).st_mtime
+        except OSError:
+            return False
+
+        return not _expired(mtime, ttl)
+
+    def put(self, layer, zoom, tiles, ttl=None):
+        for (x, y), data in tiles.items():
+            write_file(data, self.tile_path(layer, zoom, x, y))
+
+    def expire(self, now=None):
+        # Expired tiles are removed when they are requested
+        return 0
+
+    def drop_times(self, dataset, before):
+        # .../<projection>/<dataset>/<variable>/<time>
+        pattern = os.path.join(self.directory, "api", "v1.0", "tiles", "*", "*", "*", "*",
+                               glob.escape(dataset), "*", "*")
+        dropped = set()
+        for path in glob.glob(pattern):
+            name = os.path.basename(path)
+            if name.isdigit() and int(name) < before:
+                shutil.rmtree(path, ignore_errors=True)
+                dropped.add(int(name))
+
+        return len(dropped)
+
+
+class SQLiteTileStore(TileStore):
+    """One MBTiles-like SQLite file per dataset, variable and timestamp.
+
+    Each thread has its own connections, so a connection is never closed
+    (evicted) while another thread is using it.
+    """
+
+    SUFFIX = ".mbtiles"
+    CONNECTIONS = 16  # per thread
+
+    def __init__(self, directory: str) -> None:
+        super().__init__(directory)
+        self._local = threading.local()
+
+    def path(self, dataset: str, variable: str, time: int) -> str:
+        return os.path.join(self.directory, dataset, variable, "%s%s" % (time, self.SUFFIX))
+
+    def _connect(self, path: str, create: bool = False) -> Union[sqlite3.Connection, None]:
+        try:
+            inode = os.stat(path).st_ino
+        except OSError:
+            if not create:
+                return None
+            inode = None
+
+        connections = self._connections()
+        cached = connections.get(path)
+        if cached is not None and cached[1] == inode:
+            return cached[0]
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Used by one thread, but may be closed by another when the thread's
+        # connections are garbage collected
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS tiles ("
+                     "layer TEXT, zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, "
+                     "tile_data BLOB, expires REAL, "
+                     "PRIMARY KEY (layer, zoom_level, tile_column, tile_row)) WITHOUT ROWID")
+        conn.execute("CREATE INDEX IF NOT EXISTS tiles_expires ON tiles (expires)")
+        conn.execute("INSERT OR IGNORE INTO metadata VALUES ('format', 'png')")
+        conn.execute("COMMIT")
+
+        connections[path] = (conn, os.stat(path).st_ino)
+
+        return conn
+
+    def _connections(self) -> LRUCache:
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            # Connections can't be shared with forked processes
+            local.connections = _Connections(maxsize=self.CONNECTIONS)
+            local.pid = os.getpid()
+
+        return local.connections
+
+    @staticmethod
+    def _layer_key(layer: Layer) -> str:
+        return "/".join(str(v) for v in (layer.interp, layer.radius, layer.neighbours,
+                                         layer.projection, layer.depth, layer.scale))
+
+    def get(self, layer, zoom, x, y, ttl=None):
+        conn = self._connect(self.path(layer.dataset, layer.variable, layer.time))
+        if conn is None:
+            return None
+
+        row = conn.execute(
+            "SELECT tile_data FROM tiles WHERE layer = ? AND zoom_level = ? AND "
+            "tile_column = ? AND tile_row = ? AND (expires IS NULL OR expires > ?)",
+            (self._layer_key(layer), zoom, x, y, time.time())
+        ).fetchone()
+
+        return row[0] if row is not None else None
+
+    def contains(self, layer, zoom, x, y, ttl=None):
+        conn = self._connect(self.path(layer.dataset, layer.variable, layer.time))
+        if conn is None:
+            return False
+
+        row = conn.execute(
+            "SELECT 1 FROM tiles WHERE layer = ? AND zoom_level = ? AND "
+            "tile_column = ? AND tile_row = ? AND (expires IS NULL OR expires > ?)",
+            (self._layer_key(layer), zoom, x, y, time.time())
+        ).fetchone()
+
+        return row is not None
+
+    def put(self, layer, zoom, tiles, ttl=None):
+        conn = self._connect(self.path(layer.dataset, layer.variable, layer.time), create=True)
+        expires = time.time() + ttl * 3600 if ttl is not None else None
+        key = self._layer_key(layer)
+
+        # One transaction, so other workers see all the tiles or none
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?)",
+                             [(key, zoom, x, y, sqlite3.Binary(data), expires)
+                              for (x, y), data in tiles.items()])
+            conn.execute("INSERT OR REPLACE INTO metadata VALUES ('ttl_hours', ?)",
+                         (str(ttl) if ttl is not None else '',))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _stores(self, dataset: str = "*") -> list:
+        if dataset != "*":
+            dataset = glob.escape(dataset)
+
+        return glob.glob(os.path.join(self.directory, dataset, "*", "*" + self.SUFFIX))
+
+    def expire(self, now=None):
+        now = now or time.time()
+        deleted = 0
+        for path in self._stores():
+            conn = self._connect(path)
+            if conn is None:
+                continue
+            deleted += conn.execute("DELETE FROM tiles WHERE expires <= ?", (now,)).rowcount
+
+        return deleted
+
+    def drop_times(self, dataset, before):
+        dropped = set()
+        for path in self._stores(dataset):
+            name = os.path.basename(path)[:-len(self.SUFFIX)]
+            if name.isdigit() and int(name) < before:
+                for p in (path, path + "-wal", path + "-shm"):
+                    try:
+                        os.remove(p)
+                    except OSError:
+                        pass
+                dropped.add(int(name))
+
+        return len(dropped)
+
+
+class _Connections(LRUCache):
+    """LRU cache of the open store connections of a thread, closing evicted
+    ones.
+    """
+
+    def popitem(self):
+        key, (conn, _) = super().popitem()
+        conn.close()
+        return key, (conn, _)
+
+
+_stores: dict = {}
+_stores_lock = threading.Lock()
+
+
+def tile_store() -> TileStore:
+    """Returns the tile store selected by the TILE_STORE setting.
+    """
+    backend = get_app_setting('TILE_STORE', 'filesystem')
+    cache_dir = get_app_setting('CACHE_DIR')
+
+    if backend == 'filesystem':
+        key = (FilesystemTileStore, cache_dir)
+    elif backend == 'sqlite':
+        key = (SQLiteTileStore,
+               get_app_setting('TILE_STORE_DIR') or os.path.join(cache_dir, "tilestore"))
+    else:
+        raise ValueError("Unknown TILE_STORE %s." % backend)
+
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = key[0](key[1])
+
+    return store
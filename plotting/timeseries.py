@@ -12,6 +12,8 @@ from mpl_toolkits.axes_grid1 import make_axes_locatable
 import plotting.colormap as colormap
 import plotting.utils as utils
 from data import open_dataset
+from data.chunking import POINT_SERIES
+from data.point_extraction import extract_timeseries
 from plotting.point import PointPlotter
 
 LINEAR = 200
@@ -44,7 +46,7 @@ class TimeseriesPlotter(PointPlotter):
 
     def load_data(self):
         
-        with open_dataset(self.dataset_config, variable=self.variables, timestamp=self.starttime, endtime=self.endtime) as dataset:
+        with open_dataset(self.dataset_config, variable=self.variables, timestamp=self.starttime, endtime=self.endtime, access=POINT_SERIES) as dataset:
             self.load_misc(dataset, self.variables)
 
             variable = self.variables[0]
@@ -73,32 +75,25 @@ class TimeseriesPlotter(PointPlotter):
                     set(dataset.nc_data.depth_dimensions)):
                 self.depth = 0
 
-            point_data = []
-            depths = []
-            for p in self.points:
-                data = []
-                if self.depth == 'all':
-                    d, depths = dataset.get_timeseries_profile(
-                        float(p[0]),
-                        float(p[1]),
-                        self.starttime,
-                        self.endtime,
-                        variable
-                    )
-                else:
-                    d, depths = dataset.get_timeseries_point(
-                        float(p[0]),
-                        float(p[1]),
-                        self.depth,
-                        self.starttime,
-                        self.endtime,
-                        variable,
-                        return_depth=True
-                    )
-                data.append(d)
-                point_data.append(np.ma.array(data))
-
-            point_data = np.ma.array(point_data)
+            # One batched read of every point (and depth) per file
+            if self.depth == 'all':
+                depths = dataset.depths
+                point_data = extract_timeseries(
+                    dataset, self.points, [variable], list(range(len(depths))),
+                    self.starttime, self.endtime
+                ).transpose(0, 1, 3, 2)
+            else:
+                # As get_timeseries_point(..., return_depth=True) returns it
+                depths = None
+                if self.depth != 'bottom':
+                    duration = (dataset.nc_data.timestamp_to_time_index(self.endtime) -
+                                dataset.nc_data.timestamp_to_time_index(self.starttime))
+                    depths = np.array([np.tile(dataset.depths[self.depth], 1)] * duration)
+                point_data = extract_timeseries(
+                    dataset, self.points, [variable], [self.depth],
+                    self.starttime, self.endtime
+                )[:, :, 0]
+
             for idx, factor in enumerate(self.scale_factors):
                 if factor != 1.0:
                     point_data[idx] = np.multiply(point_data[idx], factor)
@@ -15,6 +15,7 @@ from scipy.interpolate import interp1d
 import plotting.utils as utils
 import plotting.colormap as colormap
 from data import open_dataset
+from data.chunking import PATH
 from data.utils import datetime_to_timestamp
 from data.observational import db, Platform, DataType, Station, Sample
 from data.observational.queries import get_platform_variable_track
@@ -110,7 +111,7 @@ class TrackPlotter(Plotter):
             points_simplified = np.array(vw.simplify(self.points, number=100))
 
         if len(self.variables) > 0:
-            with open_dataset(self.dataset_config, timestamp=start, endtime=end, variable=self.variables, nearest_timestamp=True) as dataset:
+            with open_dataset(self.dataset_config, timestamp=start, endtime=end, variable=self.variables, nearest_timestamp=True, access=PATH) as dataset:
                 # Make distance -> time function
                 dist_to_time = interp1d(
                     self.distances,
@@ -8,6 +8,7 @@ from flask_babel import gettext
 
 import plotting.utils as utils
 from data import open_dataset
+from data.chunking import PROFILE
 from plotting.point import PointPlotter
 
 
@@ -43,7 +44,7 @@ class TemperatureSalinityPlotter(PointPlotter):
         temp_var_key = self.__find_var_key(variables, r'^(.*temp.*|thetao.*)$')
         sal_var_key = self.__find_var_key(variables, r'^(.*sal.*|so)$')
 
-        with open_dataset(self.dataset_config, timestamp=self.time, variable=[temp_var_key, sal_var_key]) as ds:
+        with open_dataset(self.dataset_config, timestamp=self.time, variable=[temp_var_key, sal_var_key], access=PROFILE) as ds:
 
             self.iso_timestamp = ds.nc_data.timestamp_to_iso_8601(self.time)
 
@@ -11,17 +11,19 @@ from io import BytesIO
 import numpy as np
 from flask import (Blueprint, Flask, Response, current_app, jsonify, request,
                    send_file, send_from_directory)
-from PIL import Image
 from dateutil.parser import parse as dateparse
 from shapely.geometry import Polygon, LinearRing, Point
 
 import data.class4 as class4
+import data.subset_jobs as subset_jobs
 import plotting.colormap
 import plotting.scale
 import plotting.tile
+import plotting.tile_cache as tile_cache
 import utils.misc
+import utils.single_flight as single_flight
 from data import open_dataset
-from data.sqlite_database import SQLiteDatabase
+from data.subset_writer import stream_zip
 from data.utils import (DateTimeEncoder, get_data_vars_from_equation,
                         time_index_to_datetime)
 from data.observational import db as DB
@@ -42,6 +44,7 @@ from plotting.stick import StickPlotter
 from plotting.timeseries import TimeseriesPlotter
 from plotting.transect import TransectPlotter
 from plotting.ts import TemperatureSalinityPlotter
+from utils.compute_budget import metrics as compute_metrics
 from utils.errors import APIError, ClientError, ErrorBase
 
 bp_v1_0 = Blueprint('api_v1_0', __name__)
@@ -229,26 +232,32 @@ def depth_query_v1_0():
     config = DatasetConfig(dataset)
 
     data = []
-    with open_dataset(config, variable=variable, timestamp=-1) as ds:
+    with open_dataset(config, meta_only=True) as ds:
         if not variable in ds.variables:
             raise APIError("Variable not found in dataset: " + variable)
 
         v = ds.variables[variable]
+        depths = ds.nc_data.catalog.depths_for(v) if v.has_depth() else None
 
-        if v.has_depth():
-            if str(args.get('all')).lower() in ['true', 'yes', 'on']:
-                data.append(
-                    {'id': 'all', 'value': gettext('All Depths')})
+    if v.has_depth():
+        if depths is None:
+            # Depth axis missing from the catalog; read it from the files
+            with open_dataset(config, variable=variable, timestamp=-1) as ds:
+                depths = ds.depths
 
-            for idx, value in enumerate(np.round(ds.depths)):
-                data.append({
-                    'id': idx,
-                    'value': "%d m" % (value)
-                })
+        if str(args.get('all')).lower() in ['true', 'yes', 'on']:
+            data.append(
+                {'id': 'all', 'value': gettext('All Depths')})
 
-            if len(data) > 0:
-                data.insert(
-                    0, {'id': 'bottom', 'value': gettext('Bottom')})
+        for idx, value in enumerate(np.round(depths)):
+            data.append({
+                'id': idx,
+                'value': "%d m" % (value)
+            })
+
+        if len(data) > 0:
+            data.insert(
+                0, {'id': 'bottom', 'value': gettext('Bottom')})
 
     data = [
         e for i, e in enumerate(data) if data.index(e) == i
@@ -269,27 +278,38 @@ def scale_v1_0(dataset: str, variable: str, scale: str):
     Returns a scale bar
     """
 
+    def render():
+        return plotting.tile.scale({
+            'dataset': dataset,
+            'variable': variable,
+            'scale': scale,
+        }).getvalue()
 
-    bytesIOBuff = plotting.tile.scale({
-        'dataset': dataset,
-        'variable': variable,
-        'scale': scale,
-    })
+    # Scale bars follow the dataset's variable config, which may be edited
+    img = single_flight.memoize('scale', single_flight.request_key(request.path), render,
+                                ttl=86400)
 
-    return send_file(bytesIOBuff, mimetype="image/png", cache_timeout=MAX_CACHE)
+    return send_file(BytesIO(img), mimetype="image/png", cache_timeout=MAX_CACHE)
 
 
 @bp_v1_0.route('/api/v1.0/range/<string:dataset>/<string:variable>/<string:interp>/<int:radius>/<int:neighbours>/<string:projection>/<string:extent>/<string:depth>/<int:time>.json')
 def range_query_v1_0(dataset: str, variable: str, interp: str, radius: int, neighbours: int, projection: str, extent: str, depth: str, time: int):
     extent = list(map(float, extent.split(",")))
 
-    minValue, maxValue = plotting.scale.get_scale(
-        dataset, variable, depth, time, projection, extent, interp, radius*1000, neighbours)
+    # Ranges expire with the dataset's tiles, as the data may be replaced
+    cache = DatasetConfig(dataset).cache
+    ttl = cache * 3600 if cache is not None else MAX_CACHE
+
+    minValue, maxValue = single_flight.memoize(
+        'range', single_flight.request_key(request.path),
+        lambda: plotting.scale.get_scale(dataset, variable, depth, time, projection, extent,
+                                         interp, radius*1000, neighbours),
+        ttl=ttl)
     resp = jsonify({
         'min': minValue,
         'max': maxValue,
     })
-    resp.cache_control.max_age = MAX_CACHE
+    resp.cache_control.max_age = ttl
     return resp
 
 
@@ -397,18 +417,104 @@ def subset_query_v1_0():
     else:
         args = request.form
 
-    working_dir = None
-    subset_filename = None
+    # Output of a finished subset job for the same query, or of a new job:
+    # the subset is computed by the subset workers, this worker only waits.
+    path = subset_jobs.cached_result(args)
+    if path is None:
+        try:
+            state = subset_jobs.wait(subset_jobs.submit(args)['job_id'])
+        except ValueError as e:
+            raise APIError(str(e))
+
+        path = subset_jobs.result_path(state['job_id']) if state is not None else None
+        if path is None:
+            error = state.get('error') if state is not None else None
+            raise APIError("Subset failed: %s" % (error or "the job stalled"))
+
+    return _send_subset(path, int(args.get('should_zip', 0)) == 1)
+
+
+@bp_v1_0.route('/api/v1.0/subset/jobs/', methods=['GET', 'POST'])
+def subset_job_submit_v1_0():
+    """
+    Queues a subset (same parameters as /api/v1.0/subset/) to be computed
+    by the subset workers, and returns the status of the job.
+    """
+
+    args = None
+    if request.method == 'GET':
+        args = request.args
+    else:
+        args = request.form
+
+    try:
+        state = subset_jobs.submit(args)
+    except ValueError as e:
+        raise APIError(str(e))
+
+    return jsonify(state), 202
+
+
+@bp_v1_0.route('/api/v1.0/subset/jobs/<string:job_id>/')
+def subset_job_status_v1_0(job_id: str):
+    """
+    Returns the status of a subset job: queued, running (with progress),
+    done or failed (with the error).
+    """
+
+    state = subset_jobs.job_status(job_id)
+    if state is None:
+        raise ClientError("Unknown subset job %s." % job_id)
+
+    return jsonify(state)
+
+
+@bp_v1_0.route('/api/v1.0/subset/jobs/<string:job_id>/download/')
+def subset_job_download_v1_0(job_id: str):
+    """
+    Sends the output of a finished subset job (zipped if should_zip=1).
+    """
+
+    path = subset_jobs.result_path(job_id)
+    if path is None:
+        raise ClientError("Subset job %s is not done." % job_id)
+
+    return _send_subset(path, int(request.args.get('should_zip', 0)) == 1)
+
 
-    config = DatasetConfig(args.get('dataset_name'))
-    time_range = args['time'].split(',')
-    variables = args['variables'].split(',')
-    with open_dataset(config, variable=variables, timestamp=int(time_range[0]), endtime=int(time_range[1])) as dataset:
-        working_dir, subset_filename = dataset.nc_data.subset(args)
+def _send_subset(path: str, should_zip: bool):
+    working_dir, subset_filename = os.path.split(path)
+
+    if should_zip:
+        # Send the archive as it is compressed
+        zip_filename = os.path.splitext(subset_filename)[0] + ".zip"
+        return Response(
+            stream_zip(path),
+            mimetype='application/zip',
+            headers={'Content-Disposition': 'attachment; filename=%s' % zip_filename}
+        )
 
     return send_from_directory(working_dir, subset_filename, as_attachment=True)
 
 
+@bp_v1_0.route('/api/v1.0/metrics/compute/')
+def compute_metrics_v1_0():
+    """
+    Returns the thread budget utilisation of the worker handling the request.
+    """
+
+    return jsonify(compute_metrics())
+
+
+@bp_v1_0.route('/api/v1.0/metrics/coalescing/')
+def coalescing_metrics_v1_0():
+    """
+    Returns the request coalescing rate of the worker handling the request.
+    """
+
+    return jsonify(single_flight.metrics())
+
+
 @bp_v1_0.route('/api/v1.0/plot/', methods=['GET', 'POST'])
 def plot_v1_0():
     """
@@ -516,7 +622,10 @@ def plot_v1_0():
         data = plotter.prepare_plot()
         return data
 
-    img, mime, filename = plotter.run()
+    # Identical plots requested within their max-age are rendered once
+    img, mime, filename = single_flight.memoize(
+        'plot', single_flight.request_key(query, fmt, options['size'], options['dpi']),
+        plotter.run, ttl=300)
 
     if img:
         response = make_response(img, mime)
@@ -598,7 +707,8 @@ def colormap_image_v1_0():
     Returns image of colourmap example configurations
     """
 
-    img = plotting.colormap.plot_colormaps()
+    img = single_flight.memoize('colormaps', single_flight.request_key(request.path),
+                                plotting.colormap.plot_colormaps, ttl=86400)
     resp = Response(img, status=200, mimetype='image/png')
     resp.cache_control.max_age = 86400
     return resp
@@ -725,19 +835,16 @@ def timestamps():
         raise APIError("Please specify a variable via ?variable=variable_name")
     variable = args.get("variable")
 
-    # Handle possible list of URLs for staggered grid velocity field datasets
-    url = config.url if not isinstance(config.url, list) else config.url[0]
-    if url.endswith(".sqlite3"):
-        with SQLiteDatabase(url) as db:
-            if variable in config.calculated_variables:
-                data_vars = get_data_vars_from_equation(config.calculated_variables[variable]['equation'],
-                                                        [v.key for v in db.get_data_variables()])
-                vals = db.get_timestamps(data_vars[0])
-            else:
-                vals = db.get_timestamps(variable)
+    # Served from the dataset's metadata catalog
+    with open_dataset(config, meta_only=True) as ds:
+        catalog = ds.nc_data.catalog
+
+    if variable in config.calculated_variables:
+        data_vars = get_data_vars_from_equation(config.calculated_variables[variable]['equation'],
+                                                [v.key for v in catalog.variables])
+        vals = catalog.timestamps(data_vars[0])
     else:
-        with open_dataset(url, variable=variable) as ds:
-            vals = list(map(int, ds.nc_data.time_variable.values))
+        vals = catalog.timestamps(variable)
     converted_vals = time_index_to_datetime(vals, config.time_dim_units)
 
     result = []
@@ -763,18 +870,15 @@ def tile_v1_0(projection: str, interp: str, radius: int, neighbours: int, datase
         Produces the map data tiles
     """
 
-    cache_dir = current_app.config['CACHE_DIR']
-    f = os.path.join(cache_dir, request.path[1:])
-
-    # Check if the tile/image is cached and send it
-    if _is_cache_valid(dataset, f):
-        return send_file(f, mimetype='image/png', cache_timeout=MAX_CACHE)
-    # Render a new tile/image, then cache and send it
+    store = tile_cache.tile_store()
+    layer = tile_cache.Layer(interp, radius, neighbours, projection, dataset, variable, time,
+                             depth, scale)
+    ttl = DatasetConfig(dataset).cache
 
     if depth != "bottom" and depth != "all":
         depth = int(depth)
 
-    img = plotting.tile.plot(projection, x, y, zoom, {
+    args = {
         'interp': interp,
         'radius': radius*1000,
         'neighbours': neighbours,
@@ -783,9 +887,24 @@ def tile_v1_0(projection: str, interp: str, radius: int, neighbours: int, datase
         'time': time,
         'depth': depth,
         'scale': scale,
-    })
+    }
 
-    return _cache_and_send_img(img, f)
+    size = int(current_app.config.get('TILE_METATILE_SIZE', tile_cache.DEFAULT_METATILE_SIZE))
+    x0, y0, n = plotting.tile.metatile_bounds(x, y, zoom, size)
+
+    def render():
+        # Render the whole metatile holding this tile and cache all of its
+        # tiles. Requests for the other tiles wait for the render to finish,
+        # then find their tile in the cache.
+        tiles = plotting.tile.plot_metatile(projection, x, y, zoom, args, size)
+        tiles = {t: img.getvalue() for t, img in tiles.items()}
+        store.put(layer, zoom, tiles, ttl)
+        return tiles[(x, y)]
+
+    data = single_flight.coalesce('tile', tile_cache.metatile_key(layer, zoom, n, x0, y0),
+                                  lambda: store.get(layer, zoom, x, y, ttl), render)
+
+    return send_file(BytesIO(data), mimetype='image/png', cache_timeout=MAX_CACHE)
 
 
 @bp_v1_0.route('/api/v1.0/tiles/topo/<string:shaded_relief>/<string:projection>/<int:zoom>/<int:x>/<int:y>.png')
@@ -1264,47 +1383,15 @@ def after_request(response):
     return response
 
 
-def _is_cache_valid(dataset: str, f: str) -> bool:
-    """
-        Returns True if dataset cache is valid
-    """
-
-    config = DatasetConfig(dataset)
-    if os.path.isfile(f):
-        cache_time = config.cache
-        if cache_time is not None:
-            modtime = datetime.datetime.fromtimestamp(
-                os.path.getmtime(f)
-            )
-            age_hours = (
-                datetime.datetime.now() - modtime
-            ).total_seconds() / 3600
-            if age_hours > cache_time:
-                os.remove(f)
-                return False
-            else:
-                return True
-        else:
-            return True
-    else:
-        return False
-
 def _cache_and_send_img(bytesIOBuff: BytesIO, f: str):
     """
-        Caches a rendered image buffer on disk and sends it to the browser
+        Sends a rendered image buffer to the browser, and caches it on disk
+        in the background
 
         bytesIOBuff: BytesIO object containing image data
         f: filename of image to be cached
     """
-    p = os.path.dirname(f)
-    if not os.path.isdir(p):
-        os.makedirs(p)
-
-    # This seems excessive
-    bytesIOBuff.seek(0)
-    dataIO = BytesIO(bytesIOBuff.read())
-    im = Image.open(dataIO)
-    im.save(f, format='PNG', optimize=True)  # For cache
+    tile_cache.write_behind(bytesIOBuff.getvalue(), f)
 
     bytesIOBuff.seek(0)
     return send_file(bytesIOBuff, mimetype="image/png", cache_timeout=MAX_CACHE)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+Build the metadata catalogs of sqlite-indexed datasets.
+
+The Ocean Navigator builds a dataset's catalog (dimensions, variables, depth
+and time axes) the first time it is needed after the sqlite index changes.
+This script builds them ahead of time; it is intended to be run by the
+indexing cron job right after the indexes are updated.
+
+Usage:
+    python scripts/build_dataset_catalog.py \\
+        --datasetconfig oceannavigator/configs/datasetconfig.json [giops_day ...]
+"""
+
+import argparse
+import json
+import logging
+import sys
+
+import data.catalog
+from data.netcdf_data import NetCDFData
+
+logging.basicConfig(format='%(message)s', level=logging.INFO)
+log = logging.getLogger()
+
+
+def build_catalog(url: str, catalog_dir: str = None) -> bool:
+    path = data.catalog.catalog_path(url, catalog_dir)
+    if path is None:
+        log.info(f"Skipping {url}: only sqlite-indexed datasets have a saved catalog.")
+        return True
+
+    version = data.catalog.catalog_version(url)
+    if version is None:
+        log.error(f"Index file {url} not found.")
+        return False
+
+    existing = data.catalog.load_catalog(path)
+    if existing is not None and existing.version == version:
+        log.info(f"Catalog {path} is up to date.")
+        return True
+
+    log.info(f"Building catalog of {url}...")
+    try:
+        catalog = NetCDFData(url).build_catalog()
+    except Exception:
+        log.exception(f"Unable to build the catalog of {url}.")
+        return False
+    catalog.version = version
+
+    data.catalog.save_catalog(catalog, path)
+    log.info(f"Wrote {path}.")
+
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--datasetconfig', dest='datasetconfig', required=True,
+                        type=argparse.FileType('r'),
+                        help='Ocean Navigator dataset configuration file (datasetconfig.json).')
+    parser.add_argument('--catalog-dir', dest='catalog_dir', default=None,
+                        help='Save the catalogs in this directory (DATASET_CATALOG_DIR) '
+                             'instead of next to the indexes.')
+    parser.add_argument('datasets', nargs='*',
+                        help='Keys of the datasets to build (default: all enabled datasets).')
+    opts = parser.parse_args()
+
+    config = json.load(opts.datasetconfig)
+
+    keys = opts.datasets or [k for k, v in config.items() if v.get('enabled')]
+    unknown = [k for k in keys if k not in config]
+    if unknown:
+        log.error(f"Error: unknown dataset(s) {', '.join(unknown)}.")
+        sys.exit(1)
+
+    ok = True
+    for key in keys:
+        url = config[key].get('url')
+        if isinstance(url, list):
+            url = url[0]
+        if not url:
+            continue
+        ok = build_catalog(url, opts.catalog_dir) and ok
+
+    log.info('Finished.')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
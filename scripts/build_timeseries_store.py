@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""
+Build or extend the time-contiguous timeseries stores of sqlite-indexed
+datasets (see data/timeseries_store.py).
+
+Only the timesteps later than the last one already in a store are appended,
+so this is intended to be run by the indexing cron job right after the
+indexes are updated. Each run writes the new timesteps to a new segment of
+the store, so the existing ones are never copied, and builders on several
+hosts may share --store-dir.
+
+Usage:
+    python scripts/build_timeseries_store.py \\
+        --datasetconfig oceannavigator/configs/datasetconfig.json \\
+        --store-dir /data/timeseries giops_day:votemper,vosaline [riops_daily ...]
+
+A dataset given without variables gets a store for each of its variables.
+"""
+
+import argparse
+import json
+import logging
+import sys
+
+import data.timeseries_store
+from data.sqlite_database import SQLiteDatabase
+
+logging.basicConfig(format='%(message)s', level=logging.INFO)
+log = logging.getLogger()
+
+
+def build_store(url: str, variable: str, store_dir: str = None) -> bool:
+    path = data.timeseries_store.store_path(url, variable, store_dir)
+    if path is None:
+        log.error("Set --store-dir (or TIMESERIES_STORE_DIR) for sqlite-indexed datasets.")
+        return False
+
+    times = data.timeseries_store.store_times(path)
+    with SQLiteDatabase(url) as db:
+        timestamps = db.get_timestamps(variable)
+        if times is not None and len(times):
+            timestamps = [t for t in timestamps if t > times[-1]]
+        if not timestamps:
+            log.info(f"Store {path} is up to date.")
+            return True
+        files = sorted(db.get_netcdf_files(timestamps, [variable]))
+
+    log.info(f"Appending {len(timestamps)} timesteps of {variable} from {len(files)} files...")
+    try:
+        appended = data.timeseries_store.append_to_store(path, variable, files)
+    except Exception:
+        log.exception(f"Unable to update {path}.")
+        return False
+    log.info(f"Appended {appended} timesteps to {path}.")
+
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--datasetconfig', dest='datasetconfig', required=True,
+                        type=argparse.FileType('r'),
+                        help='Ocean Navigator dataset configuration file (datasetconfig.json).')
+    parser.add_argument('--store-dir', dest='store_dir', default=None,
+                        help='Directory of the stores (TIMESERIES_STORE_DIR).')
+    parser.add_argument('datasets', nargs='+',
+                        help='Keys of the datasets, optionally followed by a colon and '
+                             'a comma-separated list of variables.')
+    opts = parser.parse_args()
+
+    config = json.load(opts.datasetconfig)
+
+    ok = True
+    for arg in opts.datasets:
+        key, _, variables = arg.partition(':')
+        if key not in config:
+            log.error(f"Error: unknown dataset {key}.")
+            ok = False
+            continue
+
+        url = config[key].get('url')
+        if isinstance(url, list):
+            url = url[0]
+        if not url or not url.endswith(".sqlite3"):
+            log.info(f"Skipping {key}: only sqlite-indexed datasets have timeseries stores.")
+            continue
+
+        if variables:
+            variables = variables.split(',')
+        else:
+            with SQLiteDatabase(url) as db:
+                variables = [v.key for v in db.get_data_variables()]
+
+        for variable in variables:
+            ok = build_store(url, variable, opts.store_dir) and ok
+
+    log.info('Finished.')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""
+Remove expired tiles from the tile store (the TILE_STORE setting, see
+plotting/tile_cache.py).
+
+Tiles older than their dataset's cache time are deleted. With --before, every
+tile of the given datasets' timestamps earlier than --before is deleted too,
+e.g. once a rolling forecast has dropped them.
+
+The coalesced scales, ranges and plots (see utils/single_flight.py) older
+than --results-age seconds (default SINGLE_FLIGHT_MAX_AGE) are removed as
+well.
+
+Usage:
+    python scripts/expire_tiles.py --before 2212704000 giops_day riops_day
+"""
+
+import argparse
+import logging
+import os
+
+from flask import Flask
+
+import plotting.tile_cache as tile_cache
+import utils.single_flight as single_flight
+
+logging.basicConfig(format='%(message)s', level=logging.INFO)
+log = logging.getLogger()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', dest='config',
+                        default=os.path.join(os.path.dirname(__file__), '..', 'oceannavigator',
+                                             'oceannavigator.cfg'),
+                        help='Ocean Navigator settings (for CACHE_DIR and TILE_STORE).')
+    parser.add_argument('--before', type=int, default=None,
+                        help='Drop the timestamps earlier than this one (in the dataset\'s '
+                             'time units).')
+    parser.add_argument('--results-age', type=int, default=None,
+                        help='Remove coalesced results older than this, in seconds. '
+                             '(default: SINGLE_FLIGHT_MAX_AGE, or 86400)')
+    parser.add_argument('datasets', nargs='*', help='Keys of the datasets.')
+    opts = parser.parse_args()
+
+    if opts.datasets and opts.before is None:
+        parser.error("--before is required with datasets.")
+
+    app = Flask('oceannavigator')
+    app.config.from_pyfile(os.path.abspath(opts.config), silent=False)
+    app.config.from_envvar('OCEANNAVIGATOR_SETTINGS', silent=True)
+
+    with app.app_context():
+        store = tile_cache.tile_store()
+
+        log.info(f"{store.expire()} expired tiles deleted.")
+        for dataset in opts.datasets:
+            count = store.drop_times(dataset, opts.before)
+            log.info(f"{dataset}: {count} timestamps dropped.")
+
+        log.info(f"{single_flight.purge(opts.results_age)} coalesced results removed.")
+
+
+if __name__ == '__main__':
+    main()
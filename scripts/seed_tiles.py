@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+
+"""
+Pre-render data tiles into the tile cache.
+
+The first users of a new timestep pay the full cost of rendering every tile
+they look at. This renders the tiles of the given layers ahead of time into
+the tile store that /api/v1.0/tiles/ reads (the TILE_STORE setting, see
+plotting/tile_cache.py), one metatile at a time in a pool of processes. It takes the same metatile
+locks as the web workers, so seeding and live requests never render the
+same metatile twice.
+
+Metatiles whose tiles are all cached are skipped. Rendered metatiles are also
+appended to the --progress file, so an interrupted run can be resumed.
+
+Usage:
+    python scripts/seed_tiles.py \\
+        --datasetconfig oceannavigator/configs/datasetconfig.json \\
+        --variables votemper,vosaline --depths 0 --times latest:2 \\
+        --projections EPSG:3857,EPSG:32661 --zooms 2-7 \\
+        --polygon "POLYGON((-70 40, -40 40, -40 60, -70 60, -70 40))" \\
+        --processes 8 --rate 200 --progress /tmp/seed.progress giops_day
+
+--times is "latest" (default), "latest:N" (the last N timestamps),
+"START:END" (every timestamp in the range) or a comma-separated list.
+Polygons are in WKT, in longitude/latitude. --rate limits the number of
+tiles per second.
+
+The throughput (tiles per second, and per core) is printed at the end, and
+appended as JSON to the --report file if one is given.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+
+from flask import Flask
+from shapely import wkt
+from shapely.ops import unary_union
+
+import plotting.tile
+import plotting.tile_cache as tile_cache
+import utils.single_flight as single_flight
+from utils.compute_budget import compute_budget
+
+logging.basicConfig(format='%(message)s', level=logging.INFO)
+log = logging.getLogger()
+
+PROJECTIONS = ('EPSG:3857', 'EPSG:32661', 'EPSG:3031')
+LOG_INTERVAL = 30  # seconds between progress messages
+
+
+def make_app(config_file: str, datasetconfig: str, processes: int) -> Flask:
+    """Returns an application with the settings of the web app, to give
+    the data and plotting code its configuration.
+    """
+    app = Flask('oceannavigator')
+    app.config.from_pyfile(os.path.abspath(config_file), silent=False)
+    app.config.from_envvar('OCEANNAVIGATOR_SETTINGS', silent=True)
+    app.config['datasetConfig'] = os.path.abspath(datasetconfig)
+    # The processes share the cores (see utils.compute_budget)
+    app.config.setdefault('COMPUTE_WORKERS', processes)
+
+    return app
+
+
+_app = None
+
+
+def _init_worker(config_file: str, datasetconfig: str, processes: int) -> None:
+    global _app
+    _app = make_app(config_file, datasetconfig, processes)
+    _app.app_context().push()
+
+
+def task_key(task: dict) -> str:
+    return "/".join(str(task[k]) for k in ('dataset', 'variable', 'time', 'depth', 'scale',
+                                           'projection', 'zoom', 'x', 'y'))
+
+
+def seed_metatile(task: dict) -> tuple:
+    """Renders and caches the tiles of a metatile, unless they are all
+    cached already.
+
+    Returns:
+        tuple -- (tiles rendered, tiles already cached, render seconds)
+    """
+    from oceannavigator import DatasetConfig
+
+    store = tile_cache.tile_store()
+    layer = tile_cache.Layer(task['interp'], task['radius'], task['neighbours'],
+                             task['projection'], task['dataset'], task['variable'],
+                             task['time'], task['depth'], task['scale'])
+    ttl = DatasetConfig(task['dataset']).cache
+    x0, y0, n = plotting.tile.metatile_bounds(task['x'], task['y'], task['zoom'], task['size'])
+    coords = [(x, y) for x in range(x0, x0 + n) for y in range(y0, y0 + n)]
+
+    def cached():
+        return not task['force'] and \
+            all(store.contains(layer, task['zoom'], x, y, ttl) for x, y in coords)
+
+    if cached():
+        return 0, len(coords), 0.0
+
+    with single_flight.lock(tile_cache.metatile_key(layer, task['zoom'], n, x0, y0)):
+        if cached():
+            return 0, len(coords), 0.0
+
+        start = time.time()
+        with compute_budget():
+            tiles = plotting.tile.plot_metatile(task['projection'], x0, y0, task['zoom'], {
+                'interp': task['interp'],
+                'radius': task['radius'] * 1000,
+                'neighbours': task['neighbours'],
+                'dataset': task['dataset'],
+                'variable': task['variable'],
+                'time': task['time'],
+                'depth': task['depth'],
+                'scale': task['scale'],
+            }, task['size'])
+
+        store.put(layer, task['zoom'], {t: buf.getvalue() for t, buf in tiles.items()}, ttl)
+
+    return len(tiles), 0, time.time() - start
+
+
+def select_times(timestamps: list, spec: str) -> list:
+    timestamps = sorted(int(t) for t in timestamps)
+    if spec == 'latest':
+        return timestamps[-1:]
+    if spec.startswith('latest:'):
+        return timestamps[-int(spec.split(':')[1]):]
+    if ':' in spec:
+        start, end = [int(t) for t in spec.split(':')]
+        return [t for t in timestamps if start <= t <= end]
+
+    return [int(t) for t in spec.split(',')]
+
+
+def variable_timestamps(dataset: str, variable: str) -> list:
+    from data import open_dataset
+    from data.utils import get_data_vars_from_equation
+    from oceannavigator import DatasetConfig
+
+    config = DatasetConfig(dataset)
+    with open_dataset(config, meta_only=True) as ds:
+        catalog = ds.nc_data.catalog
+
+    if variable in config.calculated_variables:
+        variable = get_data_vars_from_equation(config.calculated_variables[variable]['equation'],
+                                               [v.key for v in catalog.variables])[0]
+
+    return catalog.timestamps(variable)
+
+
+def build_tasks(opts, polygon) -> list:
+    from oceannavigator import DatasetConfig
+
+    zooms = [int(z) for z in opts.zooms.split('-')]
+    zooms = range(zooms[0], zooms[-1] + 1)
+    depths = [d if d == 'bottom' else int(d) for d in opts.depths.split(',')]
+
+    tasks = []
+    for dataset in opts.datasets:
+        config = DatasetConfig(dataset)
+        variables = opts.variables.split(',') if opts.variables else config.variables
+
+        for variable in variables:
+            scale = opts.scale or tile_cache.format_scale(config.variable[variable].scale)
+            times = select_times(variable_timestamps(dataset, variable), opts.times)
+
+            for t in times:
+                for depth in depths:
+                    for projection in opts.projections.split(','):
+                        for zoom in zooms:
+                            for x, y in plotting.tile.metatiles(projection, zoom,
+                                                                opts.metatile, polygon):
+                                tasks.append({
+                                    'dataset': dataset,
+                                    'variable': variable,
+                                    'time': t,
+                                    'depth': depth,
+                                    'scale': scale,
+                                    'projection': projection,
+                                    'zoom': zoom,
+                                    'x': x,
+                                    'y': y,
+                                    'size': opts.metatile,
+                                    'interp': opts.interp,
+                                    'radius': opts.radius,
+                                    'neighbours': opts.neighbours,
+                                    'force': opts.force,
+                                })
+
+    return tasks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--datasetconfig', dest='datasetconfig', required=True,
+                        help='Ocean Navigator dataset configuration file (datasetconfig.json).')
+    parser.add_argument('--config', dest='config',
+                        default=os.path.join(os.path.dirname(__file__), '..', 'oceannavigator',
+                                             'oceannavigator.cfg'),
+                        help='Ocean Navigator settings (for CACHE_DIR and ETOPO_FILE).')
+    parser.add_argument('--variables', default=None,
+                        help='Comma-separated variables (default: every visible variable).')
+    parser.add_argument('--depths', default='0',
+                        help='Comma-separated depth indices, or bottom. (default: 0)')
+    parser.add_argument('--times', default='latest',
+                        help='latest, latest:N, START:END or a comma-separated list.')
+    parser.add_argument('--projections', default='EPSG:3857',
+                        help='Comma-separated projections among %s.' % ', '.join(PROJECTIONS))
+    parser.add_argument('--zooms', default='0-7', help='Zoom range, e.g. 2-7.')
+    parser.add_argument('--polygon', action='append', default=[],
+                        help='Only seed tiles intersecting a WKT polygon (lon/lat), '
+                             'can be repeated.')
+    parser.add_argument('--scale', default=None,
+                        help='Colour scale as min,max (default: the variable\'s scale).')
+    parser.add_argument('--interp', default='gaussian')
+    parser.add_argument('--radius', type=int, default=25, help='Radius in km. (default: 25)')
+    parser.add_argument('--neighbours', type=int, default=10)
+    parser.add_argument('--metatile', type=int, default=tile_cache.DEFAULT_METATILE_SIZE,
+                        help='Tiles on each side of a metatile; must match '
+                             'TILE_METATILE_SIZE.')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Maximum tiles per second (default: unlimited).')
+    parser.add_argument('--progress', default=None,
+                        help='File recording the rendered metatiles, to resume a run.')
+    parser.add_argument('--report', default=None,
+                        help='File the throughput report is appended to (JSON lines).')
+    parser.add_argument('--force', action='store_true',
+                        help='Render tiles that are already cached.')
+    parser.add_argument('datasets', nargs='+', help='Keys of the datasets.')
+    opts = parser.parse_args()
+
+    for projection in opts.projections.split(','):
+        if projection not in PROJECTIONS:
+            parser.error(f"Unknown projection {projection}.")
+
+    polygon = unary_union([wkt.loads(p) for p in opts.polygon]) if opts.polygon else None
+
+    app = make_app(opts.config, opts.datasetconfig, opts.processes)
+    with app.app_context():
+        tasks = build_tasks(opts, polygon)
+
+    done = set()
+    if opts.progress and os.path.isfile(opts.progress):
+        with open(opts.progress) as f:
+            done = {line.strip() for line in f}
+    pending = [t for t in tasks if task_key(t) not in done]
+    log.info(f"{len(tasks)} metatiles, {len(tasks) - len(pending)} done in a previous run.")
+
+    progress = open(opts.progress, 'a') if opts.progress else None
+    rendered = skipped = failed = 0
+    render_seconds = 0.0
+    submitted_tiles = 0
+    start = last_log = time.time()
+
+    with ProcessPoolExecutor(max_workers=opts.processes, mp_context=get_context('spawn'),
+                             initializer=_init_worker,
+                             initargs=(opts.config, opts.datasetconfig, opts.processes)) as pool:
+        running = {}
+        queue = iter(pending)
+        while True:
+            # Keep the processes busy without queueing the whole run
+            for task in queue:
+                if opts.rate > 0:
+                    # Hold the submission until it fits in the rate limit
+                    delay = submitted_tiles / opts.rate - (time.time() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+                running[pool.submit(seed_metatile, task)] = task
+                submitted_tiles += task['size'] ** 2
+                if len(running) >= 2 * opts.processes:
+                    break
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = running.pop(future)
+                try:
+                    count, cached, seconds = future.result()
+                except Exception:
+                    log.exception(f"Unable to render {task_key(task)}.")
+                    failed += 1
+                    continue
+
+                rendered += count
+                skipped += cached
+                render_seconds += seconds
+                if progress is not None:
+                    progress.write(task_key(task) + "\n")
+                    progress.flush()
+
+            if time.time() - last_log >= LOG_INTERVAL:
+                last_log = time.time()
+                log.info(f"{rendered} tiles rendered, {skipped} already cached, "
+                         f"{len(running)} metatiles in progress...")
+
+    if progress is not None:
+        progress.close()
+
+    elapsed = time.time() - start
+    report = {
+        'date': datetime.datetime.utcnow().isoformat(),
+        'datasets': opts.datasets,
+        'metatiles': len(pending),
+        'failed': failed,
+        'tiles_rendered': rendered,
+        'tiles_cached': skipped,
+        'processes': opts.processes,
+        'seconds': round(elapsed, 3),
+        'tiles_per_second': round(rendered / elapsed, 3) if elapsed else 0.0,
+        'tiles_per_second_per_core': round(rendered / elapsed / opts.processes, 3)
+        if elapsed else 0.0,
+        # Throughput of a busy process, excluding waits (rate limit, skips)
+        'tiles_per_render_second': round(rendered / render_seconds, 3)
+        if render_seconds else 0.0,
+    }
+    log.info(json.dumps(report, indent=2))
+
+    if opts.report:
+        with open(opts.report, 'a') as f:
+            f.write(json.dumps(report) + "\n")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
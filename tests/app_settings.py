@@ -0,0 +1,17 @@
+"""
+Helpers for tests of modules that read settings with get_app_setting.
+"""
+
+from unittest.mock import patch
+
+
+def patch_settings(module: str, settings: dict):
+    """Returns a patch of get_app_setting in a module that reads the
+    settings from a dict (changes to the dict are seen by the module).
+
+    Arguments:
+        module {str} -- The module, e.g. 'plotting.tile_cache'.
+        settings {dict} -- The settings.
+    """
+    return patch(module + '.get_app_setting',
+                 side_effect=lambda key, default=None: settings.get(key, default))
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from utils.atomic_file import atomic_path, atomic_write, tmp_path
+
+
+class TestAtomicFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'a', 'b.png')
+
+    def test_atomic_write(self):
+        with atomic_write(self.path) as f:
+            f.write(b'png')
+            self.assertFalse(os.path.exists(self.path))
+
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'png')
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['b.png'])
+
+    def test_failed_write_is_removed(self):
+        with open(os.path.join(self.directory, 'c'), 'w') as f:
+            f.write('old')
+
+        with self.assertRaises(ValueError):
+            with atomic_path(os.path.join(self.directory, 'c')) as tmp:
+                with open(tmp, 'w') as f:
+                    f.write('new')
+                raise ValueError
+
+        self.assertEqual(os.listdir(self.directory), ['c'])
+        with open(os.path.join(self.directory, 'c')) as f:
+            self.assertEqual(f.read(), 'old')
+
+    def test_tmp_path_is_unique_per_thread(self):
+        paths = [tmp_path(self.path)]
+        thread = threading.Thread(target=lambda: paths.append(tmp_path(self.path)))
+        thread.start()
+        thread.join()
+
+        self.assertNotEqual(paths[0], paths[1])
+        self.assertTrue(paths[0].endswith('.tmp'))
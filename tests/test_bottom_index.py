@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import xarray as xr
+
+from data.bottom_index import (LAND, BottomIndexCache, bottom_index_path,
+                               compute_bottom_index, read_bottom)
+from utils import single_flight
+
+
+class TestBottomIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+        # (time, depth, y, x): 3 levels deep, 1 level deep and land
+        values = np.arange(2 * 4 * 1 * 3, dtype=np.float32).reshape(2, 4, 1, 3)
+        values[:, 3, :, :] = np.nan
+        values[:, 1:, :, 1] = np.nan
+        values[:, :, :, 2] = np.nan
+        self.var = xr.DataArray(values, dims=['time', 'depth', 'y', 'x'])
+        self.lat = xr.DataArray([[45., 45., 45.]], dims=['y', 'x'], name='nav_lat')
+        self.lon = xr.DataArray([[-60., -59., -58.]], dims=['y', 'x'], name='nav_lon')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_compute_bottom_index(self):
+        bottom = compute_bottom_index(self.var)
+
+        np.testing.assert_array_equal(bottom, [[2, 0, LAND]])
+        self.assertFalse(bottom.flags.writeable)
+
+    def test_read_bottom(self):
+        bottom = compute_bottom_index(self.var)
+
+        data = read_bottom(self.var, slice(0, 2), bottom, slice(0, 1), slice(0, 3))
+
+        np.testing.assert_array_equal(data[:, 0, :2], self.var.values[:, [2, 0], 0, [0, 1]])
+        self.assertTrue(data.mask[:, 0, 2].all())
+        self.assertEqual(read_bottom(self.var, 1, bottom, slice(0, 1), slice(0, 3)).shape, (1, 3))
+
+    def test_bottom_index_is_cached_and_saved(self):
+        url = os.path.join(self.tmpdir, "dataset.sqlite3")
+        with open(url, "w") as f:
+            f.write("x")
+        cache = BottomIndexCache()
+
+        with patch("data.bottom_index.compute_bottom_index",
+                   wraps=compute_bottom_index) as patch_compute:
+            cache.get(url, "votemper", self.var, self.lat, self.lon)
+            cache.get(url, "votemper", self.var, self.lat, self.lon)
+            cache.clear()
+            bottom = cache.get(url, "votemper", self.var, self.lat, self.lon)
+
+        patch_compute.assert_called_once()
+        self.assertTrue(os.path.isfile(bottom_index_path(url, "votemper")))
+        self.assertEqual(cache.info()['disk_hits'], 1)
+        np.testing.assert_array_equal(bottom, [[2, 0, LAND]])
+
+    def test_bottom_index_is_kept_when_index_changes(self):
+        url = os.path.join(self.tmpdir, "dataset.sqlite3")
+        with open(url, "w") as f:
+            f.write("x")
+        cache = BottomIndexCache()
+
+        with patch("data.bottom_index.compute_bottom_index",
+                   wraps=compute_bottom_index) as patch_compute:
+            cache.get(url, "votemper", self.var, self.lat, self.lon)
+            # Re-indexing the dataset doesn't change its grid
+            st = os.stat(url)
+            os.utime(url, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            cache.clear()
+            cache.get(url, "votemper", self.var, self.lat, self.lon)
+            patch_compute.assert_called_once()
+
+            # Another grid does
+            cache.get(url, "votemper", self.var, self.lat + 1, self.lon)
+
+        self.assertEqual(patch_compute.call_count, 2)
+
+    def test_bottom_index_is_computed_under_lock(self):
+        cache = BottomIndexCache()
+
+        with patch("data.bottom_index.single_flight.lock",
+                   wraps=single_flight.lock) as patch_lock:
+            cache.get("dataset.nc", "votemper", self.var, self.lat, self.lon)
+            cache.get("dataset.nc", "votemper", self.var, self.lat, self.lon)
+
+        patch_lock.assert_called_once()
@@ -7,6 +7,7 @@ import numpy as np
 import xarray as xr
 
 import data.calculated_parser.parser
+from data.calculated_parser.chunked import chunk_slices, evaluate_chunked
 
 
 class TestCalculatedParser(unittest.TestCase):
@@ -88,3 +89,69 @@ class TestCalculatedParser(unittest.TestCase):
                     case[0], ds, (0, slice(0, 5), slice(0, 5)), ['time_counter', 'y', 'x'])
 
                 self.assertEqual(result.shape, case[1])
+
+    def test_compiled_expression_is_reused(self):
+        expression = "votemper_compile_test * 2 + 1"
+
+        compiled = data.calculated_parser.parser.compile_expression(expression)
+
+        with patch('data.calculated_parser.parser.Parser') as patch_parser:
+            again = data.calculated_parser.parser.compile_expression(expression)
+            patch_parser.assert_not_called()
+
+        self.assertIs(compiled, again)
+        self.assertEqual(compiled.variables, {"votemper_compile_test"})
+
+    def test_compiled_expression_evaluates_each_key(self):
+        dataset = xr.Dataset({'var': ('x', [1., 2., 3.])})
+        compiled = data.calculated_parser.parser.compile_expression("-var * 2 + var ^ 2 + sin(0)")
+
+        self.assertEqual(compiled.evaluate(dataset, 0, ['x']), -1)
+        self.assertEqual(compiled.evaluate(dataset, 2, ['x']), 3)
+
+    def test_common_subexpressions_are_evaluated_once(self):
+        dataset = xr.Dataset({'var': ('x', [3., 4.])})
+        compiled = data.calculated_parser.parser.compile_expression(
+            "magnitude(var, var) + magnitude(var, var) * 2")
+
+        with patch('data.calculated_parser.functions.magnitude',
+                   side_effect=np.hypot) as patch_magnitude:
+            result = compiled.evaluate(dataset, slice(0, 2), ['x'])
+
+        patch_magnitude.assert_called_once()
+        np.testing.assert_allclose(result, np.hypot([3., 4.], [3., 4.]) * 3)
+
+    def test_chunked_evaluation_matches_whole(self):
+        key = (0, slice(0, 20), slice(3, 60))
+        dims = ['time_counter', 'y', 'x']
+        shape = (2, 76, 101)
+
+        with xr.open_dataset('tests/testdata/nemo_test.nc') as ds:
+            # Chunks of 10 columns (the full-depth variables have 50 levels)
+            for expression, chunk_size in [
+                    ("nav_lat * 2 - nav_lon", 20 * 10),
+                    ("soniclayerdepth([deptht], nav_lat, [votemper] - 273.15, [votemper] * 0 + 35)",
+                     50 * 20 * 10)]:
+                compiled = data.calculated_parser.parser.compile_expression(expression)
+                whole = compiled.evaluate(ds, key, dims)
+
+                with patch.object(compiled, 'evaluate', wraps=compiled.evaluate) as patch_evaluate:
+                    chunked = evaluate_chunked(compiled, ds, key, dims, shape,
+                                               chunk_size=chunk_size, max_workers=2)
+
+                self.assertEqual(patch_evaluate.call_count, 6, msg=expression)
+                np.testing.assert_array_equal(np.asarray(chunked), np.asarray(whole))
+
+    def test_reductions_are_not_chunked(self):
+        dataset = xr.Dataset({'var': ('x', np.arange(10.))})
+        compiled = data.calculated_parser.parser.compile_expression("max(var) - var")
+
+        result = evaluate_chunked(compiled, dataset, slice(0, 10), ['x'], (10,), chunk_size=2)
+
+        np.testing.assert_array_equal(result, 9 - np.arange(10.))
+
+    def test_chunk_slices(self):
+        self.assertEqual(chunk_slices(slice(0, 7), 10, 3), [slice(0, 3, 1), slice(3, 7, 1)])
+        self.assertEqual(chunk_slices(slice(None), 4, 1), [slice(0, 2, 1), slice(2, 4, 1)])
+        self.assertEqual(chunk_slices(slice(0, 10, 2), 10, 2),
+                         [slice(0, 4, 2), slice(4, 10, 2)])
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import data.catalog
+from data.catalog import DatasetCatalog, catalog_path, clear_catalogs, get_catalog
+from data.netcdf_data import NetCDFData
+
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = os.path.join(self.tmpdir, "test-nemo.sqlite3")
+        shutil.copy("tests/testdata/databases/test-nemo.sqlite3", self.db)
+
+        clear_catalogs()
+
+    def tearDown(self):
+        clear_catalogs()
+        shutil.rmtree(self.tmpdir)
+
+    def test_netcdf_catalog(self):
+        catalog = NetCDFData("tests/testdata/nemo_test.nc").catalog
+
+        self.assertEqual(sorted(catalog.dimensions), ["deptht", "time_counter", "x", "y"])
+        self.assertIn("votemper", catalog.variables)
+        self.assertEqual(catalog.latlon, ["nav_lat", "nav_lon"])
+        self.assertEqual(catalog.timestamps("votemper"), [2031436800, 2034072000])
+        self.assertAlmostEqual(catalog.depths["deptht"][0], 0.494025, places=5)
+        self.assertIsNone(catalog_path("tests/testdata/nemo_test.nc"))
+
+    def test_sqlite_catalog_is_saved_next_to_index(self):
+        catalog = NetCDFData(self.db).catalog
+
+        self.assertEqual(catalog.timestamps("votemper"), [2031436800, 2034072000])
+        self.assertEqual(catalog.timestamps("fake_variable"), [])
+        self.assertTrue(os.path.isfile(self.db + ".catalog.json"))
+
+        clear_catalogs()
+        with patch.object(NetCDFData, "build_catalog") as patch_build_catalog:
+            loaded = NetCDFData(self.db).catalog
+
+            patch_build_catalog.assert_not_called()
+        self.assertEqual(loaded.to_dict(), catalog.to_dict())
+
+    def test_catalog_is_rebuilt_when_index_changes(self):
+        builder = patch.object(NetCDFData, "build_catalog",
+                               side_effect=lambda: DatasetCatalog(["x"], [])).start()
+        self.addCleanup(patch.stopall)
+
+        get_catalog(self.db, builder)
+        get_catalog(self.db, builder)
+        st = os.stat(self.db)
+        os.utime(self.db, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        get_catalog(self.db, builder)
+
+        self.assertEqual(builder.call_count, 2)
+
+    def test_remote_catalog_expires(self):
+        builder = patch.object(NetCDFData, "build_catalog",
+                               side_effect=lambda: DatasetCatalog(["x"], [])).start()
+        self.addCleanup(patch.stopall)
+        url = "http://opendap.example.com/dataset.nc"
+
+        get_catalog(url, builder)
+        get_catalog(url, builder)
+        builder.assert_called_once()
+
+        later = time.time() + data.catalog.DEFAULT_REMOTE_TTL + 1
+        with patch("data.catalog.time.time", return_value=later):
+            get_catalog(url, builder)
+
+        self.assertEqual(builder.call_count, 2)
+
+    def test_dimensions_do_not_build_catalog(self):
+        with patch.object(NetCDFData, "build_catalog") as patch_build_catalog:
+            dimensions = NetCDFData(self.db).dimensions
+
+            patch_build_catalog.assert_not_called()
+        self.assertIn("time_counter", dimensions)
+
+        catalog = NetCDFData(self.db).catalog
+        with patch("data.netcdf_data.SQLiteDatabase") as patch_database:
+            self.assertEqual(NetCDFData(self.db).dimensions, catalog.dimensions)
+
+            patch_database.assert_not_called()
+
+    def test_dimensions_of_missing_dataset(self):
+        self.assertEqual(NetCDFData(os.path.join(self.tmpdir, "missing.nc")).dimensions, [])
+
+    def test_time_axes_are_shared(self):
+        axes, variable_axis = data.catalog.time_axes({"a": [1, 2], "b": [1, 2], "c": [3]})
+
+        self.assertEqual(axes, [[1, 2], [3]])
+        self.assertEqual(variable_axis, {"a": 0, "b": 0, "c": 1})
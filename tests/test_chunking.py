@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import netCDF4
+import numpy as np
+
+from data.chunking import (AREA, PATH, POINT_SERIES, PROFILE, SUBSET, DiskLayout,
+                           dataset_chunks, plan_chunks, read_disk_layout)
+
+
+class TestChunking(unittest.TestCase):
+
+    def setUp(self):
+        self.chunked = DiskLayout(('time', 'depth', 'lat', 'lon'), (24, 50, 1000, 1500),
+                                  (1, 1, 100, 150), 4, False)
+        self.contiguous = DiskLayout(('time', 'depth', 'lat', 'lon'), (24, 50, 1000, 1500),
+                                     (24, 50, 1000, 1500), 4, True)
+
+    def test_point_series(self):
+        self.assertEqual(plan_chunks(self.chunked, POINT_SERIES),
+                         {'time': 24, 'depth': 1, 'lat': 100, 'lon': 150})
+        self.assertEqual(plan_chunks(self.contiguous, POINT_SERIES),
+                         {'time': 24, 'depth': 1, 'lat': 32, 'lon': 32})
+
+    def test_path(self):
+        chunks = plan_chunks(self.chunked, PATH, target_bytes=4 * 24 * 200 * 300)
+
+        self.assertEqual(chunks, {'time': 24, 'depth': 1, 'lat': 200, 'lon': 300})
+        # Not the 32x32 chunks of point series
+        self.assertEqual(plan_chunks(self.contiguous, PATH, target_bytes=4 * 24 * 512 * 256),
+                         {'time': 24, 'depth': 1, 'lat': 512, 'lon': 256})
+
+    def test_profile(self):
+        self.assertEqual(plan_chunks(self.chunked, PROFILE),
+                         {'time': 1, 'depth': 50, 'lat': 100, 'lon': 150})
+
+    def test_area_chunks_are_multiples_of_the_disk_chunks(self):
+        chunks = plan_chunks(self.chunked, AREA, target_bytes=4 * 400 * 600)
+
+        self.assertEqual(chunks, {'time': 1, 'depth': 1, 'lat': 400, 'lon': 600})
+
+    def test_subset(self):
+        chunks = plan_chunks(self.contiguous, SUBSET, target_bytes=4 * 50 * 256 * 256)
+
+        self.assertEqual(chunks, {'time': 1, 'depth': 50, 'lat': 256, 'lon': 256})
+
+    def test_read_disk_layout(self):
+        layout = read_disk_layout("tests/testdata/nemo_test.nc")
+
+        self.assertEqual(layout.dims, ('time_counter', 'deptht', 'y', 'x'))
+        self.assertEqual(layout.chunks, (1, 50, 76, 101))
+        self.assertFalse(layout.contiguous)
+
+    def test_chunk_sizes_attribute(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, "remote.nc")
+            with netCDF4.Dataset(path, 'w', format='NETCDF3_CLASSIC') as ds:
+                ds.createDimension('time', 4)
+                ds.createDimension('lat', 20)
+                ds.createDimension('lon', 30)
+                v = ds.createVariable('temp', 'f4', ('time', 'lat', 'lon'))
+                v.setncattr('_ChunkSizes', np.array([1, 10, 15], dtype=np.int32))
+
+            self.assertEqual(dataset_chunks([path], POINT_SERIES),
+                             {'time': 4, 'lat': 10, 'lon': 15})
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import sys
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+import dask
+
+from utils import compute_budget
+from tests.app_settings import patch_settings
+
+
+class TestComputeBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = {'COMPUTE_CORES': 8}
+        p = patch_settings('utils.compute_budget', self.settings)
+        p.start()
+        self.addCleanup(p.stop)
+
+    def test_budget_is_shared_among_workers(self):
+        self.assertEqual(compute_budget.thread_budget(), 8)
+
+        self.settings['COMPUTE_WORKERS'] = 3
+        self.assertEqual(compute_budget.thread_budget(), 2)
+
+        self.settings['COMPUTE_WORKERS'] = 16
+        self.assertEqual(compute_budget.thread_budget(), 1)
+
+    def test_max_threads(self):
+        self.settings['COMPUTE_MAX_THREADS'] = 4
+
+        self.assertEqual(compute_budget.thread_budget(), 4)
+
+    def test_busy_uwsgi_workers(self):
+        uwsgi = MagicMock()
+        uwsgi.workers.return_value = [{'status': 'busy'}] * 4 + [{'status': 'idle'}] * 4
+
+        with patch.dict(sys.modules, {'uwsgi': uwsgi}):
+            self.assertEqual(compute_budget.active_workers(), 4)
+            self.assertEqual(compute_budget.thread_budget(), 2)
+
+    def test_compute_budget_is_thread_local(self):
+        before = compute_budget.metrics()['budgets']
+        budgets = []
+
+        with compute_budget.compute_budget(3) as threads:
+            self.assertEqual(threads, 3)
+            self.assertEqual(compute_budget.thread_budget(), 3)
+            self.assertEqual(compute_budget.metrics()['threads_in_use'], 3)
+            # Nothing process-wide is changed for the request
+            self.assertIsNone(dask.config.get('num_workers', None))
+
+            thread = threading.Thread(target=lambda: budgets.append(compute_budget.thread_budget()))
+            thread.start()
+            thread.join()
+
+        self.assertEqual(budgets, [8])
+        self.assertEqual(compute_budget.thread_budget(), 8)
+        metrics = compute_budget.metrics()
+        self.assertEqual(metrics['budgets'], before + 1)
+        self.assertEqual(metrics['active'], 0)
+
+    def test_compute_limits_applies_to_dask(self):
+        with compute_budget.compute_budget(3), compute_budget.compute_limits():
+            self.assertEqual(dask.config.get('num_workers'), 3)
+
+        self.assertIsNone(dask.config.get('num_workers', None))
+
+    def test_overlapping_compute_limits(self):
+        first = compute_budget.compute_limits()
+        second = compute_budget.compute_limits()
+
+        with compute_budget.compute_budget(3):
+            first.__enter__()
+        with compute_budget.compute_budget(2):
+            second.__enter__()
+        # The limits of the first compute are shared until the last one ends
+        self.assertEqual(dask.config.get('num_workers'), 3)
+
+        first.__exit__(None, None, None)
+        self.assertEqual(dask.config.get('num_workers'), 3)
+        second.__exit__(None, None, None)
+        self.assertIsNone(dask.config.get('num_workers', None))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from data.dataset_pool import DatasetPool
+
+
+class TestDatasetPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "file.nc")
+        with open(self.path, "w") as f:
+            f.write("x")
+
+        self.pool = DatasetPool(maxsize=2, idle_timeout=600)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_dataset_is_reused(self):
+        opener = MagicMock()
+
+        entry = self.pool.acquire("giops", opener, [self.path])
+        self.pool.release(entry)
+        entry = self.pool.acquire("giops", opener, [self.path])
+        self.pool.release(entry)
+
+        opener.assert_called_once()
+        opener.return_value.close.assert_not_called()
+        self.assertEqual(self.pool.info()['hits'], 1)
+
+    def test_least_recently_used_is_closed(self):
+        datasets = {k: MagicMock() for k in "abc"}
+
+        for k in "abc":
+            self.pool.release(self.pool.acquire(k, lambda k=k: datasets[k]))
+
+        datasets["a"].close.assert_called_once()
+        datasets["b"].close.assert_not_called()
+        self.assertEqual(self.pool.info()['size'], 2)
+
+    def test_dataset_in_use_is_not_closed(self):
+        datasets = {k: MagicMock() for k in "abc"}
+
+        in_use = self.pool.acquire("a", lambda: datasets["a"])
+        for k in "bc":
+            self.pool.release(self.pool.acquire(k, lambda k=k: datasets[k]))
+
+        datasets["a"].close.assert_not_called()
+        datasets["b"].close.assert_called_once()
+
+        self.pool.clear()
+        datasets["a"].close.assert_not_called()
+        self.pool.release(in_use)
+        datasets["a"].close.assert_called_once()
+
+    def test_idle_dataset_is_closed(self):
+        pool = DatasetPool(maxsize=2, idle_timeout=0)
+        first = MagicMock()
+
+        pool.release(pool.acquire("giops", lambda: first))
+        pool.release(pool.acquire("riops", MagicMock()))
+
+        first.close.assert_called_once()
+
+    def test_modified_file_is_reopened(self):
+        opener = MagicMock()
+
+        self.pool.release(self.pool.acquire("giops", opener, [self.path]))
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.pool.release(self.pool.acquire("giops", opener, [self.path]))
+
+        self.assertEqual(opener.call_count, 2)
+        opener.return_value.close.assert_called_once()
+
+    def test_unwatched_dataset_is_reopened_after_max_age(self):
+        pool = DatasetPool(maxsize=2, idle_timeout=600, max_age=0)
+        opener = MagicMock()
+        url = "https://example.com/thredds/dodsC/giops"
+
+        pool.release(pool.acquire("giops", opener, [url]))
+        pool.release(pool.acquire("giops", opener, [url]))
+        self.assertEqual(opener.call_count, 2)
+
+        # Files with a modification time are only reopened when modified
+        pool.release(pool.acquire("riops", opener, [self.path]))
+        pool.release(pool.acquire("riops", opener, [self.path]))
+        self.assertEqual(opener.call_count, 3)
+
+    def test_pool_is_not_shared_with_forked_process(self):
+        opener = MagicMock()
+        self.pool.release(self.pool.acquire("giops", opener))
+
+        with patch("data.dataset_pool.os.getpid", return_value=os.getpid() + 1):
+            self.pool.release(self.pool.acquire("giops", opener))
+
+        self.assertEqual(opener.call_count, 2)
+
+    def test_zero_size_disables_pooling(self):
+        pool = DatasetPool(maxsize=0)
+        opener = MagicMock()
+
+        pool.release(pool.acquire("giops", opener))
+
+        opener.return_value.close.assert_called_once()
+        self.assertEqual(pool.info()['size'], 0)
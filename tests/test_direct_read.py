@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import xarray as xr
+
+import data.direct_read as direct_read
+from data.direct_read import (DASK, DIRECT, DirectReader, DirectReadVariable,
+                              footprint, summarize_reads)
+
+
+class TestDirectRead(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.nemo = "tests/testdata/nemo_test.nc"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_footprint(self):
+        shape = (2, 50, 76, 101)
+
+        self.assertEqual(footprint((0, 0, slice(10, 20), slice(None)), shape, 4), 10 * 101 * 4)
+        self.assertEqual(footprint((slice(0, 2), [1, 5, 9]), shape, 4), 2 * 3 * 76 * 101 * 4)
+        self.assertIsNone(footprint((0, 0, np.ones((2, 2), dtype=int)), shape, 4))
+        self.assertIsNone(footprint((0, 0, 0, 0, 0), shape, 4))
+
+    def test_reads_match_xarray(self):
+        with xr.open_dataset(self.nemo) as ds:
+            reader = DirectReader([self.nemo])
+            for name, key in [
+                    ('votemper', (0, 0, slice(45, 55), slice(48, 58))),
+                    ('votemper', (slice(0, 2), [0, 4], 50, slice(None, None, 10))),
+                    ('nav_lon', (slice(10, 20), slice(0, 5))),
+                    ('deptht', slice(None))]:
+                expected = ds.variables[name][key]
+                variable = DirectReadVariable(ds.variables[name], name, reader, 2 ** 20)
+
+                result = variable[key]
+
+                self.assertEqual(result.dims, expected.dims)
+                np.testing.assert_array_equal(result.values, expected.values)
+
+    def test_files_are_concatenated_in_time_order(self):
+        with xr.open_dataset(self.nemo) as ds:
+            paths = []
+            for i in (1, 0):
+                path = os.path.join(self.tmpdir, "nemo_%d.nc" % i)
+                ds[['votemper']].isel(time_counter=[i]).to_netcdf(path)
+                paths.append(path)
+
+            expected = ds.votemper[:, 3, 20:25, 30:35].values
+
+        result = DirectReader(paths).read('votemper', (slice(None), 3, slice(20, 25), slice(30, 35)))
+
+        np.testing.assert_array_equal(result, expected)
+
+    def test_large_reads_use_dask(self):
+        with xr.open_dataset(self.nemo) as ds:
+            variable = DirectReadVariable(ds.variables['votemper'], 'votemper',
+                                          DirectReader([self.nemo]), 1024)
+            before = direct_read.info()
+
+            variable[0, 0, 0:2, 0:2]
+            variable[0, 0, :, :]
+
+            after = direct_read.info()
+
+        self.assertEqual(after[DIRECT] - before[DIRECT], 1)
+        self.assertEqual(after[DASK] - before[DASK], 1)
+
+    def test_summarize_reads(self):
+        reads = [(DIRECT, 'votemper', 400), (DIRECT, 'nav_lat', 100), (DASK, 'votemper', None)]
+
+        self.assertEqual(summarize_reads(reads), "direct=2;dask=1;direct_bytes=500")
+
+    def test_evicted_handle_stays_open_while_read(self):
+        path = os.path.join(self.tmpdir, "nemo.nc")
+        shutil.copyfile(self.nemo, path)
+
+        with direct_read._handle(path) as handle:
+            # Other threads opening more files evict this one
+            while direct_read._handles:
+                direct_read._handles.popitem()
+
+            self.assertTrue(handle.isopen())
+
+        self.assertFalse(handle.isopen())
+
+    def test_rewritten_files_are_reopened(self):
+        path = os.path.join(self.tmpdir, "nemo.nc")
+        with xr.open_dataset(self.nemo) as ds:
+            ds[['votemper']].isel(time_counter=[0]).to_netcdf(path)
+            expected = ds.votemper[1, 0, 10, 10:15].values
+
+        DirectReader([path]).read('votemper', (0, 0, 10, slice(10, 15)))
+        with xr.open_dataset(self.nemo) as ds:
+            ds[['votemper']].isel(time_counter=[1]).to_netcdf(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        os.utime(path, ns=(0, 10 ** 18))
+
+        result = DirectReader([path]).read('votemper', (0, 0, 10, slice(10, 15)))
+
+        np.testing.assert_array_equal(result, expected)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import datetime
+import unittest
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytz
+
+from data.fvcom import decode_times
+from data.fvcom_mesh import MeshCache, TriangularMesh
+
+
+class TestFvcomMesh(unittest.TestCase):
+
+    def setUp(self):
+        # Unit square split into two triangles
+        self.mesh = TriangularMesh(
+            lat=[0, 0, 1, 1],
+            lon=[0, 1, 0, 1],
+            nv=[[1, 2], [2, 4], [3, 3]]
+        )
+        # Linear in lat and lon, so interpolation is exact
+        self.values = np.array([0., 1., 2., 3.])
+
+    def test_node_interpolation(self):
+        weights = self.mesh.weights([0.25, 0.5, 0.9], [0.5, 0.25, 0.9])
+
+        np.testing.assert_allclose(weights.apply(self.values), [1., 1.25, 2.7])
+        np.testing.assert_allclose(weights.weights.sum(axis=1), 1.)
+
+    def test_element_interpolation(self):
+        weights = self.mesh.weights([0.25, 0.9], [0.25, 0.9], element=True)
+
+        np.testing.assert_array_equal(weights.apply([[10., 20.], [30., 40.]]),
+                                      [[10., 20.], [30., 40.]])
+
+    def test_points_near_the_mesh_are_weighted_by_distance(self):
+        # About 5 km north of the top edge: only the node at (1, 0) is
+        # within the radius
+        weights = self.mesh.weights([1.05], [0.25])
+
+        result = weights.apply(self.values)
+
+        self.assertTrue(weights.valid[0])
+        np.testing.assert_allclose(weights.weights, [[1., 0., 0.]])
+        np.testing.assert_allclose(result, [2.])
+        np.testing.assert_array_equal(
+            self.mesh.weights([1.05], [0.25], element=True).indices, [[1]])
+
+    def test_points_outside_the_mesh_are_masked(self):
+        weights = self.mesh.weights([0.5, 5.], [0.5, 5.])
+
+        result = weights.apply(self.values)
+
+        self.assertFalse(result.mask[0])
+        self.assertTrue(result.mask[1])
+
+    def test_masked_values_propagate(self):
+        weights = self.mesh.weights([0.1], [0.1])
+
+        result = weights.apply(np.ma.masked_values([0., 1., 2., 3.], 1.))
+
+        self.assertTrue(result.mask[0])
+
+    def test_span(self):
+        weights = self.mesh.weights([0.9], [0.9])
+
+        self.assertEqual(weights.span, slice(1, 4))
+        np.testing.assert_allclose(weights.apply(self.values[1:4], offset=1), [2.7])
+
+    def test_weights_are_cached(self):
+        cache = MeshCache()
+
+        with patch.object(self.mesh, 'weights', wraps=self.mesh.weights) as patch_weights:
+            cache.weights("mesh", self.mesh, [0.5], [0.5])
+            cache.weights("mesh", self.mesh, np.array([0.5]), np.array([0.5]))
+            cache.weights("mesh", self.mesh, [0.5], [0.5], element=True)
+
+        self.assertEqual(patch_weights.call_count, 2)
+        self.assertEqual(cache.info()['hits'], 1)
+
+    def test_mesh_tables_are_loaded_once(self):
+        loader = MagicMock(return_value=[[-0.5] * 4])
+
+        self.mesh.table('siglay', loader)
+        table = self.mesh.table('siglay', loader)
+
+        loader.assert_called_once()
+        self.assertFalse(table.flags.writeable)
+        np.testing.assert_allclose(self.mesh.to_elements(table), [[-0.5, -0.5]])
+
+    def test_decode_times(self):
+        timestamps = decode_times(["2015-07-06T00:00:00.000000", "2015-07-06T01:30:00.000000"],
+                                  pytz.UTC)
+
+        self.assertEqual(timestamps[0], datetime.datetime(2015, 7, 6, 0, 0, 0, 0, pytz.UTC))
+        self.assertEqual(timestamps[1], datetime.datetime(2015, 7, 6, 1, 30, 0, 0, pytz.UTC))
+        self.assertFalse(timestamps.flags.writeable)
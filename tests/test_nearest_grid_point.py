@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+import unittest
+
+import numpy as np
+import xarray as xr
+
+from data.nearest_grid_point import GridIndexCache, find_nearest_grid_point, grid_index_cache
+
+
+class TestNearestGridPoint(unittest.TestCase):
+
+    def setUp(self):
+        lat, lon = np.meshgrid(np.linspace(40, 50, 21), np.linspace(-70, -50, 41), indexing='ij')
+        self.latvar = xr.DataArray(lat.astype(np.float32), dims=('y', 'x'), name='nav_lat')
+        self.lonvar = xr.DataArray(lon.astype(np.float32), dims=('y', 'x'), name='nav_lon')
+
+        grid_index_cache.clear()
+
+    def test_find_nearest_grid_point(self):
+        iy, ix, _ = find_nearest_grid_point(45.0, -60.0, self.latvar, self.lonvar)
+
+        self.assertEqual(iy, 10)
+        self.assertEqual(ix, 20)
+
+    def test_find_nearest_grid_point_1d_axes(self):
+        latvar = xr.DataArray(np.linspace(40, 50, 21), dims=('latitude',), name='latitude')
+        lonvar = xr.DataArray(np.linspace(-70, -50, 41), dims=('longitude',), name='longitude')
+
+        iy, ix, _ = find_nearest_grid_point(45.0, -60.0, latvar, lonvar)
+
+        self.assertEqual(iy, 10)
+        self.assertEqual(ix, 20)
+
+    def test_grid_index_is_reused(self):
+        find_nearest_grid_point(45.0, -60.0, self.latvar, self.lonvar, dataset_key='giops')
+        find_nearest_grid_point(41.0, -55.0, self.latvar, self.lonvar, dataset_key='giops')
+
+        info = grid_index_cache.info()
+        self.assertEqual(info['misses'], 1)
+        self.assertEqual(info['hits'], 1)
+        self.assertEqual(info['size'], 1)
+
+    def test_grid_index_is_keyed_by_dataset(self):
+        find_nearest_grid_point(45.0, -60.0, self.latvar, self.lonvar, dataset_key='giops')
+        find_nearest_grid_point(45.0, -60.0, self.latvar, self.lonvar, dataset_key='riops')
+
+        self.assertEqual(grid_index_cache.info()['misses'], 2)
+
+    def test_grid_index_cache_evicts_least_recently_used(self):
+        cache = GridIndexCache(maxsize=1)
+
+        cache.get(self.latvar, self.lonvar, 'giops')
+        cache.get(self.latvar, self.lonvar, 'riops')
+        cache.get(self.latvar, self.lonvar, 'giops')
+
+        info = cache.info()
+        self.assertEqual(info['misses'], 3)
+        self.assertEqual(info['hits'], 0)
+        self.assertEqual(info['size'], 1)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+import unittest
+from unittest.mock import patch
+
+import matplotlib.colors
+import numpy as np
+from PIL import Image
+
+import plotting.png as png
+from tests.app_settings import patch_settings
+
+
+class TestPng(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = {}
+        p = patch_settings('plotting.png', self.settings)
+        p.start()
+        self.addCleanup(p.stop)
+
+        cmap = matplotlib.colors.ListedColormap(['red', 'green', 'blue', 'white'])
+        data = np.ma.masked_greater(np.arange(256 * 256).reshape(256, 256) % 5, 3)
+        self.cmap = cmap
+        self.rgba = (cmap(matplotlib.colors.Normalize(0, 3)(data)) * 255).astype(np.uint8)
+
+    def test_is_categorical(self):
+        self.assertTrue(png.is_categorical(self.cmap))
+        self.assertFalse(png.is_categorical(matplotlib.colormaps['viridis']))
+
+    def test_palette(self):
+        buf = png.encode_png(self.rgba, palette=True)
+
+        im = Image.open(buf)
+        self.assertEqual(im.mode, 'P')
+        np.testing.assert_array_equal(np.asarray(im.convert('RGBA')), self.rgba)
+
+        self.settings['PNG_PALETTE'] = False
+        self.assertEqual(Image.open(png.encode_png(self.rgba, palette=True)).mode, 'RGBA')
+
+    def test_too_many_colours_for_palette(self):
+        rgba = np.random.randint(0, 255, (256, 256, 4), dtype=np.uint8)
+
+        im = Image.open(png.encode_png(rgba, palette=True))
+        self.assertEqual(im.mode, 'RGBA')
+        np.testing.assert_array_equal(np.asarray(im), rgba)
+
+    def test_compress_level(self):
+        self.settings['PNG_OPTIMIZE'] = False
+        self.settings['PNG_COMPRESS_LEVEL'] = 1
+
+        with patch.object(Image.Image, 'save', autospec=True) as save:
+            png.encode_png(self.rgba)
+
+        self.assertEqual(save.call_args[1], {'format': 'PNG', 'compress_level': 1})
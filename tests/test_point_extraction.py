@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+import unittest
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from data.nemo import Nemo
+from data.netcdf_data import NetCDFData
+from data.point_extraction import extract_timeseries, time_ranges
+
+
+class TestPointExtraction(unittest.TestCase):
+
+    def setUp(self):
+        self.starttime = 2031436800
+        self.endtime = 2034072000
+        self.points = [(13.0, -149.0), ("12.5", "-148.2")]
+
+    def test_matches_get_timeseries_point(self):
+        with Nemo(NetCDFData('tests/testdata/nemo_test.nc')) as n:
+            result = extract_timeseries(n, self.points, ['votemper', 'votemper'], [0, 5],
+                                        self.starttime, self.endtime, max_workers=2)
+
+            self.assertEqual(result.shape, (2, 2, 2, 2))
+            for p, (lat, lon) in enumerate(self.points):
+                for k, depth in enumerate([0, 5]):
+                    expected = n.get_timeseries_point(float(lat), float(lon), depth,
+                                                      self.starttime, self.endtime,
+                                                      'votemper')
+                    np.testing.assert_allclose(result[p, 0, k], expected)
+                    np.testing.assert_allclose(result[p, 1, k], expected)
+
+    def test_time_ranges(self):
+        var = MagicMock(chunks=((3, 3, 2), (50,)))
+
+        self.assertEqual(time_ranges(var, 1, 8), [(1, 3), (3, 6), (6, 8)])
+        self.assertEqual(time_ranges(var, 4, 5), [(4, 5)])
+        self.assertEqual(time_ranges(MagicMock(chunks=None), 0, 4), [(0, 4)])
+
+    def test_models_without_windows_read_each_point(self):
+        dataset = MagicMock()
+        dataset.nc_data.timestamp_to_time_index.side_effect = [0, 2]
+        dataset.supports_point_windows = False
+        dataset.get_timeseries_point.return_value = np.array([1., 2., 3.])
+
+        result = extract_timeseries(dataset, self.points, ['temp'], [0, 'bottom'],
+                                    self.starttime, self.endtime)
+
+        self.assertEqual(result.shape, (2, 1, 2, 3))
+        self.assertEqual(dataset.get_timeseries_point.call_count, 4)
+        dataset.get_timeseries_point.assert_any_call(12.5, -148.2, 'bottom', self.starttime,
+                                                     self.endtime, 'temp')
+        dataset.point_grid.assert_not_called()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import unittest
+
+import numpy as np
+import xarray as xr
+
+from data.regular_grid import RegularAxis, RegularGrid
+
+
+class TestRegularGrid(unittest.TestCase):
+
+    def setUp(self):
+        self.lat = np.arange(-80, 80.01, 0.5)
+        self.lon = np.arange(-180, 180, 0.5)
+        lat, lon = np.meshgrid(self.lat, self.lon, indexing='ij')
+        # Linear in lat and lon, so bilinear interpolation is exact
+        self.data = lat * 2 + lon * 0.1
+        self.grid = RegularGrid(self.lat, self.lon)
+
+    def test_axis_index(self):
+        axis = RegularAxis([0., 1., 2., 4., 8.])
+
+        np.testing.assert_allclose(axis.index([0.5, 3., 8.]), [0.5, 2.5, 4.])
+        self.assertTrue(np.isnan(axis.index(9.)))
+        self.assertFalse(axis.uniform)
+
+    def test_descending_axis(self):
+        axis = RegularAxis([10., 5., 0.])
+
+        np.testing.assert_allclose(axis.index([10., 2.5]), [0., 1.5])
+
+    def test_longitude_wraps(self):
+        self.assertEqual(self.grid.lon.period, 360.)
+        self.assertIsNone(self.grid.lat.period)
+
+        np.testing.assert_allclose(self.grid.lon.index([-180., 180., 540.25, 179.75]),
+                                   [0., 0., 0.5, 719.5])
+
+    def test_bilinear(self):
+        result = self.grid.interpolate(self.data, [10.1, -45.33], [20.05, -100.2], 'bilinear')
+
+        np.testing.assert_allclose(result, [10.1 * 2 + 2.005, -45.33 * 2 - 10.02])
+
+    def test_nearest(self):
+        result = self.grid.interpolate(self.data, [10.1], [20.3], 'nearest')
+
+        np.testing.assert_allclose(result, [10. * 2 + 2.05])
+
+    def test_points_outside_the_grid_are_masked(self):
+        result = self.grid.interpolate(self.data, [85., 0.], [0., 0.], 'bilinear')
+
+        self.assertTrue(result.mask[0])
+        self.assertFalse(result.mask[1])
+
+    def test_masked_points_are_left_out(self):
+        data = np.ma.masked_array(self.data, mask=self.data > 20.)
+
+        result = self.grid.interpolate(data, [10.1, 30.], [0., 0.], 'bilinear')
+
+        self.assertAlmostEqual(result[0], self.data[180, 360])
+        self.assertTrue(result.mask[1])
+
+    def test_subset_and_levels(self):
+        lat, lon = [10.1, 12.3], [20.05, 21.]
+        miny, maxy, minx, maxx = self.grid.bounding_box(lat, lon)
+        levels = np.stack([self.data, self.data + 1])[:, miny:maxy, minx:maxx]
+
+        result = self.grid.interpolate(levels, lat, lon, 'bilinear',
+                                       slice(miny, maxy), slice(minx, maxx))
+
+        self.assertEqual(result.shape, (2, 2))
+        np.testing.assert_allclose(result[1] - result[0], [1., 1.])
+        np.testing.assert_allclose(result[0], [10.1 * 2 + 2.005, 12.3 * 2 + 2.1])
+
+    def test_bounding_box_across_the_wrap(self):
+        self.assertEqual(self.grid.bounding_box([0.], [179.9])[2:], (0, 720))
+
+    def test_radial_weighting(self):
+        data = np.ma.masked_array(np.full(self.data.shape, 5.), mask=self.data > 21.5)
+
+        result = self.grid.interpolate(data, [5., 10.], [20., 30.], 'gaussian', radius=100000)
+
+        self.assertAlmostEqual(result[0], 5.)
+        self.assertTrue(result.mask[1])
+
+    def test_from_variables(self):
+        self.assertIsNotNone(RegularGrid.from_variables(xr.DataArray(self.lat),
+                                                        xr.DataArray(self.lon)))
+        self.assertIsNone(RegularGrid.from_variables(np.ones((2, 2)), np.ones((2, 2))))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+import unittest
+
+import numpy as np
+import pyresample
+
+from data.resampling import neighbour_info_cache, resample, resample_levels
+
+
+class TestResampling(unittest.TestCase):
+
+    def setUp(self):
+        lon, lat = np.meshgrid(np.linspace(-60, -50, 30), np.linspace(40, 45, 20))
+        self.input_def = pyresample.geometry.SwathDefinition(lons=lon, lats=lat)
+        self.data = np.ma.masked_invalid(np.sin(lat) + np.cos(lon))
+
+        out_lon, out_lat = np.meshgrid(np.linspace(-58, -52, 16), np.linspace(41, 44, 16))
+        self.output_def = pyresample.geometry.SwathDefinition(lons=out_lon, lats=out_lat)
+
+        neighbour_info_cache.clear()
+
+    def test_resample_gaussian_matches_pyresample(self):
+        expected = pyresample.kd_tree.resample_gauss(
+            self.input_def, self.data, self.output_def,
+            radius_of_influence=50000.0, sigmas=25000, fill_value=None)
+
+        result = resample(self.input_def, self.output_def, self.data, 'gaussian', 50000, 10)
+
+        np.testing.assert_array_almost_equal(result, expected)
+
+    def test_resample_nearest_matches_pyresample(self):
+        expected = pyresample.kd_tree.resample_nearest(
+            self.input_def, self.data, self.output_def, radius_of_influence=50000.0)
+
+        result = resample(self.input_def, self.output_def, self.data, 'nearest', 50000, 10)
+
+        np.testing.assert_array_equal(result, expected)
+
+    def test_resample_nearest_fill_value_none_masks(self):
+        expected = pyresample.kd_tree.resample_nearest(
+            self.input_def, self.data, self.output_def, radius_of_influence=5000.0,
+            fill_value=None)
+
+        result = resample(self.input_def, self.output_def, self.data, 'nearest', 5000, 1,
+                          fill_value=None)
+
+        self.assertTrue(np.ma.is_masked(result))
+        np.testing.assert_array_equal(np.ma.getmaskarray(result), np.ma.getmaskarray(expected))
+        np.testing.assert_array_equal(result, expected)
+
+    def test_neighbour_info_is_reused(self):
+        resample(self.input_def, self.output_def, self.data, 'inverse', 50000, 10)
+        resample(self.input_def, self.output_def, self.data * 2, 'inverse', 50000, 10)
+
+        info = neighbour_info_cache.info()
+        self.assertEqual(info['misses'], 1)
+        self.assertEqual(info['hits'], 1)
+        self.assertGreater(info['bytes'], 0)
+
+    def test_different_radius_is_not_reused(self):
+        resample(self.input_def, self.output_def, self.data, 'bilinear', 50000, 10)
+        resample(self.input_def, self.output_def, self.data, 'bilinear', 25000, 10)
+
+        self.assertEqual(neighbour_info_cache.info()['misses'], 2)
+
+    def test_unknown_interp_raises(self):
+        with self.assertRaises(ValueError):
+            resample(self.input_def, self.output_def, self.data, 'cubic', 50000, 10)
+
+    def test_resample_levels_matches_per_level_resample(self):
+        levels = np.ma.stack([self.data, self.data * 2, self.data + 1], axis=-1)
+
+        result = resample_levels(self.input_def.lons, self.input_def.lats, self.output_def,
+                                 levels, 'gaussian', 50000, 10)
+
+        self.assertEqual(result.shape, (3, 16, 16))
+        for i in range(3):
+            expected = resample(self.input_def, self.output_def, levels[:, :, i], 'gaussian', 50000, 10)
+            np.testing.assert_array_almost_equal(result[i], expected)
+
+    def test_resample_levels_does_one_search(self):
+        levels = np.ma.stack([self.data] * 5, axis=-1)
+
+        resample_levels(self.input_def.lons, self.input_def.lats, self.output_def,
+                        levels, 'inverse', 50000, 4)
+
+        self.assertEqual(neighbour_info_cache.info()['misses'], 1)
+
+    def test_resample_levels_ignores_masked_points_per_level(self):
+        deep = self.data.copy()
+        deep[:, :15] = np.ma.masked
+        levels = np.ma.stack([self.data, deep], axis=-1)
+
+        for interp in ['gaussian', 'nearest']:
+            result = resample_levels(self.input_def.lons, self.input_def.lats, self.output_def,
+                                     levels, interp, 50000, 10)
+
+            surface = resample(self.input_def, self.output_def, self.data, interp, 50000, 10)
+            np.testing.assert_array_almost_equal(result[0], surface)
+            # Far from the masked half, the deep level only sees its own points
+            np.testing.assert_array_almost_equal(result[1][:, -4:], surface[:, -4:])
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from utils import single_flight
+from tests.app_settings import patch_settings
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        self.settings = {'SINGLE_FLIGHT_DIR': directory}
+        p = patch_settings('utils.single_flight', self.settings)
+        p.start()
+        self.addCleanup(p.stop)
+
+        m = patch('utils.single_flight._metrics', single_flight._Metrics())
+        m.start()
+        self.addCleanup(m.stop)
+
+    def test_request_key(self):
+        self.assertEqual(single_flight.request_key({'a': 1, 'b': [2, 3]}, 'png'),
+                         single_flight.request_key({'b': [2, 3], 'a': 1}, 'png'))
+        self.assertNotEqual(single_flight.request_key({'a': 1}, 'png'),
+                            single_flight.request_key({'a': 1}, 'json'))
+
+    def test_identical_requests_render_once(self):
+        calls = []
+
+        def render():
+            calls.append(1)
+            time.sleep(0.2)
+            return b'png'
+
+        key = single_flight.request_key('scale', 'giops', 'votemper')
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(single_flight.memoize('scale', key, render, ttl=60)))
+            for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(results, [b'png'] * 4)
+        self.assertEqual(len(calls), 1)
+
+        self.assertEqual(single_flight.memoize('scale', key, render, ttl=60), b'png')
+        counts = single_flight.metrics()['kinds']['scale']
+        self.assertEqual(counts['requests'], 5)
+        self.assertEqual(counts['rendered'], 1)
+        self.assertEqual(counts['coalesced'] + counts['hits'], 4)
+        self.assertGreater(counts['coalescing_rate'], 0)
+
+    def test_ttl(self):
+        calls = []
+
+        def render():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(single_flight.memoize('plot', 'key', render, ttl=60), 1)
+        self.assertEqual(single_flight.memoize('plot', 'key', render, ttl=60), 1)
+        with patch('time.time', return_value=time.time() + 120):
+            self.assertEqual(single_flight.memoize('plot', 'key', render, ttl=60), 2)
+
+    def test_timeout(self):
+        with single_flight.lock('key'):
+            result = single_flight.coalesce('tile', 'key', lambda: None, lambda: b'png',
+                                            timeout=0.05)
+
+        self.assertEqual(result, b'png')
+        self.assertEqual(single_flight.metrics()['kinds']['tile']['timeouts'], 1)
+
+    def test_purge(self):
+        single_flight.memoize('plot', 'key', lambda: b'png', ttl=60)
+
+        self.assertEqual(single_flight.purge(60), 0)
+        self.assertEqual(single_flight.purge(-1), 1)
+        self.assertTrue(os.path.isdir(os.path.join(self.settings['SINGLE_FLIGHT_DIR'],
+                                                   '.locks')))
+
+    def test_memoize_purges_old_results(self):
+        self.settings['SINGLE_FLIGHT_MAX_AGE'] = -1
+        single_flight.memoize('plot', 'old', lambda: b'png', ttl=60)
+
+        last_purge = time.monotonic() - 2 * single_flight.PURGE_INTERVAL
+        with patch('utils.single_flight._last_purge', last_purge), \
+                patch('threading.Thread') as thread:
+            single_flight.memoize('plot', 'new', lambda: b'png', ttl=60)
+            thread.assert_called_once_with(target=single_flight.purge, args=(-1.0,), daemon=True)
+            thread.return_value.start.assert_called_once_with()
+
+            # At most once per PURGE_INTERVAL
+            single_flight.memoize('plot', 'newer', lambda: b'png', ttl=60)
+            thread.assert_called_once()
@@ -1,5 +1,8 @@
 #!/usr/bin/env python
 
+import os
+import shutil
+import tempfile
 from unittest import TestCase
 
 from data.sqlite_database import SQLiteDatabase
@@ -131,6 +134,49 @@ class TestSqliteDatabase(TestCase):
             self.assertFalse(dims)
             self.assertFalse(units)
 
+    def test_get_all_variables_has_variable_dims(self):
+
+        with SQLiteDatabase(self.historical_db) as db:
+
+            for variable in db.get_all_variables():
+                self.assertEqual(variable.dimensions, db.get_variable_dims(variable.key))
+
+    def test_get_timestamp_range_matches_timestamps(self):
+
+        with SQLiteDatabase(self.historical_db) as db:
+            timestamps = db.get_timestamps("vo")
+            rng = db.get_timestamp_range(timestamps[1], timestamps[3], ["vo"])
+
+            self.assertEqual(rng, timestamps[1:4])
+
+    def test_connection_is_reused(self):
+
+        with SQLiteDatabase(self.historical_db) as db:
+            conn = db.conn
+
+        with SQLiteDatabase(self.historical_db) as db:
+            self.assertIs(db.conn, conn)
+
+    def test_connection_is_replaced_when_index_changes(self):
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            db_path = os.path.join(tmpdir, "Historical.sqlite3")
+            shutil.copy(self.historical_db, db_path)
+
+            with SQLiteDatabase(db_path) as db:
+                conn = db.conn
+                db.get_timestamps("vo")
+
+            st = os.stat(db_path)
+            os.utime(db_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+            with SQLiteDatabase(db_path) as db:
+                self.assertIsNot(db.conn, conn)
+                self.assertEqual(db.get_timestamps("vo"), self.historical_timestamps)
+        finally:
+            shutil.rmtree(tmpdir)
+
 
 if __name__ == '__main__':
     unittest.main()
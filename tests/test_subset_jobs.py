@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest.mock import MagicMock, patch
+
+import data.subset_jobs as subset_jobs
+from tests.app_settings import patch_settings
+
+# The tests patch it
+executor = subset_jobs._executor
+
+
+class TestSubsetJobs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.job_dir = os.path.join(self.tmpdir, "jobs")
+        self.settings = {'SUBSET_JOB_DIR': self.job_dir}
+        self.query = {
+            'dataset_name': 'giops',
+            'variables': 'vosaline,votemper',
+            'min_range': '45,-60',
+            'max_range': '46,-59',
+            'time': '2031436800,2034072000',
+            'output_format': 'NETCDF4',
+            'should_zip': '1',
+        }
+
+        self.executor = MagicMock()
+        self.version = '[[1, 100]]'
+        patches = [
+            patch('data.subset_jobs.dataset_version', side_effect=lambda d: self.version),
+            patch_settings('data.subset_jobs', self.settings),
+            patch('data.subset_jobs._executor', return_value=self.executor),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_job(self, state, size=10):
+        def run_subset(query, progress=None):
+            with open(os.path.join(self.tmpdir, "out.nc"), 'wb') as f:
+                f.write(b"x" * size)
+            return self.tmpdir + "/", "out.nc"
+
+        with patch('data.subset_jobs.run_subset', side_effect=run_subset):
+            subset_jobs._run_job(self.job_dir, state['job_id'], state['query'])
+
+        return subset_jobs.job_status(state['job_id'])
+
+    def test_normalize_query(self):
+        other = dict(self.query, variables='votemper, vosaline,votemper',
+                     min_range='45.0,-60.0000001', should_zip='0')
+
+        self.assertEqual(subset_jobs.normalize_query(self.query),
+                         subset_jobs.normalize_query(other))
+        with self.assertRaises(ValueError):
+            subset_jobs.normalize_query({'dataset_name': 'giops'})
+
+    def test_submit_deduplicates(self):
+        first = subset_jobs.submit(self.query)
+        second = subset_jobs.submit(dict(self.query, variables='votemper,vosaline'))
+
+        self.assertEqual(first['job_id'], second['job_id'])
+        self.assertEqual(second['status'], subset_jobs.QUEUED)
+        self.executor.submit.assert_called_once()
+
+    def test_run_job(self):
+        state = subset_jobs.submit(self.query)
+
+        state = self.run_job(state)
+
+        self.assertEqual(state['status'], subset_jobs.DONE)
+        self.assertEqual(state['progress'], 1.0)
+        path = subset_jobs.result_path(state['job_id'])
+        self.assertEqual(os.path.basename(path), "out.nc")
+        self.assertEqual(subset_jobs.cached_result(self.query), path)
+
+        # Done jobs aren't run again
+        subset_jobs.submit(self.query)
+        self.executor.submit.assert_called_once()
+
+    def test_failed_job_is_resubmitted(self):
+        state = subset_jobs.submit(self.query)
+        with patch('data.subset_jobs.run_subset', side_effect=RuntimeError("no data")):
+            subset_jobs._run_job(self.job_dir, state['job_id'], state['query'])
+
+        failed = subset_jobs.job_status(state['job_id'])
+        self.assertEqual(failed['status'], subset_jobs.FAILED)
+        self.assertEqual(failed['error'], "no data")
+
+        self.assertEqual(subset_jobs.submit(self.query)['status'], subset_jobs.QUEUED)
+        self.assertEqual(self.executor.submit.call_count, 2)
+
+    def test_evict_least_recently_used(self):
+        self.settings['SUBSET_CACHE_BYTES'] = 25
+        old = self.run_job(subset_jobs.submit(self.query))
+        os.utime(os.path.join(self.job_dir, old['job_id'] + ".json"), (0, 0))
+
+        new = self.run_job(subset_jobs.submit(dict(self.query, time='2031436800,2031436800')))
+        self.run_job(subset_jobs.submit(dict(self.query, output_format='NETCDF3_64BIT')))
+
+        self.assertIsNone(subset_jobs.job_status(old['job_id']))
+        self.assertIsNotNone(subset_jobs.result_path(new['job_id']))
+
+    def test_new_dataset_version_is_a_new_job(self):
+        first = self.run_job(subset_jobs.submit(self.query))
+        self.assertEqual(subset_jobs.cached_result(self.query),
+                         subset_jobs.result_path(first['job_id']))
+
+        self.version = '[[2, 100]]'
+
+        self.assertIsNone(subset_jobs.cached_result(self.query))
+        self.assertNotEqual(subset_jobs.submit(self.query)['job_id'], first['job_id'])
+
+    def test_job_of_a_dead_process_is_resubmitted(self):
+        state = subset_jobs.submit(self.query)
+        dead = subprocess.Popen(['true'])
+        dead.wait()
+        subset_jobs._update_state(self.job_dir, state['job_id'],
+                                  owner=dict(state['owner'], pid=dead.pid))
+
+        self.assertEqual(subset_jobs.submit(self.query)['owner']['pid'], os.getpid())
+        self.assertEqual(self.executor.submit.call_count, 2)
+
+    def test_waiting_job_heartbeat(self):
+        state = subset_jobs.submit(self.query)
+        subset_jobs._write_state(self.job_dir, dict(state, updated=0))
+        self.assertFalse(subset_jobs._is_live(self.job_dir,
+                                              subset_jobs.job_status(state['job_id'])))
+        beats = []
+
+        with patch('data.subset_jobs.HEARTBEAT_INTERVAL', 0), \
+                patch('data.subset_jobs.SLOT_WAIT', 0), \
+                patch('fcntl.flock', side_effect=[OSError] * 2 + [None]):
+            subset_jobs._acquire_slot(self.job_dir, 1, lambda: beats.append(
+                subset_jobs._update_state(self.job_dir, state['job_id'])))
+
+        self.assertEqual(len(beats), 2)
+        self.assertTrue(subset_jobs._is_live(self.job_dir,
+                                             subset_jobs.job_status(state['job_id'])))
+
+    def test_job_of_a_dead_worker_fails(self):
+        future = Future()
+        self.executor.submit.return_value = future
+        state = subset_jobs.submit(self.query)
+
+        future.set_exception(BrokenProcessPool("A worker died"))
+
+        failed = subset_jobs.job_status(state['job_id'])
+        self.assertEqual(failed['status'], subset_jobs.FAILED)
+        self.assertEqual(failed['error'], "A worker died")
+        self.assertEqual(subset_jobs.submit(self.query)['status'], subset_jobs.QUEUED)
+
+    def test_finished_job_is_not_failed(self):
+        future = Future()
+        self.executor.submit.return_value = future
+        state = self.run_job(subset_jobs.submit(self.query))
+
+        future.set_result(None)
+
+        self.assertEqual(subset_jobs.job_status(state['job_id'])['status'], subset_jobs.DONE)
+
+    def test_submit_to_broken_pool(self):
+        self.executor.submit.side_effect = [BrokenProcessPool(), MagicMock()]
+
+        self.assertEqual(subset_jobs.submit(self.query)['status'], subset_jobs.QUEUED)
+        self.assertEqual(self.executor.submit.call_count, 2)
+
+    def test_broken_pool_is_replaced(self):
+        with patch('data.subset_jobs.ProcessPoolExecutor') as pool, \
+                patch('data.subset_jobs._pool', None):
+            pool.return_value = MagicMock(_broken=False)
+            first = executor()
+            self.assertIs(executor(), first)
+
+            first._broken = "A worker died"
+            pool.return_value = MagicMock(_broken=False)
+            self.assertIsNot(executor(), first)
+            first.shutdown.assert_called_once_with(wait=False)
+
+    def test_worker_python(self):
+        self.assertEqual(subset_jobs._python(), sys.executable)
+
+        with patch.dict(sys.modules, {'uwsgi': MagicMock()}):
+            self.assertEqual(subset_jobs._python(),
+                             os.path.join(sys.exec_prefix, "bin", "python3"))
+
+            self.settings['SUBSET_WORKER_PYTHON'] = "/opt/venv/bin/python"
+            self.assertEqual(subset_jobs._python(), "/opt/venv/bin/python")
+
+    def test_wait(self):
+        state = subset_jobs.submit(self.query)
+        self.assertIsNone(subset_jobs.wait('0' * 40))
+
+        def run(seconds):
+            self.run_job(state)
+
+        with patch('data.subset_jobs.time.sleep', side_effect=run) as sleep:
+            done = subset_jobs.wait(state['job_id'])
+
+        sleep.assert_called_once()
+        self.assertEqual(done['status'], subset_jobs.DONE)
+
+        # A stalled job isn't waited for
+        other = subset_jobs.submit(dict(self.query, output_format='NETCDF3_64BIT'))
+        subset_jobs._write_state(self.job_dir, dict(other, updated=0))
+        self.assertEqual(subset_jobs.wait(other['job_id'])['status'], subset_jobs.QUEUED)
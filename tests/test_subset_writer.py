@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import netCDF4
+import numpy as np
+import xarray as xr
+
+from data.subset_writer import ZIP_COMMENT, stream_zip, write_subset
+
+
+class TestSubsetWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dataset = xr.open_mfdataset(["tests/testdata/nemo_test.nc"], decode_times=False,
+                                         chunks=200)
+        self.subset = self.dataset.isel(y=slice(10, 30), x=slice(20, 50), deptht=slice(0, 5))
+
+    def tearDown(self):
+        self.dataset.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_write_subset(self):
+        path = os.path.join(self.tmpdir, "subset.nc")
+
+        write_subset(self.subset, path, 'NETCDF4', complevel=4)
+
+        with xr.open_dataset(path, decode_times=False) as ds:
+            xr.testing.assert_identical(ds.load(), self.subset.load())
+
+        with netCDF4.Dataset(path) as ds:
+            votemper = ds.variables['votemper']
+            self.assertEqual(votemper.chunking(), [1, 1, 20, 30])
+            self.assertTrue(votemper.filters()['zlib'])
+
+    def test_write_classic_subset(self):
+        path = os.path.join(self.tmpdir, "subset.nc")
+        subset = self.subset.assign(count=xr.DataArray(np.arange(5, dtype=np.int64),
+                                                        dims=['deptht']))
+
+        write_subset(subset, path, 'NETCDF3_64BIT')
+
+        with netCDF4.Dataset(path) as ds:
+            self.assertEqual(ds.data_model, 'NETCDF3_64BIT_OFFSET')
+            self.assertEqual(ds.variables['count'].dtype, np.int32)
+            np.testing.assert_allclose(ds.variables['votemper'][:],
+                                       self.subset.votemper.values, rtol=1e-6)
+
+    def test_write_packed_subset(self):
+        source = os.path.join(self.tmpdir, "packed.nc")
+        votemper = self.subset.votemper.load()
+        votemper[0, 0, 0, 0] = np.nan
+        votemper.to_dataset().to_netcdf(source, unlimited_dims=['time_counter'], encoding={
+            'votemper': {'dtype': 'int16', 'scale_factor': 0.01, 'add_offset': 10.0,
+                         '_FillValue': -32768},
+        })
+        path = os.path.join(self.tmpdir, "subset.nc")
+
+        with xr.open_dataset(source, decode_times=False) as subset:
+            write_subset(subset, path, 'NETCDF4')
+
+        with netCDF4.Dataset(path) as ds:
+            self.assertTrue(ds.dimensions['time_counter'].isunlimited())
+            variable = ds.variables['votemper']
+            self.assertEqual(variable.dtype, np.int16)
+            self.assertEqual(variable.scale_factor, 0.01)
+            self.assertEqual(variable.add_offset, 10.0)
+        with xr.open_dataset(path, decode_times=False) as ds:
+            np.testing.assert_allclose(ds.votemper.values, votemper.values, atol=0.005)
+
+    def test_stream_zip(self):
+        path = os.path.join(self.tmpdir, "subset.nc")
+        with open(path, 'wb') as f:
+            f.write(np.random.default_rng(0).bytes(256 * 1024))
+
+        blocks = list(stream_zip(path, block_size=16 * 1024))
+
+        self.assertGreater(len(blocks), 2)
+        with zipfile.ZipFile(io.BytesIO(b"".join(blocks))) as zf:
+            self.assertEqual(zf.comment, ZIP_COMMENT)
+            self.assertEqual(zf.namelist(), ["subset.nc"])
+            with open(path, 'rb') as f:
+                self.assertEqual(zf.read("subset.nc"), f.read())
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import unittest
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+from PIL import Image
+from shapely.geometry import Polygon
+
+import plotting.tile
+
+
+class TestTile(unittest.TestCase):
+
+    def setUp(self):
+        dataset = MagicMock()
+        dataset.__enter__.return_value = dataset
+        dataset.get_area.side_effect = \
+            lambda area, *args: np.ma.masked_invalid(np.sin(area[0]) * np.cos(area[1]))
+        dataset.depths = [0.5]
+        self.dataset = dataset
+
+        variable = MagicMock(unit='K', scale_factor=1.0)
+        variable.name = 'Temperature'
+        config = MagicMock()
+        config.variable.__getitem__.return_value = variable
+
+        patches = [
+            patch('plotting.tile.open_dataset', return_value=dataset),
+            patch('plotting.tile.DatasetConfig', return_value=config),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+        self.projection = 'EPSG:3857'
+        self.args = {
+            'interp': 'gaussian',
+            'radius': 25000,
+            'neighbours': 10,
+            'dataset': 'giops',
+            'variable': 'votemper',
+            'time': 2031436800,
+            'depth': 0,
+            'scale': '-1,1',
+        }
+
+    def test_metatile_bounds(self):
+        self.assertEqual(plotting.tile.metatile_bounds(9, 6, 10, 4), (8, 4, 4))
+        self.assertEqual(plotting.tile.metatile_bounds(1, 0, 1, 4), (0, 0, 2))
+
+    def test_metatile_matches_single_tiles(self):
+        tiles = plotting.tile.plot_metatile(self.projection, 161, 90, 8, self.args, 2)
+
+        self.assertEqual(sorted(tiles), [(160, 90), (160, 91), (161, 90), (161, 91)])
+        self.assertEqual(self.dataset.get_area.call_count, 1)
+
+        for (x, y), img in tiles.items():
+            expected = plotting.tile.plot(self.projection, x, y, 8, self.args)
+            np.testing.assert_array_equal(np.asarray(Image.open(img)),
+                                          np.asarray(Image.open(expected)))
+
+    def test_metatiles(self):
+        self.assertEqual(len(list(plotting.tile.metatiles('EPSG:3857', 4, 4))), 16)
+
+        # 78-92 x 86-96 at zoom 8
+        polygon = Polygon([(-70, 40), (-50, 40), (-50, 50), (-70, 50)])
+        tiles = list(plotting.tile.metatiles('EPSG:3857', 8, 4, polygon))
+
+        self.assertEqual(len(tiles), 20)
+        self.assertIn((76, 84), tiles)
+        self.assertIn((92, 96), tiles)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import plotting.tile_cache as tile_cache
+from tests.app_settings import patch_settings
+
+
+class TestTileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        self.layer = tile_cache.Layer('gaussian', 25, 10, 'EPSG:3857', 'giops', 'votemper',
+                                      2212704000, '0', '-5,30')
+        self.tiles = {(x, y): b'png %d %d' % (x, y) for x in (4, 5) for y in (8, 9)}
+
+    def stores(self):
+        return [tile_cache.FilesystemTileStore(os.path.join(self.directory, 'fs')),
+                tile_cache.SQLiteTileStore(os.path.join(self.directory, 'sqlite'))]
+
+    def test_put_get(self):
+        for store in self.stores():
+            self.assertIsNone(store.get(self.layer, 6, 4, 8))
+            self.assertFalse(store.contains(self.layer, 6, 4, 8))
+
+            store.put(self.layer, 6, self.tiles, ttl=24)
+
+            for (x, y), data in self.tiles.items():
+                self.assertEqual(store.get(self.layer, 6, x, y, ttl=24), data)
+                self.assertTrue(store.contains(self.layer, 6, x, y, ttl=24))
+            self.assertIsNone(store.get(self.layer, 7, 4, 8))
+            self.assertIsNone(store.get(self.layer._replace(depth='1'), 6, 4, 8))
+
+    def test_filesystem_layout(self):
+        store = tile_cache.FilesystemTileStore(self.directory)
+        store.put(self.layer, 6, self.tiles)
+
+        path = os.path.join(self.directory, 'api/v1.0/tiles/gaussian/25/10/EPSG:3857/giops/'
+                                            'votemper/2212704000/0/-5,30/6/5/9.png')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'png 5 9')
+
+    def test_sqlite_read_does_not_create_store(self):
+        store = tile_cache.SQLiteTileStore(self.directory)
+
+        self.assertIsNone(store.get(self.layer, 6, 4, 8))
+        self.assertFalse(os.path.exists(store.path('giops', 'votemper', 2212704000)))
+
+    def test_ttl(self):
+        for store in self.stores():
+            store.put(self.layer, 6, self.tiles, ttl=1)
+
+            with patch('time.time', return_value=time.time() + 7200):
+                self.assertIsNone(store.get(self.layer, 6, 4, 8, ttl=1))
+                self.assertFalse(store.contains(self.layer, 6, 5, 9, ttl=1))
+
+    def test_sqlite_expire(self):
+        store = tile_cache.SQLiteTileStore(self.directory)
+        store.put(self.layer, 6, self.tiles, ttl=1)
+        store.put(self.layer, 7, {(0, 0): b'png'})
+
+        self.assertEqual(store.expire(), 0)
+        self.assertEqual(store.expire(time.time() + 7200), 4)
+        self.assertEqual(store.get(self.layer, 7, 0, 0), b'png')
+
+    def test_drop_times(self):
+        for store in self.stores():
+            store.put(self.layer, 6, self.tiles)
+            store.put(self.layer._replace(time=2212790400), 6, self.tiles)
+            store.put(self.layer._replace(dataset='riops'), 6, self.tiles)
+
+            self.assertEqual(store.drop_times('giops', 2212790400), 1)
+
+            self.assertIsNone(store.get(self.layer, 6, 4, 8))
+            self.assertIsNotNone(store.get(self.layer._replace(time=2212790400), 6, 4, 8))
+            self.assertIsNotNone(store.get(self.layer._replace(dataset='riops'), 6, 4, 8))
+
+            # A store dropped and created again is reopened
+            store.put(self.layer, 6, self.tiles)
+            self.assertIsNotNone(store.get(self.layer, 6, 4, 8))
+
+    def test_tile_store_setting(self):
+        settings = {'CACHE_DIR': self.directory}
+        with patch_settings('plotting.tile_cache', settings):
+            self.assertIsInstance(tile_cache.tile_store(), tile_cache.FilesystemTileStore)
+
+            settings['TILE_STORE'] = 'sqlite'
+            store = tile_cache.tile_store()
+            self.assertIsInstance(store, tile_cache.SQLiteTileStore)
+            self.assertEqual(store.directory, os.path.join(self.directory, 'tilestore'))
+            self.assertIs(tile_cache.tile_store(), store)
+
+    def test_write_behind(self):
+        path = os.path.join(self.directory, 'topo', '0', '0.png')
+
+        tile_cache.write_behind(b'png', path)
+        tile_cache._write_queue().join()
+
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'png')
+
+    def test_write_file_from_threads(self):
+        path = os.path.join(self.directory, 'topo', '0', '0.png')
+        tmps = []
+        replace = os.replace
+
+        def record(src, dst):
+            tmps.append(src)
+            replace(src, dst)
+
+        with patch('plotting.tile_cache.os.replace', side_effect=record):
+            tile_cache.write_file(b'png', path)
+            thread = threading.Thread(target=tile_cache.write_file, args=(b'png', path))
+            thread.start()
+            thread.join()
+
+        # The writer thread and a request never share a tmp file
+        self.assertEqual(len(set(tmps)), 2)
+
+    def test_tile_store_is_abstract(self):
+        with self.assertRaises(TypeError):
+            tile_cache.TileStore(self.directory)
+
+    def test_sqlite_connections_are_per_thread(self):
+        store = tile_cache.SQLiteTileStore(self.directory)
+        store.put(self.layer, 6, self.tiles)
+        conn = store._connect(store.path('giops', 'votemper', 2212704000))
+
+        # Other threads evicting their connections don't close this one
+        def evict():
+            for time in range(tile_cache.SQLiteTileStore.CONNECTIONS + 1):
+                store.put(self.layer._replace(time=time), 6, self.tiles)
+
+        thread = threading.Thread(target=evict)
+        thread.start()
+        thread.join()
+
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM tiles").fetchone()[0], 4)
+        self.assertEqual(store.get(self.layer, 6, 4, 8), b'png 4 8')
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+import datetime
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from data.time_index import TimeIndex
+
+
+def _to_datetime(timestamps, units):
+    # Stands in for cftime decoding, which depends on the installed version
+    epoch = datetime.datetime(2000, 1, 1)
+    return [epoch + datetime.timedelta(seconds=int(t)) for t in timestamps]
+
+
+class TestTimeIndex(unittest.TestCase):
+
+    def setUp(self):
+        # Daily timestamps, stored out of order
+        values = np.array([86400 * d for d in [3, 0, 1, 2, 31, 32]])
+        self.index = TimeIndex(values, "seconds since 2000-01-01 00:00:00")
+
+    def test_exact(self):
+        self.assertEqual(self.index.exact(86400 * 2), 2)
+        np.testing.assert_array_equal(self.index.exact([0, 86400 * 3, 5]), [0, 3])
+
+    def test_exact_missing_raises(self):
+        with self.assertRaises(IndexError):
+            self.index.exact(5)
+
+    def test_exact_with_tolerance(self):
+        index = TimeIndex([58000.0, 58000.0416667, 58000.0833333])
+
+        self.assertEqual(index.exact(58000.04166666, rtol=1.e-7), 1)
+
+    def test_exact_truncated(self):
+        # Fractional time values are found by their whole part
+        index = TimeIndex([86400.5, 0.25, 172800.75])
+
+        self.assertEqual(index.exact(86400, truncate=True), 1)
+        np.testing.assert_array_equal(index.exact([0, 172800, 5], truncate=True), [0, 2])
+        with self.assertRaises(IndexError):
+            index.exact(86400)
+        with self.assertRaises(IndexError):
+            index.exact(86401, truncate=True)
+
+    def test_nearest_and_floor(self):
+        self.assertEqual(self.index.nearest(86400 * 10), 3)
+        self.assertEqual(self.index.nearest(86400 * 20), 4)
+        self.assertEqual(self.index.floor(86400 * 20), 3)
+        self.assertEqual(self.index.floor(-1), 0)
+
+    def test_range(self):
+        self.assertEqual(self.index.range(86400, 86400 * 31), slice(1, 5))
+
+    @patch("data.time_index.data.utils.time_index_to_datetime")
+    def test_datetimes_are_decoded_once(self, patch_time_index_to_datetime):
+        patch_time_index_to_datetime.side_effect = _to_datetime
+
+        datetimes = self.index.datetimes
+
+        self.assertEqual(len(datetimes), 6)
+        self.assertEqual(datetimes[4].month, 2)
+        self.assertIs(self.index.datetimes, datetimes)
+        patch_time_index_to_datetime.assert_called_once()
+
+    @patch("data.time_index.data.utils.time_index_to_datetime")
+    def test_first_in_period(self, patch_time_index_to_datetime):
+        patch_time_index_to_datetime.side_effect = _to_datetime
+
+        self.assertEqual(self.index.first_in_period(datetime.datetime(2000, 1, 3), 'day'), 2)
+        self.assertEqual(self.index.first_in_period(datetime.datetime(2000, 2, 15), 'month'), 4)
+        self.assertIsNone(self.index.first_in_period(datetime.datetime(2000, 1, 10), 'day'))
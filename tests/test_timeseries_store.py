@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import netCDF4
+import numpy as np
+import xarray as xr
+
+import data.timeseries_store as timeseries_store
+from data.timeseries_store import (TILE, append_to_store, find_stores, segments, store_path,
+                                   store_times)
+from tests.app_settings import patch_settings
+
+
+class TestTimeseriesStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+        # One file per timestep, as the datasets are indexed
+        self.files = []
+        with xr.open_dataset("tests/testdata/nemo_test.nc", decode_times=False) as ds:
+            self.expected = ds.votemper[:, :3].values
+            for i in range(2):
+                path = os.path.join(self.tmpdir, "nemo_%d.nc" % i)
+                ds.isel(time_counter=[i], deptht=slice(0, 3)).to_netcdf(path)
+                self.files.append(path)
+            self.times = ds.time_counter.values
+
+        self.url = os.path.join(self.tmpdir, "index.sqlite3")
+        self.store = store_path(self.url, 'votemper', os.path.join(self.tmpdir, "stores"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_store_path(self):
+        self.assertTrue(self.store.endswith("votemper"))
+        self.assertIsNone(store_path("dataset.nc", 'votemper', self.tmpdir))
+
+    def test_append(self):
+        self.assertEqual(append_to_store(self.store, 'votemper', self.files[1:]), 1)
+        self.assertEqual(append_to_store(self.store, 'votemper', self.files), 0)
+
+        # Earlier timesteps are never inserted
+        np.testing.assert_array_equal(store_times(self.store), self.times[1:])
+
+    def test_append_incrementally(self):
+        append_to_store(self.store, 'votemper', self.files[:1])
+        append_to_store(self.store, 'votemper', self.files)
+
+        np.testing.assert_array_equal(store_times(self.store), self.times)
+        # Each append is a new segment, the first one isn't copied
+        files = segments(self.store)
+        self.assertEqual([os.path.basename(f) for f in files],
+                         ["00000000-00000000.nc", "00000001-00000001.nc"])
+        with xr.open_mfdataset(files, decode_times=False) as ds:
+            np.testing.assert_array_equal(ds.votemper.values, self.expected)
+            self.assertIn('nav_lat', ds.variables)
+
+        with netCDF4.Dataset(files[1]) as ds:
+            self.assertEqual(ds.variables['votemper'].chunking()[2:], [TILE, TILE])
+            self.assertTrue(ds.dimensions['time_counter'].isunlimited())
+
+    def test_merge_segments(self):
+        with xr.open_dataset("tests/testdata/nemo_test.nc", decode_times=False) as ds:
+            for i in range(2, 4):
+                path = os.path.join(self.tmpdir, "nemo_%d.nc" % i)
+                later = ds.isel(time_counter=[1], deptht=slice(0, 3))
+                later = later.assign_coords(time_counter=later.time_counter + i * 86400)
+                later.to_netcdf(path)
+                self.files.append(path)
+
+        with patch('data.timeseries_store.MERGE_SEGMENTS', 2):
+            for f in self.files:
+                self.assertEqual(append_to_store(self.store, 'votemper', [f]), 1)
+
+            self.assertEqual([os.path.basename(f) for f in segments(self.store)],
+                             ["00000000-00000003.nc"])
+            self.assertEqual(len(store_times(self.store)), 4)
+
+            # Merged segments are kept a while for readers that listed them
+            self.assertEqual(len(os.listdir(self.store)), 8)
+            with patch('time.time', return_value=time.time() + 2 * timeseries_store.SUPERSEDED_GRACE):
+                timeseries_store._remove_superseded(self.store)
+            self.assertEqual(sorted(os.listdir(self.store)), [".lock", "00000000-00000003.nc"])
+
+    def test_find_stores(self):
+        append_to_store(self.store, 'votemper', self.files)
+        settings = {'TIMESERIES_STORE_DIR': os.path.join(self.tmpdir, "stores"),
+                    'TIMESERIES_STORE_MIN_STEPS': 2}
+
+        with patch_settings('data.timeseries_store', settings):
+            self.assertEqual(find_stores(self.url, ['votemper'], list(self.times)),
+                             segments(self.store))
+            # Too short, not covered or no store
+            self.assertIsNone(find_stores(self.url, ['votemper'], list(self.times[:1])))
+            self.assertIsNone(find_stores(self.url, ['votemper'], [self.times[0], 1]))
+            self.assertIsNone(find_stores(self.url, ['votemper', 'vosaline'], list(self.times)))
@@ -0,0 +1,21 @@
+from flask import current_app, has_app_context
+
+
+def get_app_setting(key: str, default=None):
+    """Returns the value of an optional setting from the Flask config
+    (oceannavigator.cfg or OCEANNAVIGATOR_SETTINGS).
+
+    The data layer is also used outside of a request (scripts, unit tests),
+    so the default is returned when there is no application context.
+
+    Arguments:
+        key {str} -- Name of the setting (e.g. GRID_INDEX_CACHE_DIR).
+
+    Keyword Arguments:
+        default -- Value to return if the setting is absent. (default: {None})
+    """
+
+    if not has_app_context():
+        return default
+
+    return current_app.config.get(key, default)
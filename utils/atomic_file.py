@@ -0,0 +1,59 @@
+"""
+Atomic writes of the files shared by the workers (cached tiles, results,
+indexes, job states, subsets).
+
+A file is written aside, to a temporary name unique to the host, process
+and thread writing it, then renamed (or linked) into place, so readers never
+see a partially written file and concurrent writers of the same path never
+share a temporary file.
+"""
+
+import contextlib
+import os
+import socket
+import threading
+
+
+def tmp_path(path: str) -> str:
+    """Returns the temporary name the current thread writes path to.
+    """
+    return "%s.%s.%d.%d.tmp" % (path, socket.gethostname(), os.getpid(),
+                                threading.get_ident())
+
+
+def remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+@contextlib.contextmanager
+def atomic_path(path: str):
+    """Yields the temporary path to write path to. It replaces path when the
+    block succeeds, and is removed when it fails.
+    """
+    tmp = tmp_path(path)
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    except BaseException:
+        remove_quietly(tmp)
+        raise
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = 'wb'):
+    """Opens the temporary file of path for writing (see atomic_path),
+    creating its directory if needed.
+
+    Keyword Arguments:
+        mode {str} -- 'wb' or 'w'. (default: {'wb'})
+    """
+    p = os.path.dirname(path)
+    if p and not os.path.isdir(p):
+        os.makedirs(p, exist_ok=True)
+
+    with atomic_path(path) as tmp:
+        with open(tmp, mode) as f:
+            yield f
@@ -0,0 +1,234 @@
+"""
+Per-request thread budget for the compute-heavy libraries.
+
+Interpolation used to ask pyresample for a fixed 8 (or 4) threads and dask
+used a thread per CPU, in every one of the 8 uwsgi workers of a host, so a
+burst of requests started many more threads than there are cores. Here the
+cores available to the process are shared among the workers that are busy,
+and each request gets that many threads:
+
+    budget = max(1, cores // busy workers)
+
+capped by the COMPUTE_MAX_THREADS setting. Under uwsgi the busy workers are
+counted from the uwsgi worker table. Elsewhere (scripts, tests, the
+development server) the COMPUTE_WORKERS setting (default 1) is used. The
+COMPUTE_CORES setting overrides the number of cores.
+
+The app enters compute_budget() at the start of every request, which only
+sets the budget of the request's thread: code that starts its own threads
+(pyresample's nprocs, thread pools) asks thread_budget(). The limits of
+dask (num_workers) and, when they are installed, of numexpr and of the
+BLAS/OpenMP pools of NumPy (through threadpoolctl) are process-wide, so
+they are only applied around the compute paths (data reads and
+interpolation) by compute_limits(), not for requests that are served from a
+cache. The budget is also sent in the X-Compute-Threads header and metrics()
+reports the utilisation of the process.
+"""
+
+import os
+import sys
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+import dask
+
+from utils.app_config import get_app_setting
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+try:
+    from threadpoolctl import ThreadpoolController
+except ImportError:
+    ThreadpoolController = None
+
+DEFAULT_WORKERS = 1
+
+
+def available_cores() -> int:
+    """Returns the number of cores the process may run on (the
+    COMPUTE_CORES setting overrides it).
+    """
+    cores = get_app_setting('COMPUTE_CORES')
+    if cores:
+        return int(cores)
+
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def active_workers() -> int:
+    """Returns the number of workers sharing the cores: the busy uwsgi
+    workers, or the COMPUTE_WORKERS setting outside of uwsgi.
+    """
+    # The uwsgi module only exists in processes run by uwsgi (importing it
+    # elsewhere would load the uwsgi.py entry point instead).
+    uwsgi = sys.modules.get('uwsgi')
+    if uwsgi is not None and hasattr(uwsgi, 'workers'):
+        try:
+            busy = sum(1 for w in uwsgi.workers() if w.get('status') == 'busy')
+            return max(1, busy)
+        except Exception:
+            pass
+
+    return max(1, int(get_app_setting('COMPUTE_WORKERS', DEFAULT_WORKERS)))
+
+
+def _compute_budget() -> int:
+    threads = max(1, available_cores() // active_workers())
+
+    limit = get_app_setting('COMPUTE_MAX_THREADS')
+    if limit:
+        threads = min(threads, int(limit))
+
+    return threads
+
+
+def thread_budget() -> int:
+    """Returns the number of threads the current request may use.
+    """
+    budget = getattr(_local, 'threads', None)
+    if budget is not None:
+        return budget
+
+    return _compute_budget()
+
+
+class _Metrics:
+    """Utilisation counters of the process."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.budgets = 0
+        self.active = 0
+        self.threads_in_use = 0
+        self.peak_threads = 0
+        self.thread_seconds = 0.0
+
+    def enter(self, threads: int) -> None:
+        with self._lock:
+            self.budgets += 1
+            self.active += 1
+            self.threads_in_use += threads
+            self.peak_threads = max(self.peak_threads, self.threads_in_use)
+
+    def exit(self, threads: int, elapsed: float) -> None:
+        with self._lock:
+            self.active -= 1
+            self.threads_in_use -= threads
+            self.thread_seconds += threads * elapsed
+
+    def info(self) -> dict:
+        with self._lock:
+            cores = available_cores()
+            uptime = time.time() - self.started
+            return {
+                'pid': os.getpid(),
+                'cores': cores,
+                'workers': active_workers(),
+                'budgets': self.budgets,
+                'active': self.active,
+                'threads_in_use': self.threads_in_use,
+                'peak_threads': self.peak_threads,
+                'thread_seconds': self.thread_seconds,
+                # Share of the cores' time granted to requests of this process
+                'utilisation': self.thread_seconds / (cores * uptime) if uptime > 0 else 0.0,
+            }
+
+
+_metrics = _Metrics()
+_local = threading.local()
+
+
+def metrics() -> dict:
+    """Returns the thread budget utilisation counters of the process.
+    """
+    return _metrics.info()
+
+
+@contextmanager
+def compute_budget(threads: int = None):
+    """Sets the thread budget of the current thread for the duration of the
+    block (see thread_budget).
+
+    Keyword Arguments:
+        threads {int} -- The budget. (default: {computed from the busy workers})
+
+    Yields:
+        int -- The budget.
+    """
+    if threads is None:
+        threads = _compute_budget()
+
+    previous = getattr(_local, 'threads', None)
+    _local.threads = threads
+    _metrics.enter(threads)
+    start = time.time()
+
+    try:
+        yield threads
+    finally:
+        _local.threads = previous
+        _metrics.exit(threads, time.time() - start)
+
+
+_controller = None
+_limits_lock = threading.Lock()
+_limits_users = 0
+_limits = None
+
+
+def _threadpool_controller():
+    global _controller
+
+    # Scanning the loaded libraries is slow, it is only done once
+    if _controller is None and ThreadpoolController is not None:
+        _controller = ThreadpoolController()
+
+    return _controller
+
+
+def _apply_limits(threads: int) -> ExitStack:
+    stack = ExitStack()
+    stack.enter_context(dask.config.set(num_workers=threads))
+    controller = _threadpool_controller()
+    if controller is not None:
+        stack.enter_context(controller.limit(limits=threads))
+    if numexpr is not None:
+        old = numexpr.set_num_threads(threads)
+        stack.callback(numexpr.set_num_threads, old)
+
+    return stack
+
+
+@contextmanager
+def compute_limits():
+    """Limits dask, numexpr and the BLAS/OpenMP pools to the thread budget
+    for the duration of a compute.
+
+    The limits are process-wide, so the computes that overlap (threads of a
+    worker, or nested blocks) share the limits applied by the first one, and
+    they are restored when the last one ends. It may also decorate a
+    function, as @compute_limits().
+    """
+    global _limits_users, _limits
+
+    with _limits_lock:
+        if _limits_users == 0:
+            _limits = _apply_limits(thread_budget())
+        _limits_users += 1
+
+    try:
+        yield
+    finally:
+        with _limits_lock:
+            _limits_users -= 1
+            if _limits_users == 0:
+                limits, _limits = _limits, None
+                limits.close()
@@ -0,0 +1,274 @@
+"""
+Coalescing of identical render requests across the workers of a host.
+
+When a map view opens, several tabs and users ask for the same missing
+tiles, scales, colormap image and plots at once, and every uwsgi worker used
+to render its own copy. Here a render is keyed by the normalized identity of
+the request (request_key), and takes an flock on a lock file shared by all
+the processes of the host. The first request renders and caches the result;
+identical requests wait for the lock, then read the cached result. A request
+that waits more than SINGLE_FLIGHT_TIMEOUT seconds (default 60) renders on
+its own.
+
+coalesce() does this for results that have their own cache (the tile
+store), and memoize() for the rest, whose results are pickled in
+SINGLE_FLIGHT_DIR (default CACHE_DIR/single_flight) for a given time.
+Results older than SINGLE_FLIGHT_MAX_AGE seconds (default 86400) are removed
+by purge(), which memoize() runs in the background every PURGE_INTERVAL
+seconds, so the directory stays bounded without a cron job. The lock files
+are striped (LOCK_STRIPES), not one per request.
+
+metrics() reports the coalescing rate of the process, by kind of request.
+"""
+
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+import zlib
+from typing import Callable
+
+from utils.app_config import get_app_setting
+from utils.atomic_file import atomic_write
+
+logger = logging.getLogger(__name__)
+
+LOCK_STRIPES = 4096
+DEFAULT_TIMEOUT = 60
+DEFAULT_MAX_AGE = 86400
+PURGE_INTERVAL = 3600
+
+
+def request_key(*parts) -> str:
+    """Returns the identity of a request made of JSON serializable parts,
+    independent of the order of the keys of dicts.
+    """
+    return hashlib.sha1(
+        json.dumps(parts, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def _directory() -> str:
+    directory = get_app_setting('SINGLE_FLIGHT_DIR')
+    if directory:
+        return directory
+
+    cache_dir = get_app_setting('CACHE_DIR') or tempfile.gettempdir()
+    return os.path.join(cache_dir, "single_flight")
+
+
+def _lock_path(key: str) -> str:
+    stripe = zlib.crc32(key.encode()) % LOCK_STRIPES
+    return os.path.join(_directory(), ".locks", "%d.lock" % stripe)
+
+
+@contextlib.contextmanager
+def lock(key: str, timeout: float = None):
+    """Holds the lock of a key, shared by all the processes of the host.
+
+    Keyword Arguments:
+        timeout {float} -- Seconds to wait for the lock. (default: {no limit})
+
+    Yields:
+        bool -- False if the lock wasn't acquired in time.
+    """
+    path = _lock_path(key)
+    p = os.path.dirname(path)
+    if not os.path.isdir(p):
+        os.makedirs(p, exist_ok=True)
+
+    with open(path, 'a') as f:
+        if timeout is None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            acquired = True
+        else:
+            # flock can't time out, poll it
+            deadline = time.monotonic() + timeout
+            delay = 0.005
+            while True:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    acquired = True
+                    break
+                except OSError as e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                if time.monotonic() >= deadline:
+                    acquired = False
+                    break
+                time.sleep(delay)
+                delay = min(delay * 2, 0.1)
+
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class _Metrics:
+    """Coalescing counters of the process, by kind of request."""
+
+    FIELDS = ('requests', 'hits', 'rendered', 'coalesced', 'timeouts')
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.kinds = {}
+
+    def count(self, kind: str, field: str) -> None:
+        with self._lock:
+            counts = self.kinds.setdefault(kind, dict.fromkeys(self.FIELDS, 0))
+            counts['requests'] += 1
+            counts[field] += 1
+
+    def info(self) -> dict:
+        with self._lock:
+            kinds = {}
+            for kind, counts in self.kinds.items():
+                kinds[kind] = dict(counts)
+                # Share of the requests served by another request's render
+                kinds[kind]['coalescing_rate'] = counts['coalesced'] / counts['requests']
+
+            return {
+                'pid': os.getpid(),
+                'kinds': kinds,
+            }
+
+
+_metrics = _Metrics()
+
+
+def metrics() -> dict:
+    """Returns the coalescing counters of the process.
+    """
+    return _metrics.info()
+
+
+def coalesce(kind: str, key: str, lookup: Callable, render: Callable, timeout: float = None):
+    """Returns the cached result of a request, or renders it once for all
+    the identical requests of the host.
+
+    Arguments:
+        kind {str} -- The kind of request, for metrics().
+        key {str} -- The identity of the request (see request_key).
+        lookup {callable} -- Returns the cached result, or None.
+        render {callable} -- Renders, caches and returns the result.
+
+    Keyword Arguments:
+        timeout {float} -- Seconds to wait for an identical request.
+                           (default: {the SINGLE_FLIGHT_TIMEOUT setting})
+    """
+    result = lookup()
+    if result is not None:
+        _metrics.count(kind, 'hits')
+        return result
+
+    if timeout is None:
+        timeout = float(get_app_setting('SINGLE_FLIGHT_TIMEOUT', DEFAULT_TIMEOUT))
+
+    with lock(key, timeout) as acquired:
+        if acquired:
+            result = lookup()
+            if result is not None:
+                _metrics.count(kind, 'coalesced')
+                return result
+        else:
+            logger.warning("Timed out waiting for %s %s, rendering it again.", kind, key)
+
+        result = render()
+        _metrics.count(kind, 'rendered' if acquired else 'timeouts')
+        return result
+
+
+def _result_path(kind: str, key: str) -> str:
+    return os.path.join(_directory(), kind, key[:2], key)
+
+
+def _read_result(path: str, ttl: float):
+    try:
+        with open(path, 'rb') as f:
+            if time.time() - os.fstat(f.fileno()).st_mtime > ttl:
+                return None
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def _write_result(path: str, result) -> None:
+    with atomic_write(path) as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+_last_purge = time.monotonic()
+_purge_lock = threading.Lock()
+
+
+def _purge_in_background() -> None:
+    global _last_purge
+
+    with _purge_lock:
+        if time.monotonic() - _last_purge < PURGE_INTERVAL:
+            return
+        _last_purge = time.monotonic()
+
+    max_age = float(get_app_setting('SINGLE_FLIGHT_MAX_AGE', DEFAULT_MAX_AGE))
+    threading.Thread(target=purge, args=(max_age,), daemon=True).start()
+
+
+def memoize(kind: str, key: str, render: Callable, ttl: float, timeout: float = None):
+    """Returns the result of a request rendered in the last ttl seconds, or
+    renders it once for all the identical requests of the host.
+
+    Arguments:
+        kind {str} -- The kind of request, for metrics().
+        key {str} -- The identity of the request (see request_key).
+        render {callable} -- Returns the result (picklable, not None).
+        ttl {float} -- Seconds the result is reused for.
+    """
+    path = _result_path(kind, key)
+
+    def render_and_cache():
+        result = render()
+        try:
+            _write_result(path, result)
+        except OSError:
+            logger.exception("Unable to cache %s %s.", kind, key)
+        _purge_in_background()
+        return result
+
+    return coalesce(kind, key, lambda: _read_result(path, ttl), render_and_cache, timeout)
+
+
+def purge(max_age: float = None) -> int:
+    """Removes the memoized results older than max_age seconds, returning
+    how many were removed.
+
+    Keyword Arguments:
+        max_age {float} -- (default: {the SINGLE_FLIGHT_MAX_AGE setting})
+    """
+    if max_age is None:
+        max_age = float(get_app_setting('SINGLE_FLIGHT_MAX_AGE', DEFAULT_MAX_AGE))
+
+    directory = _directory()
+    now = time.time()
+    removed = 0
+    for root, dirs, files in os.walk(directory):
+        if root == directory and ".locks" in dirs:
+            dirs.remove(".locks")
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                if now - os.stat(path).st_mtime > max_age:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+
+    return removed